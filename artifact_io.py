@@ -0,0 +1,310 @@
+"""
+キャッシュ・成果物の圧縮入出力
+
+pickle の成果物（embed_cache_*.pkl, keyword_embed_*.pkl, embeddings_*.pkl など）は、ファイル名はそのままで
+中身を zstd（なければ gzip）で圧縮して書く。読み込み側は先頭のマジックバイトで形式を判別し、
+展開しながら unpickle するので、従来の非圧縮ファイルもそのまま読める。
+
+大きな配列・テキストは「チャンク形式」で書く。ブロックごとに独立した圧縮フレームを並べ、
+末尾に各フレームの位置を置くので、全体を展開せずに先頭から順に、または任意のブロックだけを読める。
+
+静的ホスティング向けに、HTML / JSON / JS の .gz と .br（brotli がある場合）を事前に作ることもできる。
+
+圧縮方式は環境変数 ARTIFACT_COMPRESSION（zstd / gzip / none）で指定する。
+zstandard / brotli は任意の依存なので、未指定なら none（従来どおり非圧縮）で書く。
+python artifact_io.py や VectorStore.pack のように明示的に圧縮する操作では、
+未指定なら zstandard があれば zstd、なければ gzip を使う。
+"""
+import contextlib
+import gzip
+import io
+import json
+import os
+import pickle
+import shutil
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_MAGIC = b"SMVCHNK1"
+CODECS = ("zstd", "gzip", "none")
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+PRECOMPRESS_SUFFIXES = (".html", ".json", ".js")
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _require_zstd():
+    zstd = _zstd()
+    if zstd is None:
+        raise RuntimeError("zstd 形式の読み書きには zstandard が必要です: pip install zstandard")
+    return zstd
+
+
+def _env_codec():
+    codec = os.getenv("ARTIFACT_COMPRESSION")
+    if codec and codec not in CODECS:
+        raise ValueError(f"不明な圧縮方式: {codec} (指定可能: {CODECS})")
+    return codec
+
+
+def default_codec():
+    """通常の書き込みの圧縮方式（ARTIFACT_COMPRESSION で指定しなければ非圧縮）"""
+    return _env_codec() or "none"
+
+
+def compress_codec():
+    """明示的に圧縮する操作の圧縮方式（ARTIFACT_COMPRESSION、なければ zstd か gzip）"""
+    return _env_codec() or ("zstd" if _zstd() is not None else "gzip")
+
+
+# ─── 単一ストリーム（pickle など） ──────────────────────────
+@contextlib.contextmanager
+def open_write(path, codec=None):
+    """
+    圧縮して書き込むバイナリストリーム。一時ファイルに書いてから置き換えるので、
+    途中で失敗しても既存のファイルは壊れない
+    """
+    codec = codec or default_codec()
+    path = Path(path)
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}-{threading.get_ident()}")
+    try:
+        with open(tmp, "wb") as raw:
+            if codec == "zstd":
+                with _require_zstd().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False) as f:
+                    yield f
+            elif codec == "gzip":
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as f:
+                    yield f
+            else:
+                yield raw
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+@contextlib.contextmanager
+def open_read(path):
+    """先頭のマジックバイトで圧縮形式を判別し、展開しながら読むバイナリストリーム"""
+    with open(path, "rb") as raw:
+        head = raw.read(4)
+        raw.seek(0)
+        if head.startswith(ZSTD_MAGIC):
+            with _require_zstd().ZstdDecompressor().stream_reader(raw, closefd=False) as f:
+                # pickle.load は peek/readline を使うのでバッファを挟む
+                yield io.BufferedReader(f)
+        elif head.startswith(GZIP_MAGIC):
+            with gzip.GzipFile(fileobj=raw, mode="rb") as f:
+                yield f
+        else:
+            yield raw
+
+
+def dump_pickle(obj, path, codec=None):
+    with open_write(path, codec) as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_pickle(path):
+    with open_read(path) as f:
+        return pickle.load(f)
+
+
+def codec_of(path):
+    """ファイルの圧縮形式（zstd / gzip / chunked / none）"""
+    with open(path, "rb") as f:
+        head = f.read(len(CHUNK_MAGIC))
+    if head.startswith(ZSTD_MAGIC):
+        return "zstd"
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head == CHUNK_MAGIC:
+        return "chunked"
+    return "none"
+
+
+# ─── チャンク形式 ───────────────────────────────────────
+# [CHUNK_MAGIC][フレーム 0][フレーム 1]...[索引 JSON][索引の長さ (uint64 LE)]
+# 索引: {"codec", "offsets", "sizes", "raw_sizes", "meta"}。フレームは互いに独立して展開できる
+def _compressor(codec):
+    if codec == "zstd":
+        return _require_zstd().ZstdCompressor(level=ZSTD_LEVEL).compress
+    if codec == "gzip":
+        return lambda data: zlib.compress(data, GZIP_LEVEL)
+    return bytes
+
+
+def _decompressor(codec):
+    if codec == "zstd":
+        return _require_zstd().ZstdDecompressor().decompress
+    if codec == "gzip":
+        return zlib.decompress
+    return bytes
+
+
+def write_chunks(path, chunks, codec=None, meta=None):
+    """bytes のイテラブルを 1 チャンク 1 フレームで書き出し、チャンク数を返す"""
+    codec = codec or default_codec()
+    compress = _compressor(codec)
+    index = {"codec": codec, "offsets": [], "sizes": [], "raw_sizes": [], "meta": {} if meta is None else meta}
+    with open_write(path, "none") as f:
+        f.write(CHUNK_MAGIC)
+        pos = len(CHUNK_MAGIC)
+        for data in chunks:
+            frame = compress(data)
+            f.write(frame)
+            index["offsets"].append(pos)
+            index["sizes"].append(len(frame))
+            index["raw_sizes"].append(len(data))
+            pos += len(frame)
+        footer = json.dumps(index).encode("utf-8")
+        f.write(footer)
+        f.write(struct.pack("<Q", len(footer)))
+    return len(index["offsets"])
+
+
+def chunk_index(path):
+    with open(path, "rb") as f:
+        if f.read(len(CHUNK_MAGIC)) != CHUNK_MAGIC:
+            raise ValueError(f"チャンク形式のファイルではありません: {path}")
+        f.seek(-8, os.SEEK_END)
+        (length,) = struct.unpack("<Q", f.read(8))
+        f.seek(-8 - length, os.SEEK_END)
+        return json.loads(f.read(length))
+
+
+def iter_chunks(path, indices=None):
+    """チャンクを 1 つずつ展開して返す。indices を指定するとそのチャンクだけを読む"""
+    index = chunk_index(path)
+    decompress = _decompressor(index["codec"])
+    targets = range(len(index["offsets"])) if indices is None else indices
+    with open(path, "rb") as f:
+        for i in targets:
+            f.seek(index["offsets"][i])
+            with metrics.span("store.read", artifact="chunked"):
+                yield decompress(f.read(index["sizes"][i]))
+
+
+def write_array_chunks(path, blocks, codec=None):
+    """同じ dtype・列数の ndarray ブロックを行ブロックごとのチャンクとして書く"""
+    # 索引は全チャンクを書いた後に書くので、dtype・行数は書きながら集めればよい
+    info = {"block_rows": []}
+
+    def frames():
+        for block in blocks:
+            block = np.ascontiguousarray(block)
+            info.setdefault("dtype", block.dtype.str)
+            info.setdefault("row_shape", list(block.shape[1:]))
+            info["block_rows"].append(len(block))
+            yield block.tobytes()
+
+    return write_chunks(path, frames(), codec, info)
+
+
+def iter_array_chunks(path, indices=None):
+    """(開始行, ndarray) をチャンクごとに返す"""
+    index = chunk_index(path)
+    meta = index["meta"]
+    if not meta.get("block_rows"):
+        return
+    dtype, row_shape = np.dtype(meta["dtype"]), tuple(meta["row_shape"])
+    starts = np.concatenate([[0], np.cumsum(meta["block_rows"])]).astype(int)
+    targets = list(range(len(starts) - 1)) if indices is None else list(indices)
+    for i, data in zip(targets, iter_chunks(path, targets)):
+        yield int(starts[i]), np.frombuffer(data, dtype=dtype).reshape((-1, *row_shape))
+
+
+# ─── 静的ホスティング用の事前圧縮 ─────────────────────────────
+def precompress(path, formats=("gz", "br")):
+    """
+    path の隣に path.gz / path.br を書き、書いたファイルのリストを返す。
+    brotli がなければ .br は作らない。元ファイルより新しい圧縮版があれば作り直さない
+    """
+    path = Path(path)
+    written = []
+    for fmt in formats:
+        out = path.with_name(path.name + "." + fmt)
+        if out.exists() and out.stat().st_mtime >= path.stat().st_mtime:
+            continue
+        if fmt == "gz":
+            with metrics.span("artifact.precompress", format=fmt), open(path, "rb") as src, \
+                    open_write(out, "none") as raw, \
+                    gzip.GzipFile(filename=path.name, fileobj=raw, mode="wb", compresslevel=9, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        elif fmt == "br":
+            try:
+                import brotli
+            except ImportError:
+                continue
+            compressor = brotli.Compressor(quality=11)
+            with metrics.span("artifact.precompress", format=fmt), open(path, "rb") as src, open_write(out, "none") as dst:
+                for data in iter(lambda: src.read(1 << 20), b""):
+                    dst.write(compressor.process(data))
+                dst.write(compressor.finish())
+        else:
+            raise ValueError(f"不明な事前圧縮形式: {fmt}")
+        written.append(out)
+    return written
+
+
+def precompress_tree(root, suffixes=PRECOMPRESS_SUFFIXES, formats=("gz", "br"), recursive=True):
+    """root（recursive なら配下すべて）の suffixes のファイルを事前圧縮し、書いたファイル数を返す"""
+    root = Path(root)
+    if root.is_file():
+        paths = [root]
+    else:
+        paths = sorted(p for p in (root.rglob("*") if recursive else root.iterdir()) if p.is_file() and p.suffix in suffixes)
+    written = 0
+    for path in paths:
+        written += len(precompress(path, formats))
+    metrics.incr("precompressed_files", written)
+    return written
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="data/<folder> の pickle 成果物を圧縮し、HTML などの .gz/.br を作ります")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--codec", choices=CODECS, help="pickle の圧縮方式（省略時は ARTIFACT_COMPRESSION、なければ zstd か gzip）")
+    parser.add_argument("--precompress", action="store_true", help="HTML / JSON / JS の .gz / .br を作る")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    codec = args.codec or compress_codec()
+    before = after = 0
+    for path in sorted(base_dir.glob("*.pkl")):
+        if codec_of(path) == codec:
+            continue
+        size = path.stat().st_size
+        dump_pickle(load_pickle(path), path, codec)
+        before += size
+        after += path.stat().st_size
+        print(f"  🗜️ {path.name}: {size / 1024:.0f} KB → {path.stat().st_size / 1024:.0f} KB")
+    if before:
+        print(f"✅ pickle を {codec} で書き直しました: {before / 1024 ** 2:.1f} MB → {after / 1024 ** 2:.1f} MB")
+    if args.precompress:
+        # フォルダ直下の HTML / JSON とタイル（ストアやキャッシュの中身は配信しないので対象外）
+        n = precompress_tree(base_dir, recursive=False)
+        if (base_dir / "tiles").exists():
+            n += precompress_tree(base_dir / "tiles")
+        print(f"✅ {n} 個の事前圧縮ファイルを作成しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+"""
+Batch API を使ったオフラインの一括埋め込み（夜間バッチ向け）
+
+args.csv を JSONL の埋め込み要求に変換してバッチジョブとして投入し、完了を待って結果をストアへ取り込む。
+進捗は data/<folder>/batch_jobs/ に保存するので、中断しても再実行すれば続きから進む:
+
+    state.json                     ジョブの一覧と状態
+    requests_<job>.jsonl           投入した要求（custom_id = "<job>:<要求番号>"）
+    rows_<job>.npy                 ジョブの要求が対象とする行番号（args.csv 上の位置）
+    output_<job>.jsonl / errors_<job>.jsonl   ダウンロードした結果
+    vectors_<model>.f32            取り込んだベクトル（args.csv の行順）
+    done_<model>.npy               行ごとの取り込み済みフラグ
+    invalid_<model>.npy            行ごとの隔離フラグ（ゼロベクトルで埋めた行。ストアに無効な行として記録する）
+
+1 ジョブの入力数は Batch API の上限（MAX_INPUTS_PER_BATCH）以下に抑える。
+投入の前に state.json へ submitting と記録し、batch_id を保存する前に中断していたら、
+metadata {"job": <job>} と入力ファイルで投入済みのバッチを探してから投入し直す（二重投入しない）。
+結果は custom_id と data[].index で行に対応づける（出力の行順には依存しない）。
+失敗・期限切れで欠けた行は、1 要求あたりの入力数を減らして次のラウンドで投入し直す。
+max_rounds を超えて残った行は、--realtime-fallback ならリアルタイム API で埋め込み、
+そうでなければゼロベクトルにして quarantine.jsonl に記録する。
+Batch API のないローカルモデルは、最後にストアへ書き出すときにその場で埋め込む。
+
+    python batch_embed.py run sample                        # 1 回だけ進めて終了（cron から繰り返し呼ぶ）
+    python batch_embed.py run sample --wait --interval 300  # 完了まで待つ
+    python batch_embed.py run sample --backend stub --wait  # FileBatchStub で動作確認
+    python batch_embed.py status sample
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from embed_items import LOCAL_MODELS, MODELS, embed_batch, invalid_rows, write_quarantine
+from llm import BATCH_TERMINAL_STATUSES, preload_local_models
+from vector_store import VectorStore, model_key
+
+BATCH_DIRNAME = "batch_jobs"
+BATCH_MODELS = [m for m in MODELS if m.startswith("openai/")]
+# Batch API の /v1/embeddings は 1 バッチあたりの入力数の合計が 50,000 まで
+MAX_INPUTS_PER_BATCH = 50_000
+
+
+def batch_dir(base_dir):
+    return Path(base_dir) / BATCH_DIRNAME
+
+
+def _csv_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1 << 20), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def _read_texts(base_dir):
+    return pd.read_csv(Path(base_dir) / "args.csv")["argument"].astype(str).tolist()
+
+
+def read_state(base_dir):
+    path = batch_dir(base_dir) / "state.json"
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_state(base_dir, state):
+    path = batch_dir(base_dir) / "state.json"
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def make_backend(kind, model_name, base_dir, stub_config=None, stub_polls=2):
+    """バッチ API の実装（"openai" は OpenAI / Azure の Batch API、"stub" はファイルベースの代役）"""
+    if kind == "openai":
+        from llm import EmbeddingBatchAPI
+
+        return EmbeddingBatchAPI(model_name.replace("openai/", ""))
+    if kind == "stub":
+        from embedding_stub_server import FileBatchStub
+
+        return FileBatchStub(batch_dir(base_dir) / "stub", stub_config, stub_polls)
+    raise ValueError(f"不明なバックエンド: {kind}")
+
+
+# ─── 要求の作成 ────────────────────────────────────────
+def _add_jobs(base_dir, state, key, rows, texts, api_model, inputs_per_request, requests_per_file):
+    """rows の行を埋め込む要求ファイルを書き、ジョブとして state に追加する"""
+    entry = state["models"][key]
+    bdir = batch_dir(base_dir)
+    # 1 ジョブの入力数が上限を超えないよう、要求数を減らす（要求の大きさはそのまま）
+    inputs_per_request = min(inputs_per_request, MAX_INPUTS_PER_BATCH)
+    rows_per_file = inputs_per_request * min(requests_per_file, MAX_INPUTS_PER_BATCH // inputs_per_request)
+    for start in range(0, len(rows), rows_per_file):
+        name = f"{key}_{len(entry['jobs'])}"
+        job_rows = np.asarray(rows[start:start + rows_per_file], dtype=np.int64)
+        np.save(bdir / f"rows_{name}.npy", job_rows)
+        n_requests = 0
+        with open(bdir / f"requests_{name}.jsonl", "w", encoding="utf-8") as f:
+            for i in range(0, len(job_rows), inputs_per_request):
+                body = {
+                    "model": api_model,
+                    "input": [texts[r] for r in job_rows[i:i + inputs_per_request]],
+                    # base64 の方が JSON の浮動小数点列より結果ファイルが小さく、読み込みも速い
+                    "encoding_format": "base64",
+                }
+                request = {"custom_id": f"{name}:{n_requests}", "method": "POST", "url": "/v1/embeddings", "body": body}
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+                n_requests += 1
+        entry["jobs"].append({
+            "name": name,
+            "round": entry["round"],
+            "inputs_per_request": inputs_per_request,
+            "rows": len(job_rows),
+            "requests": n_requests,
+            "status": "prepared",
+            "file_id": None,
+            "batch_id": None,
+            "output_file_id": None,
+            "error_file_id": None,
+        })
+
+
+def init_jobs(base_dir, backend="openai", models=BATCH_MODELS, inputs_per_request=256, requests_per_file=1000, **backend_kwargs):
+    """batch_jobs/ を作り直し、全行分の要求ファイルを書く"""
+    bdir = batch_dir(base_dir)
+    if bdir.exists():
+        shutil.rmtree(bdir)
+    bdir.mkdir(parents=True)
+    texts = _read_texts(base_dir)
+    state = {
+        "backend": backend,
+        "csv_sha1": _csv_digest(Path(base_dir) / "args.csv"),
+        "rows": len(texts),
+        "created": time.time(),
+        "finalized": False,
+        "requests_per_file": requests_per_file,
+        "models": {},
+    }
+    all_rows = np.arange(len(texts))
+    for model_name in models:
+        key = model_key(model_name)
+        api = make_backend(backend, model_name, base_dir, **backend_kwargs)
+        state["models"][key] = {
+            "model": model_name,
+            "api_model": getattr(api, "model", model_name.replace("openai/", "")),
+            "dim": None,
+            "round": 0,
+            "exhausted": False,
+            "jobs": [],
+        }
+        _add_jobs(base_dir, state, key, all_rows, texts, state["models"][key]["api_model"], inputs_per_request, requests_per_file)
+    _write_state(base_dir, state)
+    return state
+
+
+# ─── 取り込み ──────────────────────────────────────────
+def _load_flags(base_dir, kind, key, n):
+    path = batch_dir(base_dir) / f"{kind}_{key}.npy"
+    return np.load(path) if path.exists() else np.zeros(n, dtype=bool)
+
+
+def _save_flags(base_dir, kind, key, flags):
+    path = batch_dir(base_dir) / f"{kind}_{key}.npy"
+    tmp = path.with_name(path.stem + ".tmp.npy")
+    np.save(tmp, flags)
+    os.replace(tmp, path)
+
+
+def _vectors(base_dir, key, n, dim):
+    path = batch_dir(base_dir) / f"vectors_{key}.f32"
+    if not path.exists():
+        with open(path, "wb") as f:
+            f.truncate(n * dim * 4)
+    return np.memmap(path, dtype=np.float32, mode="r+", shape=(n, dim))
+
+
+def _decode(embedding):
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype="<f4")
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def ingest_job(base_dir, state, key, job):
+    """
+    ダウンロード済みの結果をベクトルファイルに書き、取り込んだ行数を返す。
+    同じ結果を何度取り込んでも結果は変わらない（中断後の再実行で二重に書いても問題ない）
+    """
+    entry = state["models"][key]
+    bdir = batch_dir(base_dir)
+    n = state["rows"]
+    rows = np.load(bdir / f"rows_{job['name']}.npy")
+    per_request = job["inputs_per_request"]
+    done = _load_flags(base_dir, "done", key, n)
+    vectors = None
+    ingested = failed = 0
+    errors = {}
+
+    output = bdir / f"output_{job['name']}.jsonl"
+    with metrics.span("batch.ingest", model=key):
+        if output.exists():
+            with open(output, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    name, _, index = result["custom_id"].rpartition(":")
+                    response = result.get("response") or {}
+                    if name != job["name"] or response.get("status_code") != 200:
+                        failed += 1
+                        continue
+                    request_rows = rows[int(index) * per_request:(int(index) + 1) * per_request]
+                    data = response["body"]["data"]
+                    # 件数が合わない応答は行に対応づけられないので、要求ごと取り込まない（次のラウンドで再投入）
+                    if len(data) != len(request_rows):
+                        failed += 1
+                        errors.setdefault("mismatch", f"{len(data)} != {len(request_rows)}")
+                        continue
+                    # index が範囲外・重複している応答も同じく要求ごと取り込まない
+                    indices = sorted(item.get("index", -1) for item in data)
+                    if indices != list(range(len(request_rows))):
+                        failed += 1
+                        errors.setdefault("index", f"data[].index が 0..{len(request_rows) - 1} に対応していません")
+                        continue
+                    for item in data:
+                        vec = _decode(item["embedding"])
+                        if vectors is None:
+                            if entry["dim"] is None:
+                                entry["dim"] = int(len(vec))
+                            vectors = _vectors(base_dir, key, n, entry["dim"])
+                        row = request_rows[item["index"]]
+                        vectors[row] = vec
+                        done[row] = True
+                    ingested += len(data)
+
+        error_path = bdir / f"errors_{job['name']}.jsonl"
+        if error_path.exists():
+            with open(error_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        result = json.loads(line)
+                        failed += 1
+                        body = (result.get("response") or {}).get("body") or {}
+                        message = (body.get("error") or result.get("error") or {}).get("message", "")
+                        errors.setdefault(str((result.get("response") or {}).get("status_code")), message)
+
+    if vectors is not None:
+        vectors.flush()
+    _save_flags(base_dir, "done", key, done)
+    metrics.incr("batch_rows_ingested", ingested, model=key)
+    metrics.incr("batch_requests_failed", failed, model=key)
+    job.update(status="ingested", ingested_rows=ingested, failed_requests=failed, errors=errors)
+    return ingested
+
+
+def _fill_leftovers(base_dir, state, key, texts, realtime_fallback, batch_size=100):
+    """
+    最後のラウンドでも埋まらなかった行を、リアルタイム API またはゼロベクトル + quarantine で埋める。
+    バッチ結果が 1 件もなく次元数がわからないときは、リアルタイム API の結果から次元数を決める。
+    リアルタイム API を使わなければ、ローカルモデルの失敗と同じくモデルを failed にする（finalize でストアから外す）
+    """
+    entry = state["models"][key]
+    n = state["rows"]
+    if entry["dim"] is None and not realtime_fallback:
+        metrics.incr("model_failures", model=entry["model"])
+        entry["failed"] = True
+        entry["exhausted"] = True
+        return 0
+    done = _load_flags(base_dir, "done", key, n)
+    invalid = _load_flags(base_dir, "invalid", key, n)
+    missing = np.flatnonzero(~done)
+    vectors = None
+    last_error = next((str(e) for job in reversed(entry["jobs"]) for e in job.get("errors", {}).values()), "")
+    for i in range(0, len(missing), batch_size):
+        rows = missing[i:i + batch_size]
+        if realtime_fallback:
+            bad_items = []
+            embedded = embed_batch([texts[r] for r in rows], entry["model"], bad_items, entry["dim"])
+            if entry["dim"] is None:
+                entry["dim"] = int(embedded.shape[1])
+            vectors = vectors if vectors is not None else _vectors(base_dir, key, n, entry["dim"])
+            vectors[rows] = embedded
+            bad_items = [{**item, "index": int(rows[item["index"]])} for item in bad_items]
+        else:
+            vectors = vectors if vectors is not None else _vectors(base_dir, key, n, entry["dim"])
+            vectors[rows] = 0.0
+            bad_items = [{"index": int(r), "text": texts[r], "error": f"batch: {last_error}"} for r in rows]
+        write_quarantine(base_dir, entry["model"], 0, bad_items)
+        invalid[[item["index"] for item in bad_items]] = True
+        done[rows] = True
+    if vectors is not None:
+        vectors.flush()
+    _save_flags(base_dir, "invalid", key, invalid)
+    _save_flags(base_dir, "done", key, done)
+    entry["exhausted"] = True
+    return len(missing)
+
+
+# ─── ストアへの書き出し ────────────────────────────────────
+def finalize(base_dir, state, include_local=True, chunk_size=1024):
+    """バッチ結果（と、ローカルモデルの埋め込み）をフォルダのストアへ書く（failed のモデルは除く）"""
+    keys = [key for key, entry in state["models"].items() if not entry.get("failed")]
+    local_models = [m for m in LOCAL_MODELS if m in MODELS] if include_local else []
+    preload_local_models(local_models)
+    failed = set()
+    invalid_flags = {key: _load_flags(base_dir, "invalid", key, state["rows"]) for key in keys}
+    store = VectorStore(base_dir)
+    store.reset()
+    start = 0
+    with metrics.span("batch.finalize"):
+        for chunk in pd.read_csv(Path(base_dir) / "args.csv", chunksize=chunk_size):
+            end = start + len(chunk)
+            vectors_by_model = {
+                key: np.array(_vectors(base_dir, key, state["rows"], state["models"][key]["dim"])[start:end])
+                for key in keys
+            }
+            invalid = {key: np.flatnonzero(flags[start:end]) for key, flags in invalid_flags.items()}
+            texts = chunk["argument"].astype(str).tolist()
+            for model_name in local_models:
+                if model_name in failed:
+                    continue
+                try:
+                    bad_items = []
+                    vectors_by_model[model_key(model_name)] = embed_batch(texts, model_name, bad_items)
+                    invalid[model_key(model_name)] = invalid_rows(bad_items)
+                    write_quarantine(base_dir, model_name, start, bad_items)
+                except Exception as e:
+                    # stream_to_store と同じく、失敗したモデルは以降スキップしてストアから外す
+                    metrics.incr("model_failures", model=model_name)
+                    print(f"❌ モデル {model_name} でエラーが発生しました: {e}")
+                    failed.add(model_name)
+                    vectors_by_model.pop(model_key(model_name), None)
+                    invalid.pop(model_key(model_name), None)
+                    if model_key(model_name) in store.model_keys():
+                        store.drop_model(model_key(model_name))
+            store.append(chunk.to_dict(orient="records"), vectors_by_model, invalid)
+            start = end
+    state["finalized"] = True
+    return store
+
+
+# ─── 1 ステップ分の進行 ───────────────────────────────────
+def step(base_dir, backends, max_rounds=3, realtime_fallback=False, include_local=True):
+    """
+    投入 → 状態確認 → ダウンロード・取り込み → 欠けた行の再投入 → ストアへの書き出し を、
+    今できるところまで進める。すべて終わっていれば True
+    """
+    state = read_state(base_dir)
+    if state["finalized"]:
+        return True
+    if _csv_digest(Path(base_dir) / "args.csv") != state["csv_sha1"]:
+        raise RuntimeError("args.csv が投入後に変更されています。--restart で作り直してください")
+    bdir = batch_dir(base_dir)
+    texts = None
+
+    for key, entry in state["models"].items():
+        api = backends(entry["model"])
+        for job in entry["jobs"]:
+            if job["status"] in ("prepared", "submitting"):
+                if job["file_id"] is None:
+                    job["file_id"] = api.upload(bdir / f"requests_{job['name']}.jsonl")
+                    _write_state(base_dir, state)
+                metadata = {"job": job["name"]}
+                if job["status"] == "submitting":
+                    # 前回は create の後、batch_id を保存する前に中断した可能性がある。二重投入しないよう先に探す
+                    job["batch_id"] = api.find(job["file_id"], metadata)
+                if job["batch_id"] is None:
+                    job["status"] = "submitting"
+                    _write_state(base_dir, state)
+                    job["batch_id"] = api.create(job["file_id"], metadata)
+                else:
+                    print(f"🔎 {job['name']}: 投入済みのバッチ {job['batch_id']} を見つけました")
+                job["status"] = "submitted"
+                metrics.incr("batch_jobs_submitted", model=key)
+                print(f"📤 {job['name']}: {job['requests']} 要求 / {job['rows']} 行を投入しました ({job['batch_id']})")
+                _write_state(base_dir, state)
+            elif job["status"] != "ingested" and job["status"] not in BATCH_TERMINAL_STATUSES:
+                info = api.retrieve(job["batch_id"])
+                job.update(info)
+                _write_state(base_dir, state)
+            if job["status"] in BATCH_TERMINAL_STATUSES:
+                for kind, prefix in (("output_file_id", "output"), ("error_file_id", "errors")):
+                    if job.get(kind):
+                        api.download(job[kind], bdir / f"{prefix}_{job['name']}.jsonl")
+                status = job["status"]
+                ingested = ingest_job(base_dir, state, key, job)
+                print(f"📥 {job['name']}: {status}, {ingested}/{job['rows']} 行を取り込みました")
+                _write_state(base_dir, state)
+
+        if entry["exhausted"] or any(job["status"] != "ingested" for job in entry["jobs"]):
+            continue
+        done = _load_flags(base_dir, "done", key, state["rows"])
+        if done.all():
+            continue
+        texts = texts if texts is not None else _read_texts(base_dir)
+        missing = np.flatnonzero(~done)
+        if entry["round"] < max_rounds:
+            # 入力エラーの行を切り分けられるよう、1 要求あたりの入力数を減らして投入し直す
+            per_request = max(1, entry["jobs"][-1]["inputs_per_request"] // 8)
+            entry["round"] += 1
+            _add_jobs(base_dir, state, key, missing, texts, entry["api_model"], per_request, state["requests_per_file"])
+            print(f"🔁 {key}: 欠けた {len(missing)} 行をラウンド {entry['round']} で投入し直します")
+        else:
+            filled = _fill_leftovers(base_dir, state, key, texts, realtime_fallback)
+            if entry.get("failed"):
+                print(f"❌ {key}: バッチ結果が 1 件も得られなかったため、このモデルはストアに書き出しません")
+            else:
+                print(f"⚠️ {key}: {filled} 行は{'リアルタイム API で埋め込みました' if realtime_fallback else 'ゼロベクトルで保存しました'}")
+        _write_state(base_dir, state)
+
+    complete = all(
+        entry["exhausted"] or _load_flags(base_dir, "done", key, state["rows"]).all() for key, entry in state["models"].items()
+    )
+    if complete:
+        store = finalize(base_dir, state, include_local)
+        _write_state(base_dir, state)
+        print(f"📦 ストアへ保存: {store.dir} ({store.num_rows} 行, モデル: {store.model_keys()})")
+    return complete
+
+
+def print_status(base_dir):
+    state = read_state(base_dir)
+    if state is None:
+        print("📋 バッチジョブはありません")
+        return
+    print(f"📋 backend={state['backend']} rows={state['rows']} finalized={state['finalized']}")
+    for key, entry in state["models"].items():
+        done = _load_flags(base_dir, "done", key, state["rows"])
+        statuses = {}
+        for job in entry["jobs"]:
+            statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+        summary = ", ".join(f"{k}={v}" for k, v in sorted(statuses.items()))
+        failed = " (failed: ストアには書き出さない)" if entry.get("failed") else ""
+        print(f"  {key}: ラウンド {entry['round']}, {int(done.sum())}/{state['rows']} 行, ジョブ [{summary}]{failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch API でフォルダの埋め込みをオフライン実行します")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="ジョブを作成（なければ）して、進められるところまで進める")
+    run.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    run.add_argument("--backend", choices=["openai", "stub"], default="openai", help="stub はファイルベースの代役")
+    run.add_argument("--models", help="バッチで埋め込むモデル（カンマ区切り, 省略時は MODELS の API モデル）")
+    run.add_argument("--inputs-per-request", type=int, default=256, help="1 要求にまとめる入力数")
+    run.add_argument(
+        "--requests-per-file",
+        type=int,
+        default=1000,
+        help=f"1 ジョブの要求数（入力数の合計が {MAX_INPUTS_PER_BATCH} を超える分は減らす）",
+    )
+    run.add_argument("--max-rounds", type=int, default=3, help="欠けた行を投入し直す最大回数")
+    run.add_argument("--realtime-fallback", action="store_true", help="最後まで欠けた行をリアルタイム API で埋め込む")
+    run.add_argument("--no-local", action="store_true", help="ローカルモデルを埋め込まない")
+    run.add_argument("--restart", action="store_true", help="既存のジョブを破棄して作り直す")
+    run.add_argument("--wait", action="store_true", help="すべて終わるまで待つ")
+    run.add_argument("--interval", type=float, default=60, help="--wait の問い合わせ間隔（秒）")
+    run.add_argument("--stub-polls", type=int, default=2, help="stub: 完了までの問い合わせ回数")
+    run.add_argument("--stub-failure-rate", type=float, default=0.0, help="stub: 要求が 500 で失敗する確率")
+    run.add_argument("--stub-max-input-chars", type=int, default=0, help="stub: 超過した入力を含む要求を 400 にする")
+    run.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+
+    status = sub.add_parser("status", help="ジョブの状態を表示")
+    status.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    if args.command == "status":
+        print_status(base_dir)
+        return
+
+    backend_kwargs = {}
+    if args.backend == "stub":
+        from embedding_stub_server import StubConfig
+
+        config = StubConfig(failure_rate=args.stub_failure_rate, max_input_chars=args.stub_max_input_chars)
+        backend_kwargs = {"stub_config": config, "stub_polls": args.stub_polls}
+
+    state = read_state(base_dir)
+    if state is None or args.restart:
+        models = args.models.split(",") if args.models else BATCH_MODELS
+        state = init_jobs(base_dir, args.backend, models, args.inputs_per_request, args.requests_per_file, **backend_kwargs)
+        print(f"✅ {len(state['models'])} モデル分のバッチジョブを作成しました: {batch_dir(base_dir)}")
+    elif state["backend"] != args.backend:
+        raise SystemExit(f"既存のジョブは backend={state['backend']} で作成されています（--restart で作り直し）")
+
+    apis = {}
+
+    def backends(model_name):
+        if model_name not in apis:
+            apis[model_name] = make_backend(args.backend, model_name, base_dir, **backend_kwargs)
+        return apis[model_name]
+
+    while True:
+        finished = step(base_dir, backends, args.max_rounds, args.realtime_fallback, not args.no_local)
+        if finished or not args.wait:
+            break
+        time.sleep(args.interval)
+    print_status(base_dir)
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "batch_embed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+モデルごとの階層クラスタ木を事前計算する（ドリルダウン表示・検索の粗探索用）
+
+ストアの埋め込み行列をブロック単位で読みながら最下層をミニバッチ k-means で求め、
+その重心を重み付き k-means でまとめて上位の階層を作る。
+各ノードは重心・所属件数・代表テキスト（重心に最も近いアイテム）を持つ。
+隔離した行（VectorStore.valid_mask が False の行）はクラスタに含めず、assignments を -1 にする。
+
+    python build_clusters.py sample --levels 8,64,512
+出力: data/<folder>/clusters_<model_key>.pkl
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from artifact_io import dump_pickle, load_pickle
+from vector_store import VectorStore
+
+
+def normalize_rows(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _nearest(x, centroids):
+    """各行に最も近い重心の番号と、その内積（正規化済みなのでコサイン類似度）"""
+    sims = x @ centroids.T
+    idx = np.argmax(sims, axis=1)
+    return idx, sims[np.arange(len(x)), idx]
+
+
+def _kmeans_pp(x, k, rng, weights=None):
+    """k-means++ 初期化"""
+    n = len(x)
+    p = None if weights is None else weights / weights.sum()
+    centers = [x[rng.choice(n, p=p)]]
+    dist = np.full(n, np.inf)
+    for _ in range(1, k):
+        dist = np.minimum(dist, ((x - centers[-1]) ** 2).sum(axis=1))
+        score = dist if weights is None else dist * weights
+        total = score.sum()
+        centers.append(x[rng.choice(n, p=score / total)] if total > 0 else x[rng.integers(n)])
+    return np.array(centers, dtype=np.float32)
+
+
+def minibatch_kmeans(store, key, k, block_rows, epochs, rng, sample_rows=20000):
+    """ストアからブロック単位で読みながらミニバッチ k-means（Sculley 2010 の更新則）"""
+    n = store.num_rows
+    mat = store.matrix(key)
+    valid = store.valid_mask(key)
+    valid_rows = np.flatnonzero(valid)
+    sample_idx = np.sort(rng.choice(valid_rows, size=min(len(valid_rows), max(sample_rows, 3 * k)), replace=False))
+    centroids = _kmeans_pp(normalize_rows(np.asarray(mat[sample_idx], dtype=np.float32)), k, rng)
+    counts = np.zeros(k, dtype=np.float64)
+
+    starts = np.arange(0, n, block_rows)
+    for epoch in range(epochs):
+        for start in rng.permutation(starts):
+            with metrics.span("store.read", artifact="vector_store"):
+                block = normalize_rows(np.asarray(mat[start:start + block_rows], dtype=np.float32))
+            block = block[valid[start:start + block_rows]]
+            idx, _ = _nearest(block, centroids)
+            for c in np.unique(idx):
+                members = block[idx == c]
+                counts[c] += len(members)
+                lr = len(members) / counts[c]
+                centroids[c] += lr * (members.mean(axis=0) - centroids[c])
+        centroids = normalize_rows(centroids)
+        print(f"  🔁 epoch {epoch + 1}/{epochs}")
+    return centroids
+
+
+def weighted_kmeans(points, weights, k, rng, iterations=50):
+    """重心同士を件数で重み付けしてまとめる（メモリ上の小さな行列向け）"""
+    k = min(k, len(points))
+    centroids = _kmeans_pp(points, k, rng, weights)
+    for _ in range(iterations):
+        idx, _ = _nearest(points, centroids)
+        new = np.zeros_like(centroids)
+        np.add.at(new, idx, points * weights[:, None])
+        empty = np.bincount(idx, minlength=k) == 0
+        new[empty] = centroids[empty]
+        new = normalize_rows(new)
+        if np.allclose(new, centroids):
+            break
+        centroids = new
+    idx, _ = _nearest(points, centroids)
+    return centroids, idx
+
+
+def build_tree(store, key, levels, block_rows=4096, epochs=3, seed=0):
+    rng = np.random.default_rng(seed)
+    n = store.num_rows
+    valid = store.valid_mask(key)
+    levels = sorted(min(k, int(valid.sum())) for k in levels)
+    leaf_k = levels[-1]
+
+    print(f"🌲 {key}: 最下層 k={leaf_k} をミニバッチ k-means で計算中...")
+    with metrics.span("clustering", model=key, level="leaf"):
+        centroids = minibatch_kmeans(store, key, leaf_k, block_rows, epochs, rng)
+
+    # 全行を最下層に割り当て、件数・重心・代表アイテムを確定する
+    assignments = np.empty(n, dtype=np.int32)
+    sums = np.zeros_like(centroids, dtype=np.float64)
+    best_sim = np.full(leaf_k, -np.inf)
+    best_row = np.full(leaf_k, -1, dtype=np.int64)
+    for start, block in store.iter_blocks(key, block_rows):
+        block = normalize_rows(block)
+        idx, sims = _nearest(block, centroids)
+        ok = valid[start:start + len(block)]
+        idx[~ok] = -1
+        assignments[start:start + len(block)] = idx
+        np.add.at(sums, idx[ok], block[ok])
+        for c in np.unique(idx[ok]):
+            mask = idx == c
+            j = np.argmax(np.where(mask, sims, -np.inf))
+            if sims[j] > best_sim[c]:
+                best_sim[c], best_row[c] = sims[j], start + j
+    counts = np.bincount(assignments[valid], minlength=leaf_k)
+
+    # 空クラスタを取り除いて番号を詰める
+    keep = np.flatnonzero(counts)
+    remap = np.full(leaf_k + 1, -1, dtype=np.int32)  # 末尾は隔離した行（-1）の行き先
+    remap[keep] = np.arange(len(keep), dtype=np.int32)
+    assignments = remap[assignments]
+    leaf = {
+        "centroids": normalize_rows(sums[keep]).astype(np.float32),
+        "counts": counts[keep],
+        "representative": best_row[keep],
+    }
+
+    # 上位の階層は下位の重心を件数で重み付けしてまとめる
+    tree_levels = [leaf]
+    for k in reversed(levels[:-1]):
+        child = tree_levels[0]
+        with metrics.span("clustering", model=key, level=str(k)):
+            cents, parent = weighted_kmeans(child["centroids"], child["counts"].astype(np.float64), k, rng)
+        child["parent"] = parent.astype(np.int32)
+        k = len(cents)
+        counts = np.bincount(parent, weights=child["counts"], minlength=k).astype(np.int64)
+        sums = np.zeros_like(cents, dtype=np.float64)
+        np.add.at(sums, parent, child["centroids"] * child["counts"][:, None])
+        level = {"centroids": normalize_rows(sums).astype(np.float32), "counts": counts}
+        # 代表アイテムは子の代表のうち親の重心に最も近いもの
+        reps = np.full(k, -1, dtype=np.int64)
+        child_rep_vecs = normalize_rows(np.asarray(store.matrix(key)[np.sort(child["representative"])], dtype=np.float32))
+        order = np.argsort(child["representative"])
+        sims = np.einsum("ij,ij->i", child_rep_vecs, level["centroids"][parent[order]])
+        best = np.full(k, -np.inf)
+        for i, child_idx in enumerate(order):
+            p = parent[child_idx]
+            if sims[i] > best[p]:
+                best[p], reps[p] = sims[i], child["representative"][child_idx]
+        level["representative"] = reps
+        tree_levels.insert(0, level)
+    tree_levels[0]["parent"] = None
+
+    texts = store.texts()
+    for level in tree_levels:
+        level["k"] = len(level["centroids"])
+        level["texts"] = [texts[i] for i in level["representative"]]
+    return {"model": key, "rows": n, "row_order": store.row_order(), "levels": tree_levels, "assignments": assignments}
+
+
+def load_cluster_tree(base_dir, key, store=None):
+    """クラスタ木を読む。store を渡すと、行の並びが作成時から変わっていないか確かめる"""
+    tree = load_pickle(Path(base_dir) / f"clusters_{key}.pkl")
+    if store is not None and (tree["rows"] != store.num_rows or tree.get("row_order", 0) != store.row_order()):
+        raise RuntimeError(f"clusters_{key}.pkl は現在のストアと行が対応していません。build_clusters.py で作り直してください")
+    return tree
+
+
+def leaf_ancestors(tree, level):
+    """最下層ノード → 指定階層のノード番号の対応表"""
+    levels = tree["levels"]
+    mapping = np.arange(levels[-1]["k"])
+    for lv in range(len(levels) - 1, level, -1):
+        mapping = levels[lv]["parent"][mapping]
+    return mapping
+
+
+def members(tree, level, node):
+    """指定ノードに属するアイテムの行番号"""
+    leaf_nodes = np.flatnonzero(leaf_ancestors(tree, level) == node)
+    return np.flatnonzero(np.isin(tree["assignments"], leaf_nodes))
+
+
+def children(tree, level, node):
+    """指定ノードの 1 つ下の階層の子ノード番号"""
+    if level + 1 >= len(tree["levels"]):
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(tree["levels"][level + 1]["parent"] == node)
+
+
+def top_clusters(tree, query_vec, level=0, n=5):
+    """クエリに近いノードを重心だけで探す（粗探索）"""
+    q = np.asarray(query_vec, dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    sims = tree["levels"][level]["centroids"] @ q
+    order = np.argsort(-sims)[:n]
+    return [(int(i), float(sims[i])) for i in order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルごとの階層クラスタ木を作成します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--levels", default="8,64,512", help="各階層のクラスタ数（カンマ区切り）")
+    parser.add_argument("--models", help="対象モデルキー（カンマ区切り, 省略時は全モデル）")
+    parser.add_argument("--block-rows", type=int, default=4096, help="一度に読み込む行数")
+    parser.add_argument("--epochs", type=int, default=3, help="ミニバッチ k-means のエポック数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    store = VectorStore.open_or_import(base_dir, args.folder)
+    levels = [int(k) for k in args.levels.split(",") if k.strip()]
+    keys = args.models.split(",") if args.models else store.model_keys()
+
+    for key in keys:
+        tree = build_tree(store, key, levels, args.block_rows, args.epochs, args.seed)
+        out_path = base_dir / f"clusters_{key}.pkl"
+        with metrics.span("store.write", artifact="clusters"):
+            dump_pickle(tree, out_path)
+        sizes = " → ".join(str(level["k"]) for level in tree["levels"])
+        print(f"✅ クラスタ木を保存: {out_path} (階層: {sizes})")
+
+
+if __name__ == "__main__":
+    main()
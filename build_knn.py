@@ -0,0 +1,208 @@
+"""
+モデルごとの厳密な k 近傍グラフ（全アイテム対全アイテム）を事前計算する
+
+N × N の類似度行列は作らず、(クエリ側ブロック) × (データ側ブロック) の float32 行列積を
+順に計算しながら各行の上位 k 件だけを保持する。クエリ側ブロックはスレッドで並列に処理する
+（行列積の間は GIL が外れる）。ピークメモリはおよそ
+threads × block_rows × (block_rows + 次元数) × 4 バイト。
+
+隔離した行（VectorStore.valid_mask が False の行）は近傍に含めず、その行自身の近傍は -1 で埋める。
+
+モデル間の比較として、各行の近傍の重なり（overlap@k）と、
+共通する近傍の順位相関（Spearman）を報告する（どちらかのモデルで隔離された行は除く）。
+
+    python build_knn.py sample --k 10 --threads 4
+出力: data/<folder>/knn_<model_key>.npz, data/<folder>/knn_report.json
+"""
+import argparse
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from vector_store import VectorStore
+
+
+def _inv_norms(store, key, block_rows):
+    """各行のノルムの逆数（ゼロベクトルは 0）"""
+    inv = np.empty(store.num_rows, dtype=np.float32)
+    for start, block in store.iter_blocks(key, block_rows):
+        norms = np.linalg.norm(block, axis=1)
+        inv[start:start + len(block)] = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return inv
+
+
+def _merge_topk(best_idx, best_sim, idx, sim, k):
+    """行ごとに (これまでの上位 k 件) と (新しい候補) をまとめて上位 k 件を選び直す"""
+    cand_idx = np.concatenate([best_idx, idx], axis=1)
+    cand_sim = np.concatenate([best_sim, sim], axis=1)
+    if cand_sim.shape[1] <= k:
+        return cand_idx, cand_sim
+    top = np.argpartition(-cand_sim, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(cand_idx, top, axis=1), np.take_along_axis(cand_sim, top, axis=1)
+
+
+def _query_block(mat, inv, valid, start, end, k, block_rows):
+    n = len(inv)
+    q = np.asarray(mat[start:end], dtype=np.float32) * inv[start:end, None]
+    best_idx = np.empty((end - start, 0), dtype=np.int64)
+    best_sim = np.empty((end - start, 0), dtype=np.float32)
+    for d_start in range(0, n, block_rows):
+        d_end = min(d_start + block_rows, n)
+        d = np.asarray(mat[d_start:d_end], dtype=np.float32) * inv[d_start:d_end, None]
+        sims = q @ d.T
+        # 隔離した行は近傍に含めない
+        sims[:, ~valid[d_start:d_end]] = -np.inf
+        # 自分自身は近傍に含めない
+        lo, hi = max(start, d_start), min(end, d_end)
+        if lo < hi:
+            rows = np.arange(lo, hi)
+            sims[rows - start, rows - d_start] = -np.inf
+        kk = min(k, d_end - d_start)
+        top = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+        best_idx, best_sim = _merge_topk(
+            best_idx, best_sim, top + d_start, np.take_along_axis(sims, top, axis=1), k
+        )
+    order = np.argsort(-best_sim, axis=1, kind="stable")
+    best_idx[~valid[start:end]] = -1
+    best_sim[~valid[start:end]] = -np.inf
+    return start, np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_sim, order, axis=1)
+
+
+def build_knn(store, key, k=10, block_rows=2048, threads=4):
+    """
+    (indices, sims) を返す。どちらも (rows, k) で類似度の降順（k は 有効な行数 - 1 まで）。
+    隔離した行の indices は -1、sims は -inf
+    """
+    n = store.num_rows
+    valid = store.valid_mask(key)
+    k = min(k, int(valid.sum()) - 1)
+    if k <= 0:
+        # 自分以外の行がなければ近傍もない
+        return np.empty((n, 0), dtype=np.int32), np.empty((n, 0), dtype=np.float32)
+    mat = store.matrix(key)
+    inv = _inv_norms(store, key, block_rows)
+    indices = np.empty((n, k), dtype=np.int32)
+    sims = np.empty((n, k), dtype=np.float32)
+
+    blocks = [(s, min(s + block_rows, n)) for s in range(0, n, block_rows)]
+    with metrics.span("knn", model=key), ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(_query_block, mat, inv, valid, s, e, k, block_rows) for s, e in blocks]
+        for i, future in enumerate(futures):
+            start, idx, sim = future.result()
+            indices[start:start + len(idx)] = idx
+            sims[start:start + len(idx)] = sim
+            print(f"  🔁 {key}: {i + 1}/{len(blocks)} ブロック")
+    return indices, sims
+
+
+def save_knn(store, key, indices, sims):
+    """近傍グラフを、作成時のストアの fingerprint と行数とともに保存する"""
+    path = Path(store.base_dir) / f"knn_{key}.npz"
+    with metrics.span("store.write", artifact="knn"):
+        np.savez(path, indices=indices, sims=sims, fingerprint=store.fingerprint(), rows=store.num_rows)
+    return path
+
+
+def load_knn(base_dir, key, store=None):
+    """
+    (indices, sims) を読む。store を渡すと、作成後にストアが書き換わっていない
+    （追記・並べ替えなどで行番号がずれていない）か確かめる
+    """
+    with np.load(Path(base_dir) / f"knn_{key}.npz") as data:
+        if store is not None and (
+            "fingerprint" not in data.files
+            or int(data["rows"]) != store.num_rows
+            or str(data["fingerprint"]) != store.fingerprint()
+        ):
+            raise RuntimeError(f"knn_{key}.npz は現在のストアと行が対応していません。build_knn.py で作り直してください")
+        return data["indices"], data["sims"]
+
+
+def compare_neighbourhoods(a, b, budget=1 << 22):
+    """
+    2 つの近傍グラフ（同じ行順の (rows, k) 配列）を比べ、
+    平均 overlap@k と、共通する近傍が 2 件以上ある行での Spearman 順位相関の平均を返す。
+    どちらかで隔離された行（近傍が -1）は数えない。
+    (rows, k, k) の一時配列が budget 要素に収まるよう、一度に比べる行数を k から決める
+    """
+    n, k = a.shape
+    if not n or not k:
+        return {"overlap_at_k": 0.0, "spearman": None, "rows_with_common_neighbours": 0}
+    block_rows = max(1, budget // (k * k))
+    overlap_sum = 0.0
+    rho_sum = 0.0
+    rho_rows = 0
+    compared = 0
+    for start in range(0, n, block_rows):
+        ab = a[start:start + block_rows]
+        bb = b[start:start + block_rows]
+        keep = (ab[:, 0] >= 0) & (bb[:, 0] >= 0)
+        if not keep.all():
+            ab, bb = ab[keep], bb[keep]
+        compared += len(ab)
+        eq = ab[:, :, None] == bb[:, None, :]  # (rows, k, k)
+        matched = eq.any(axis=2)  # a 側の各近傍が b にもあるか
+        m = matched.sum(axis=1)
+        overlap_sum += float((m / k).sum())
+
+        # 共通近傍の中での a 側・b 側の順位
+        pos_b = np.where(matched, eq.argmax(axis=2), k)
+        rank_a = np.cumsum(matched, axis=1) - 1
+        rank_b = ((pos_b[:, None, :] < pos_b[:, :, None]) & matched[:, None, :]).sum(axis=2)
+        d2 = np.where(matched, (rank_a - rank_b) ** 2, 0).sum(axis=1)
+        ok = m >= 2
+        rho = 1 - 6 * d2[ok] / (m[ok] * (m[ok] ** 2 - 1))
+        rho_sum += float(rho.sum())
+        rho_rows += int(ok.sum())
+    return {
+        "overlap_at_k": overlap_sum / compared if compared else 0.0,
+        "spearman": rho_sum / rho_rows if rho_rows else None,
+        "rows_with_common_neighbours": rho_rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルごとの k 近傍グラフを作成し、モデル間で比較します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--k", type=int, default=10, help="近傍数")
+    parser.add_argument("--models", help="対象モデルキー（カンマ区切り, 省略時は全モデル）")
+    parser.add_argument("--block-rows", type=int, default=2048, help="一度に掛け合わせる行数")
+    parser.add_argument("--threads", type=int, default=4, help="並列に処理するブロック数")
+    parser.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    store = VectorStore.open_or_import(base_dir, args.folder)
+    keys = args.models.split(",") if args.models else store.model_keys()
+
+    graphs = {}
+    for key in keys:
+        print(f"🕸️ {key}: {store.num_rows} 行の {args.k} 近傍を計算中...")
+        indices, sims = build_knn(store, key, args.k, args.block_rows, args.threads)
+        print(f"✅ 近傍グラフを保存: {save_knn(store, key, indices, sims)}")
+        graphs[key] = indices
+
+    report = {"rows": store.num_rows, "k": args.k, "pairs": []}
+    if len(graphs) >= 2:
+        print("\n📊 モデル間の近傍の一致")
+    for a, b in itertools.combinations(graphs, 2):
+        stats = compare_neighbourhoods(graphs[a], graphs[b])
+        report["pairs"].append({"model_a": a, "model_b": b, **stats})
+        rho = "-" if stats["spearman"] is None else f"{stats['spearman']:.3f}"
+        print(f"  {a} × {b}: overlap@{args.k}={stats['overlap_at_k']:.3f}, spearman={rho}")
+
+    report_path = base_dir / "knn_report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📝 比較結果を保存: {report_path}")
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "build_knn")
+
+
+if __name__ == "__main__":
+    main()
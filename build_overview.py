@@ -0,0 +1,229 @@
+"""
+モデルごとの概観レイアウト（PCA による 2D/3D 座標）をストアからブロック単位で計算する
+
+行ブロックを順に読みながら平均と散布行列（次元数 × 次元数）だけを積算し、その固有ベクトルを主成分とする。
+積算値は保存しておくので、行が追記されたときは追加分だけを読んで更新できる
+（散布行列は対称なので上三角だけを圧縮して保存する）。
+ストアの reset・並べ替え（row_order）や、積算済みの行の中身が変わっていたら最初から計算し直す。
+隔離した行（VectorStore.valid_mask が False の行）は積算に含めず、座標は NaN にする。
+追加分が前回の主成分計算時の行数の refit_fraction 未満なら、主成分はそのままで追加分だけを射影し、
+それを超えたら主成分を計算し直して全行を射影し直す（符号は前回に揃える）。
+
+    python build_overview.py sample
+出力: data/<folder>/overview_<model_key>.npz
+"""
+import argparse
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from vector_store import VectorStore
+
+
+def _order_digest(store, n):
+    """先頭 n 行の並び（元の行番号）のハッシュ。並べ替えられていたら作り直す"""
+    return hashlib.sha1(store.row_ids()[:n].tobytes()).hexdigest()
+
+
+def _prefix_digest(store, key, n, samples=64):
+    """積算済みの先頭 n 行から等間隔に選んだ行のベクトルのハッシュ（中身が入れ替わっていないかの確認用）"""
+    if n == 0:
+        return ""
+    rows = np.unique(np.linspace(0, n - 1, min(samples, n)).astype(np.int64))
+    return hashlib.sha1(np.ascontiguousarray(store.matrix(key)[rows], dtype=np.float32).tobytes()).hexdigest()
+
+
+def _prefix_matches(store, key, state):
+    """
+    保存済みの状態が、今のストアの先頭 state["n"] 行から作られたものか。
+    reset・並べ替え（row_order）、行番号の並び、先頭部分のベクトルの中身を確かめる
+    """
+    n = int(state["n"])
+    return (
+        "row_order" in state
+        and "n_valid" in state
+        and int(state["row_order"]) == store.row_order()
+        and n <= store.num_rows
+        and str(state["order"]) == _order_digest(store, n)
+        and str(state["prefix"]) == _prefix_digest(store, key, n)
+    )
+
+
+def _empty_state(dim, n_components):
+    return {
+        "n": 0,
+        "n_valid": 0,
+        "sum": np.zeros(dim, dtype=np.float64),
+        "scatter": np.zeros((dim, dim), dtype=np.float64),
+        "n_at_fit": 0,
+        "mean": np.zeros(dim, dtype=np.float32),
+        "components": np.zeros((n_components, dim), dtype=np.float32),
+        "explained_variance_ratio": np.zeros(n_components, dtype=np.float32),
+        "coords": np.zeros((0, n_components), dtype=np.float32),
+    }
+
+
+def _accumulate(store, key, state, block_rows):
+    mat = store.matrix(key)
+    valid = store.valid_mask(key)
+    for start in range(state["n"], store.num_rows, block_rows):
+        with metrics.span("store.read", artifact="vector_store"):
+            block = np.asarray(mat[start:start + block_rows], dtype=np.float64)
+        state["n"] += len(block)
+        block = block[valid[start:start + len(block)]]
+        state["sum"] += block.sum(axis=0)
+        state["scatter"] += block.T @ block
+        state["n_valid"] += len(block)
+
+
+def _fit(state, n_components):
+    n = max(state["n_valid"], 1)
+    mean = state["sum"] / n
+    cov = state["scatter"] / n - np.outer(mean, mean)
+    values, vectors = np.linalg.eigh(cov)
+    order = np.argsort(values)[::-1][:n_components]
+    components = vectors[:, order].T
+    # 主成分の符号を前回に揃える（軸が反転して見た目が変わらないように）
+    old = state["components"]
+    if np.any(old):
+        signs = np.sign(np.einsum("ij,ij->i", components, old))
+        components *= np.where(signs == 0, 1, signs)[:, None]
+    total = values.clip(min=0).sum() or 1.0
+    state["mean"] = mean.astype(np.float32)
+    state["components"] = components.astype(np.float32)
+    state["explained_variance_ratio"] = (values[order].clip(min=0) / total).astype(np.float32)
+    state["n_at_fit"] = state["n"]
+
+
+def _project(store, key, state, start, block_rows):
+    mat = store.matrix(key)
+    valid = store.valid_mask(key)
+    out = np.empty((store.num_rows - start, len(state["components"])), dtype=np.float32)
+    for s in range(start, store.num_rows, block_rows):
+        block = np.asarray(mat[s:s + block_rows], dtype=np.float32)
+        out[s - start:s - start + len(block)] = (block - state["mean"]) @ state["components"].T
+    out[~valid[start:]] = np.nan
+    return out
+
+
+def overview_path(base_dir, key):
+    return Path(base_dir) / f"overview_{key}.npz"
+
+
+def load_overview(base_dir, key):
+    path = overview_path(base_dir, key)
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        state = {name: data[name] for name in data.files}
+    if "scatter_triu" in state:
+        upper = state.pop("scatter_triu")
+        dim = len(state["sum"])
+        scatter = np.zeros((dim, dim), dtype=np.float64)
+        scatter[np.triu_indices(dim)] = upper
+        state["scatter"] = scatter + np.triu(scatter, 1).T
+    return state
+
+
+def save_overview(base_dir, key, state):
+    """散布行列は上三角だけにして圧縮保存する（一時ファイルに書いてから置き換える）"""
+    path = overview_path(base_dir, key)
+    saved = {name: value for name, value in state.items() if name != "scatter"}
+    saved["scatter_triu"] = state["scatter"][np.triu_indices(len(state["scatter"]))]
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    with metrics.span("store.write", artifact="overview"), open(tmp, "wb") as f:
+        np.savez_compressed(f, **saved)
+    os.replace(tmp, path)
+    return path
+
+
+def update_overview(store, key, n_components=3, refit_fraction=0.2, block_rows=4096, force=False):
+    """
+    overview_<key>.npz を作成・更新して状態の dict を返す。
+    coords はストアの行順の (rows, n_components) 座標
+    """
+    dim = store.dim(key)
+    fingerprint = store.fingerprint()
+    state = load_overview(store.base_dir, key)
+    if (
+        state is not None
+        and not force
+        and str(state.get("fingerprint")) == fingerprint
+        and int(state["n"]) == store.num_rows
+        and state["components"].shape == (n_components, dim)
+    ):
+        # 前回からストアが書き換わっていない
+        return state
+    if (
+        state is None
+        or force
+        or state["components"].shape != (n_components, dim)
+        or not _prefix_matches(store, key, state)
+    ):
+        state = _empty_state(dim, n_components)
+    else:
+        state["n"] = int(state["n"])
+        state["n_valid"] = int(state["n_valid"])
+        state["n_at_fit"] = int(state["n_at_fit"])
+
+    previous = state["n"]
+    # 行数が同じなら（pack など、中身を変えない書き換え）積算・射影はそのままで記録だけ更新する
+    if previous < store.num_rows:
+        with metrics.span("overview", model=key):
+            _accumulate(store, key, state, block_rows)
+            if previous == 0 or state["n"] - state["n_at_fit"] >= refit_fraction * state["n_at_fit"]:
+                _fit(state, n_components)
+                state["coords"] = _project(store, key, state, 0, block_rows)
+                print(f"  🧮 {key}: 主成分を計算し直しました ({state['n']} 行)")
+            else:
+                state["coords"] = np.concatenate([state["coords"], _project(store, key, state, previous, block_rows)])
+                print(f"  ➕ {key}: 追加の {state['n'] - previous} 行を射影しました")
+
+    state["order"] = np.array(_order_digest(store, state["n"]))
+    state["prefix"] = np.array(_prefix_digest(store, key, state["n"]))
+    state["row_order"] = store.row_order()
+    state["fingerprint"] = np.array(fingerprint)
+    save_overview(store.base_dir, key, state)
+    return state
+
+
+def overview_in_csv_order(store, key):
+    """概観座標を args.csv の行順に並べ替えて返す（なければ None）"""
+    state = load_overview(store.base_dir, key)
+    if state is None or int(state["n"]) != store.num_rows or not _prefix_matches(store, key, state):
+        return None
+    return state["coords"][np.argsort(store.row_ids(), kind="stable")]
+
+
+def build_overviews(base_dir, folder, n_components=3, refit_fraction=0.2, force=False):
+    store = VectorStore.open_or_import(base_dir, folder)
+    results = {}
+    for key in store.model_keys():
+        state = update_overview(store, key, n_components, refit_fraction, force=force)
+        ratio = ", ".join(f"{r:.3f}" for r in state["explained_variance_ratio"])
+        print(f"✅ {key}: 寄与率 [{ratio}]")
+        results[key] = state
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルごとの概観レイアウト (PCA) を作成・更新します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--components", type=int, default=3, help="主成分の数 (2 または 3)")
+    parser.add_argument("--refit-fraction", type=float, default=0.2, help="この割合以上の行が追加されたら主成分を計算し直す")
+    parser.add_argument("--force", action="store_true", help="積算をやり直して全行を計算し直す")
+    parser.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    build_overviews(base_dir, args.folder, args.components, args.refit_fraction, args.force)
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "build_overview")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+埋め込み → 軸語ベクトル → 概観レイアウト → HTML 生成を 1 プロセスで実行するパイプライン
+
+各ステージの結果（埋め込み・キーワードベクトル）はメモリ上で次のステージに渡し、
+ローカルモデルは llm.py のキャッシュにより 1 プロセスで 1 回だけ読み込む。
+
+    python build_pipeline.py build sample
+    python build_pipeline.py build sample --stages embed,axis,explorer --stream
+    python build_pipeline.py batch 'pub*' sample --workers 4 --stage-workers embed=1,overview=2 --report batch_report.json
+
+batch では最大 workers 個のフォルダを同時に進め、ステージごとの同時実行数を stage_workers で制限する
+（あるフォルダが埋め込み中でも、別のフォルダの HTML 生成は先に進む）。
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import metrics
+from build_overview import build_overviews
+from embed_items import embed_folder, stream_to_store
+from generate_axis_embeddings import embed_keywords
+from generate_html import build_interactive_html
+from generate_interactive_html import build_explorer_html
+from vector_store import load_embedded_items
+
+DATA_DIR = Path(__file__).parent / "data"
+STAGES = ["embed", "axis", "overview", "explorer", "interactive"]
+DEFAULT_STAGES = ["embed", "axis", "explorer"]
+# ステージごとの同時実行数の既定値（指定のないステージは workers まで）。
+# 埋め込みはローカルモデル・GPU・API のレート制限を共有するので 1 フォルダずつ
+DEFAULT_STAGE_WORKERS = {"embed": 1}
+
+
+def parse_stages(value):
+    stages = [s.strip() for s in value.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"不明なステージ: {unknown} (指定可能: {STAGES})")
+    return stages
+
+
+def parse_stage_workers(value):
+    """"embed=1,overview=2" → {"embed": 1, "overview": 2}"""
+    limits = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        stage, _, n = item.partition("=")
+        stage = stage.strip()
+        if stage not in STAGES or not n.strip().isdigit() or int(n) < 1:
+            raise argparse.ArgumentTypeError(f"不正な指定: {item} (例: embed=1,overview=2)")
+        limits[stage] = int(n)
+    return limits
+
+
+def build_folder(folder, stages=DEFAULT_STAGES, stream=False, chunk_size=256, precompressed=False, stage_slots=None):
+    """
+    folder の指定ステージを順に実行する。
+    stage_slots（ステージ名 → Semaphore）があれば、各ステージはその枠を確保してから実行する。
+    ステージ名 → 所要秒数（枠の待ち時間は含まない）の dict を返す
+    """
+    base_dir = DATA_DIR / folder
+    timings = {}
+    items_data = None
+    keyword_embeddings = None
+
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        with (stage_slots or {}).get(stage) or contextlib.nullcontext():
+            print(f"▶️ [{folder}] ステージ {stage} を実行中...")
+            start = time.perf_counter()
+            with metrics.span("stage", stage=stage):
+                if stage == "embed":
+                    if stream:
+                        input_csv = os.path.join(base_dir, "args.csv")
+                        if not os.path.exists(input_csv):
+                            raise FileNotFoundError(f"指定された CSV が見つかりません: {input_csv}")
+                        stream_to_store(base_dir, input_csv, chunk_size)
+                    else:
+                        items_data = embed_folder(folder)
+                elif stage == "axis":
+                    keyword_embeddings = embed_keywords(folder)
+                elif stage == "overview":
+                    build_overviews(base_dir, folder)
+                else:
+                    # HTML ステージ間で埋め込みの読み込みは 1 回だけ
+                    if items_data is None:
+                        items_data = load_embedded_items(base_dir, folder)
+                    if stage == "explorer":
+                        build_explorer_html(folder, items_data, keyword_embeddings, precompressed=precompressed)
+                    else:
+                        build_interactive_html(folder, items_data, precompressed=precompressed)
+            timings[stage] = time.perf_counter() - start
+        print(f"⏱️ [{folder}] {stage}: {timings[stage]:.2f} 秒")
+
+    return timings
+
+
+def resolve_folders(patterns):
+    """フォルダ名またはグロブ（data/ からの相対）を重複なく展開する"""
+    folders = []
+    for pattern in patterns:
+        matches = sorted(
+            Path(p).name for p in glob.glob(str(DATA_DIR / pattern)) if Path(p).is_dir()
+        )
+        if not matches:
+            print(f"⚠️ 該当するフォルダがありません: {pattern}")
+        for name in matches:
+            if name not in folders:
+                folders.append(name)
+    return folders
+
+
+def build_batch(
+    folders, stages=DEFAULT_STAGES, workers=2, stream=False, chunk_size=256, precompressed=False, stage_workers=None
+):
+    """
+    複数フォルダをワーカープールで並列にビルドする。同時に進めるフォルダは最大 workers 個で、
+    各ステージの同時実行数は stage_workers（省略時は DEFAULT_STAGE_WORKERS）で制限する。
+    ローカルモデル・API クライアントはプロセス内で共有されるので、フォルダごとに読み込み直さない。
+    あるフォルダの失敗は他のフォルダに影響しない。フォルダごとの結果の list を返す
+    """
+    limits = {**DEFAULT_STAGE_WORKERS, **(stage_workers or {})}
+    stage_slots = {stage: threading.Semaphore(n) for stage, n in limits.items() if n < workers}
+    results = []
+
+    def run(folder):
+        start = time.perf_counter()
+        try:
+            timings = build_folder(
+                folder, stages, stream=stream, chunk_size=chunk_size, precompressed=precompressed, stage_slots=stage_slots
+            )
+            return {"folder": folder, "status": "ok", "seconds": time.perf_counter() - start, "stages": timings}
+        except Exception as e:
+            metrics.incr("folder_failures")
+            print(f"❌ [{folder}] ビルドに失敗しました: {e}")
+            return {
+                "folder": folder,
+                "status": "failed",
+                "seconds": time.perf_counter() - start,
+                "error": f"{type(e).__name__}: {e}",
+                "traceback": traceback.format_exc(),
+            }
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, folder): folder for folder in folders}
+        for future in as_completed(futures):
+            results.append(future.result())
+
+    order = {folder: i for i, folder in enumerate(folders)}
+    results.sort(key=lambda r: order[r["folder"]])
+    return results
+
+
+def print_batch_summary(results):
+    print("\n📋 バッチビルド結果")
+    for r in results:
+        mark = "✅" if r["status"] == "ok" else "❌"
+        detail = ", ".join(f"{k}={v:.2f}s" for k, v in r.get("stages", {}).items()) or r.get("error", "")
+        print(f"  {mark} {r['folder']:<20} {r['seconds']:>8.2f} 秒  {detail}")
+    failed = [r for r in results if r["status"] != "ok"]
+    print(f"合計 {len(results)} フォルダ / 失敗 {len(failed)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込みから HTML 生成までを 1 プロセスで実行します")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="1 フォルダをビルド")
+    build.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    build.add_argument(
+        "--stages",
+        type=parse_stages,
+        default=DEFAULT_STAGES,
+        help=f"実行するステージ（カンマ区切り, 指定可能: {','.join(STAGES)}）",
+    )
+    build.add_argument("--stream", action="store_true", help="埋め込みをストリーミングモードで実行")
+    build.add_argument("--chunk-size", type=int, default=256, help="ストリーミング時のチャンク行数")
+    build.add_argument("--precompress", action="store_true", help="HTML の .gz / .br も出力する")
+    build.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+
+    batch = sub.add_parser("batch", help="複数フォルダをまとめてビルド")
+    batch.add_argument("folders", nargs="+", help="data 配下のフォルダ名またはグロブ (例: 'pub*' sample)")
+    batch.add_argument(
+        "--stages",
+        type=parse_stages,
+        default=DEFAULT_STAGES,
+        help=f"実行するステージ（カンマ区切り, 指定可能: {','.join(STAGES)}）",
+    )
+    batch.add_argument("--workers", type=int, default=2, help="同時にビルドするフォルダ数")
+    batch.add_argument(
+        "--stage-workers",
+        type=parse_stage_workers,
+        default={},
+        help=f"ステージごとの同時実行数 (例: embed=1,overview=2, 既定: {DEFAULT_STAGE_WORKERS})",
+    )
+    batch.add_argument("--stream", action="store_true", help="埋め込みをストリーミングモードで実行")
+    batch.add_argument("--chunk-size", type=int, default=256, help="ストリーミング時のチャンク行数")
+    batch.add_argument("--precompress", action="store_true", help="HTML の .gz / .br も出力する")
+    batch.add_argument("--report", help="フォルダごとの結果を書き出す JSON ファイル")
+    batch.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        timings = build_folder(
+            args.folder, args.stages, stream=args.stream, chunk_size=args.chunk_size, precompressed=args.precompress
+        )
+        print(f"✅ ビルド完了: {args.folder} (合計 {sum(timings.values()):.2f} 秒)")
+    elif args.command == "batch":
+        folders = resolve_folders(args.folders)
+        results = build_batch(
+            folders, args.stages, workers=args.workers, stream=args.stream, chunk_size=args.chunk_size,
+            precompressed=args.precompress, stage_workers=args.stage_workers,
+        )
+        print_batch_summary(results)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"📝 結果を保存: {args.report}")
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "build_pipeline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+多数の data/<folder> を 1 プロセスで扱うための、メモリ予算つきデータセットマネージャ
+
+フォルダは初回アクセス時に読み取り専用で開き、埋め込み行列・キーワードベクトル・射影索引を必要になった分だけ
+メモリに載せる。合計が予算を超えたら、フォルダをまたいで最も長く使われていないものから捨てる
+（データ本体はディスクのストアにあるので、次のアクセスで読み直す）。
+ストアの作成・取り込みはしないので、先に python vector_store.py <folder> などでストアを作っておく。
+
+    manager = DatasetManager(DATA_DIR, budget_bytes=2 * 1024**3)
+    mat = manager.matrix("sample", "openai_text-embedding-3-large")
+    index = manager.projection_index("sample", "openai_text-embedding-3-large", ("甘い", "辛い"), ("熱い", "冷たい"))
+    print(manager.stats())
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from spatial_index import GridIndex, axis_vector, load_keyword_vectors, project
+from vector_store import VectorStore
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def _nbytes(value):
+    # キーワードベクトルは {keyword: ベクトル} の dict
+    if isinstance(value, dict):
+        return sum(v.nbytes for v in value.values())
+    return value.nbytes
+
+
+def _meta_version(store):
+    """meta.json の (更新時刻, サイズ)。ストアは meta.json を置き換えて更新するので、stat だけで変更が分かる"""
+    try:
+        stat = store.meta_path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FolderData:
+    """1 フォルダ分のメモリ上のデータ"""
+
+    def __init__(self, base_dir, folder):
+        self.folder = folder
+        self.store = VectorStore(base_dir)
+        if not self.store.exists():
+            raise FileNotFoundError(f"{folder} のストアがありません（python vector_store.py {folder} で作成してください）")
+        self.version = _meta_version(self.store)
+        self.matrices = {}
+        self.keyword_vectors = {}
+        self.indexes = {}
+
+    @property
+    def nbytes(self):
+        return sum(_nbytes(v) for cache in (self.matrices, self.keyword_vectors, self.indexes) for v in cache.values())
+
+
+class DatasetManager:
+    def __init__(self, data_dir=DATA_DIR, budget_bytes=1024 ** 3):
+        self.data_dir = Path(data_dir)
+        self.budget_bytes = budget_bytes
+        self._folders = {}
+        # (フォルダ, 種類, キー) を使われた順に並べる。予算を超えたら先頭から捨てる
+        self._entries = OrderedDict()
+        # 読み込み中のエントリ → Future（同じキーの同時読み込みを 1 回にまとめる）
+        self._loading = {}
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "evictions": 0, "reloads": 0}
+
+    # ─── フォルダ ────────────────────────────────────
+    def folder(self, folder):
+        """開いたフォルダを返す（開いていなければ開く）。meta.json が変わっていれば開き直す"""
+        with self._lock:
+            data = self._folders.get(folder)
+            if data is not None and _meta_version(data.store) != data.version:
+                self._stats["reloads"] += 1
+                self._forget(folder)
+                data = None
+            if data is None:
+                data = FolderData(self.data_dir / folder, folder)
+                self._folders[folder] = data
+            return data
+
+    def _forget(self, folder):
+        self._folders.pop(folder, None)
+        for entry in [e for e in self._entries if e[0] == folder]:
+            del self._entries[entry]
+
+    def _lookup(self, data, kind, key, load):
+        """
+        data.<kind>[key] を返す。なければ load() で作って予算内に収める。
+        読み込みはロックの外で行い（他のフォルダ・キーのヒットを待たせない）、
+        同じキーを同時に読もうとしたスレッドは最初の読み込みの完了を待つ
+        """
+        cache = getattr(data, kind)
+        entry = (data.folder, kind, key)
+        with self._lock:
+            if key in cache:
+                self._stats["hits"] += 1
+                metrics.incr("dataset_cache_hits")
+                self._entries.move_to_end(entry)
+                return cache[key]
+            future = self._loading.get(entry)
+            if future is None:
+                self._stats["misses"] += 1
+                metrics.incr("dataset_cache_misses")
+                future = self._loading[entry] = Future()
+                loader = True
+            else:
+                self._stats["waits"] += 1
+                metrics.incr("dataset_cache_waits")
+                loader = False
+        if not loader:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[entry]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[entry]
+            # 読み込み中にストアが更新されて開き直されていたら、古い版のデータはキャッシュしない
+            if self._folders.get(data.folder) is data:
+                cache[key] = value
+                self._entries[entry] = None
+                self._enforce_budget(keep=entry)
+        future.set_result(value)
+        return value
+
+    def _enforce_budget(self, keep):
+        """予算を超えていれば、フォルダをまたいで最も長く使われていない行列・索引から捨てる（keep は残す）"""
+        while self.resident_bytes > self.budget_bytes:
+            victim = next((e for e in self._entries if e != keep), None)
+            if victim is None:
+                break
+            del self._entries[victim]
+            folder, kind, key = victim
+            data = self._folders[folder]
+            value = getattr(data, kind).pop(key)
+            self._stats["evictions"] += 1
+            metrics.incr("dataset_evictions", kind=kind)
+            print(f"♻️ {folder} の {kind} {key} をメモリから解放しました ({_nbytes(value) / 1024 ** 2:.1f} MB)")
+
+    # ─── データ ─────────────────────────────────────
+    def matrix(self, folder, key):
+        """(rows, dim) の埋め込み行列。単独で予算を超える場合はメモリに載せず memmap を返す"""
+        data = self.folder(folder)
+        n, d = data.store.num_rows, data.store.dim(key)
+        if n * d * 4 > self.budget_bytes:
+            metrics.incr("dataset_memmap_fallbacks")
+            return data.store.matrix(key)
+
+        def load():
+            with metrics.span("store.read", artifact="vector_store"):
+                return np.array(data.store.matrix(key))
+
+        return self._lookup(data, "matrices", key, load)
+
+    def keyword_vectors(self, folder, key):
+        """{keyword: float32 ベクトル}"""
+        data = self.folder(folder)
+
+        def load():
+            raw = load_keyword_vectors(data.store.base_dir, key)
+            return {kw: np.asarray(vec, dtype=np.float32) for kw, vec in raw.items()}
+
+        return self._lookup(data, "keyword_vectors", key, load)
+
+    def projection_index(self, folder, key, x_axis, y_axis):
+        """x_axis = (左, 右), y_axis = (下, 上) の射影座標の GridIndex"""
+        data = self.folder(folder)
+
+        def load():
+            kw = self.keyword_vectors(folder, key)
+            ax = axis_vector(kw[x_axis[1]], kw[x_axis[0]])
+            ay = axis_vector(kw[y_axis[1]], kw[y_axis[0]])
+            xs, ys = project(self.matrix(folder, key), ax, ay)
+            return GridIndex(xs, ys)
+
+        return self._lookup(data, "indexes", (key, tuple(x_axis), tuple(y_axis)), load)
+
+    # ─── 統計 ───────────────────────────────────────
+    @property
+    def resident_bytes(self):
+        with self._lock:
+            return sum(data.nbytes for data in self._folders.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": self.resident_bytes,
+                "folders": {name: data.nbytes for name, data in self._folders.items()},
+            }
@@ -1,8 +1,12 @@
 import argparse
+import json
 import os
-import pickle
+import numpy as np
 import pandas as pd
-from llm import request_to_local_embed, request_to_embed
+import metrics
+from artifact_io import dump_pickle, load_pickle
+from llm import is_input_error, preload_local_models, request_to_local_embed, request_to_embed
+from vector_store import VectorStore, model_key
 
 # 対応するローカルモデルおよびOpenAIモデルのリスト
 MODELS = [
@@ -11,18 +15,150 @@ MODELS = [
     "cl-nagoya/ruri-v3-310m",
     "openai/text-embedding-3-large",
 ]
+LOCAL_MODELS = [m for m in MODELS if not m.startswith("openai/")]
+# 各モデルの出力次元数（最初のバッチが全件隔離されて次元数がわからないときに使う）
+MODEL_DIMS = {
+    "sentence-transformers/paraphrase-multilingual-mpnet-base-v2": 768,
+    "sbintuitions/sarashina-embedding-v1-1b": 1792,
+    "cl-nagoya/ruri-v3-310m": 768,
+    "openai/text-embedding-3-large": 3072,
+}
+QUARANTINE_FILENAME = "quarantine.jsonl"
 
 
-def main():
-    parser = argparse.ArgumentParser(description="フォルダ名を指定して埋め込みを実行します")
-    parser.add_argument(
-        "folder",
-        help="data 配下のサブフォルダ名 (例: overflow, sample)",
+def _embed_once(texts, model_name):
+    if model_name.startswith("openai/"):
+        vectors = request_to_embed(texts, model_name.replace("openai/", ""))
+    else:
+        vectors = request_to_local_embed(texts, model_name)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def embed_batch(texts, model_name, bad_items=None, dim=None):
+    """
+    texts (list[str]) をまとめて埋め込み、(len(texts), dim) の float32 配列を返す。
+
+    bad_items に list を渡すと、入力が原因のエラーで失敗したバッチを半分ずつに分けて再送し、
+    単独でも失敗するアイテムだけをゼロベクトルにして {"index", "text", "error"} を bad_items に追加する。
+    ゼロベクトルの行は呼び出し側で VectorStore.append(invalid=...) に渡し、無効な行として記録する。
+    全件が失敗したときの次元数は、このプロセスで前に見た次元数 → dim（既存のストアの次元数など）→ MODEL_DIMS の順に決める。
+    一時的なエラーの再試行は llm.py 側で行う
+    """
+    if bad_items is None:
+        vectors = _embed_once(texts, model_name)
+        _model_dims[model_name] = vectors.shape[1]
+        return vectors
+
+    found = []
+    rows = _embed_split(texts, model_name, 0, found)
+    dim = _model_dims.get(model_name) or dim or MODEL_DIMS.get(model_name)
+    if dim is None:
+        raise RuntimeError(f"{model_name}: すべての入力が失敗しました ({found[0]['error']})")
+    bad_items.extend(found)
+    return np.stack([np.zeros(dim, dtype=np.float32) if row is None else row for row in rows])
+
+
+def _embed_split(texts, model_name, offset, bad_items):
+    """失敗したら二分して再送し、行ごとのベクトル（隔離したアイテムは None）のリストを返す"""
+    try:
+        vectors = _embed_once(texts, model_name)
+        _model_dims[model_name] = vectors.shape[1]
+        return list(vectors)
+    except Exception as e:
+        if not is_input_error(e):
+            raise
+        if len(texts) == 1:
+            metrics.incr("quarantined_items", model=model_name)
+            bad_items.append({"index": offset, "text": texts[0], "error": f"{type(e).__name__}: {e}"})
+            return [None]
+    metrics.incr("batch_splits", model=model_name)
+    mid = len(texts) // 2
+    return (
+        _embed_split(texts[:mid], model_name, offset, bad_items)
+        + _embed_split(texts[mid:], model_name, offset + mid, bad_items)
     )
-    args = parser.parse_args()
 
-    # データフォルダパス
-    base_dir = os.path.join(os.path.dirname(__file__), "data", args.folder)
+
+# モデルごとの次元数（隔離したアイテムのゼロベクトル用）
+_model_dims = {}
+
+
+def invalid_rows(bad_items):
+    """隔離したアイテムの、バッチ内での位置のリスト（VectorStore.append の invalid 用）"""
+    return [item["index"] for item in bad_items]
+
+
+def write_quarantine(base_dir, model_name, start_row, bad_items):
+    """隔離したアイテムを data/<folder>/quarantine.jsonl に追記する"""
+    if not bad_items:
+        return
+    path = os.path.join(base_dir, QUARANTINE_FILENAME)
+    with open(path, "a", encoding="utf-8") as f:
+        for item in bad_items:
+            row = {"model": model_name, "row": start_row + item["index"], "text": item["text"], "error": item["error"]}
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    print(f"⚠️ {model_name}: {len(bad_items)} 件の入力を隔離しました（ゼロベクトルで保存）: {path}")
+
+
+def stream_to_store(base_dir, input_csv, chunk_size, resume=False):
+    """
+    args.csv をチャンクごとに読み、埋め込んでストアへ追記する。
+    ピークメモリはチャンクサイズ × モデル数 × 次元数に比例する。
+    """
+    store = VectorStore(base_dir)
+    skip = store.num_rows if (resume and store.exists()) else 0
+    if not skip:
+        store.reset()
+    else:
+        print(f"⏩ コミット済みの {skip} 行をスキップして再開します")
+
+    failed = set(m for m in MODELS if resume and store.num_rows and model_key(m) not in store.model_keys())
+    # 最初のチャンクを埋め込んでいる間に、残りのローカルモデルを読み込んでおく
+    preload_local_models([m for m in LOCAL_MODELS if m not in failed])
+    processed = 0
+    for chunk in pd.read_csv(input_csv, chunksize=chunk_size):
+        if processed + len(chunk) <= skip:
+            processed += len(chunk)
+            continue
+        chunk = chunk.iloc[max(0, skip - processed):]
+        processed = chunk.index[-1] + 1
+        texts = chunk["argument"].astype(str).tolist()
+        print(f"  🔄 {processed} 件目まで処理中...")
+
+        vectors_by_model = {}
+        invalid = {}
+        for model_name in MODELS:
+            if model_name in failed:
+                continue
+            key = model_key(model_name)
+            try:
+                bad_items = []
+                dim = store.dim(key) if key in store.model_keys() else None
+                vectors_by_model[key] = embed_batch(texts, model_name, bad_items, dim)
+                invalid[key] = invalid_rows(bad_items)
+                write_quarantine(base_dir, model_name, chunk.index[0], bad_items)
+            except Exception as e:
+                # 従来モードと同じく、失敗したモデルは以降スキップする
+                metrics.incr("model_failures", model=model_name)
+                print(f"❌ モデル {model_name} でエラーが発生しました: {e}")
+                failed.add(model_name)
+                vectors_by_model.pop(key, None)
+                invalid.pop(key, None)
+                if key in store.model_keys():
+                    store.drop_model(key)
+
+        store.append(chunk.to_dict(orient="records"), vectors_by_model, invalid)
+
+    print(f"📦 ストアへ保存: {store.dir} ({store.num_rows} 行, モデル: {store.model_keys()})")
+    return store
+
+
+def embed_folder(folder, batch_size=100):
+    """
+    data/<folder>/args.csv を全モデルで埋め込み、従来どおり pkl に保存する。
+    結果 (texts / embeddings の dict) をそのまま返すので、後段のステージはメモリ上で受け取れる
+    """
+    base_dir = os.path.join(os.path.dirname(__file__), "data", folder)
     input_csv = os.path.join(base_dir, "args.csv")
     if not os.path.exists(input_csv):
         raise FileNotFoundError(f"指定された CSV が見つかりません: {input_csv}")
@@ -30,45 +166,89 @@ def main():
     # CSV 読み込み ("argument" カラムを想定)
     df = pd.read_csv(input_csv)
     texts = df["argument"].astype(str).tolist()
+    # 1 つ目のモデルで埋め込んでいる間に、後続のローカルモデルを読み込んでおく
+    preload_local_models(LOCAL_MODELS)
 
+    # テキスト＋全モデルの埋め込みを一つにまとめて保存
+    combined = {
+        "texts": texts,
+        "embeddings": {m.replace('/', '_'): None for m in MODELS},
+        # モデルごとの隔離した行（ゼロベクトルで保存した行）の位置
+        "invalid": {},
+    }
     for model_name in MODELS:
+        key = model_name.replace('/', '_')
+        out_path = os.path.join(base_dir, f"embeddings_{key}.pkl")
         print(f"📦 モデル {model_name} で埋め込み中...")
         try:
             vectors = []
-            for i, text in enumerate(texts):
-                if i % 100 == 0:
-                    print(f"  🔄 {i}/{len(texts)} 件目を処理中...")
-                if model_name.startswith("openai/"):
-                    vec = request_to_embed(text, model_name.replace("openai/", ""))[0]
-                else:
-                    vec = request_to_local_embed(text, model_name)
-                vectors.append(vec)
-
-            out_path = os.path.join(base_dir, f"embeddings_{model_name.replace('/', '_')}.pkl")
-            with open(out_path, "wb") as f:
-                pickle.dump(vectors, f)
+            invalid = []
+            for i in range(0, len(texts), batch_size):
+                print(f"  🔄 {i}/{len(texts)} 件目を処理中...")
+                bad_items = []
+                vectors.extend(embed_batch(texts[i:i + batch_size], model_name, bad_items).tolist())
+                invalid.extend(i + row for row in invalid_rows(bad_items))
+                write_quarantine(base_dir, model_name, i, bad_items)
+
+            with metrics.span("store.write", artifact="embeddings"):
+                dump_pickle(vectors, out_path)
             print(f"✅ 埋め込み結果を保存: {out_path}")
+            combined["embeddings"][key] = vectors
+            if invalid:
+                combined["invalid"][key] = invalid
 
         except Exception as e:
+            metrics.incr("model_failures", model=model_name)
             print(f"❌ モデル {model_name} でエラーが発生しました: {e}")
+            # 以前の実行で保存済みのベクトルがあればそれを使う
+            if os.path.exists(out_path):
+                with metrics.span("store.read", artifact="embeddings"):
+                    combined["embeddings"][key] = load_pickle(out_path)
             continue  # 次のモデルへ進む
 
-    # テキスト＋全モデルの埋め込みを一つにまとめて保存
-    combined = {
-        "texts": texts,
-        "embeddings": {m.replace('/', '_'): None for m in MODELS},
-    }
-    # 個別ファイルに保存したベクトルをまとめて読み込む
-    for model_name in MODELS:
-        key = model_name.replace('/', '_')
-        with open(os.path.join(base_dir, f"embeddings_{key}.pkl"), "rb") as f:
-            combined["embeddings"][key] = pickle.load(f)
-
-    combined_path = os.path.join(base_dir, f"embedded_items_{args.folder}.pkl")
-    with open(combined_path, "wb") as f:
-        pickle.dump(combined, f)
+    combined_path = os.path.join(base_dir, f"embedded_items_{folder}.pkl")
+    with metrics.span("store.write", artifact="embedded_items"):
+        dump_pickle(combined, combined_path)
     print(f"📦 全モデル結果まとめ保存: {combined_path}")
+    return combined
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フォルダ名を指定して埋め込みを実行します")
+    parser.add_argument(
+        "folder",
+        help="data 配下のサブフォルダ名 (例: overflow, sample)",
+    )
+    parser.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    parser.add_argument("--stream", action="store_true", help="CSV をチャンク単位で読み、結果を直接ストアへ追記する")
+    parser.add_argument("--chunk-size", type=int, default=256, help="ストリーミング時のチャンク行数")
+    parser.add_argument("--resume", action="store_true", help="ストリーミング時、コミット済みの行から再開する")
+    parser.add_argument(
+        "--parquet", action="store_true", help="カテゴリ別の Parquet データセット (dataset/) も書き出す（pyarrow が必要）"
+    )
+    args = parser.parse_args()
+
+    if args.stream:
+        # データフォルダパス
+        base_dir = os.path.join(os.path.dirname(__file__), "data", args.folder)
+        input_csv = os.path.join(base_dir, "args.csv")
+        if not os.path.exists(input_csv):
+            raise FileNotFoundError(f"指定された CSV が見つかりません: {input_csv}")
+        store = stream_to_store(base_dir, input_csv, args.chunk_size, resume=args.resume)
+    else:
+        embed_folder(args.folder)
+        if args.parquet:
+            base_dir = os.path.join(os.path.dirname(__file__), "data", args.folder)
+            store = VectorStore.import_combined(base_dir, args.folder)
+
+    if args.parquet:
+        from parquet_export import export_parquet
+
+        print(f"🗃️ Parquet データセットを保存: {export_parquet(store)}")
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "embed_items")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
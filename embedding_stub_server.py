@@ -0,0 +1,425 @@
+"""
+OpenAI / Azure OpenAI 互換の埋め込みスタブサーバー
+
+オフライン環境でのロードテスト用。`/v1/embeddings` と Azure 形式の
+`/openai/deployments/<deployment>/embeddings` を実装し、テキストのハッシュから
+決定的なベクトルを返す。レイテンシ分布・レート制限 (429)・障害注入を設定できる。
+
+llm.py から使う場合:
+    OPENAI_API_KEY=dummy OPENAI_EMBEDDING_BASE_URL=http://127.0.0.1:8000/v1
+    (Azure の場合は AZURE_EMBEDDING_ENDPOINT=http://127.0.0.1:8000)
+
+Batch API の代わりには、ディレクトリだけで動く FileBatchStub を使う（batch_embed.py --backend stub）。
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# モデルごとの既定次元数（未登録モデルは --dim の値）
+MODEL_DIMS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
+AZURE_PATH = re.compile(r"^/openai/deployments/([^/]+)/embeddings$")
+
+
+def hash_embedding(text, model, dim):
+    """(model, text) から決定的な単位ベクトルを生成"""
+    digest = hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(digest[:8], "little"))
+    vec = rng.standard_normal(dim).astype(np.float32)
+    vec /= np.linalg.norm(vec)
+    return vec
+
+
+def estimate_tokens(text):
+    # 厳密なトークナイザは使わず、文字数ベースの概算
+    return max(1, len(text) // 2)
+
+
+class StubConfig:
+    def __init__(
+        self,
+        dim=1536,
+        latency_dist="none",
+        latency_ms=50.0,
+        latency_sigma=0.5,
+        rate_limit_rps=0.0,
+        rate_limit_burst=10,
+        failure_rate=0.0,
+        max_input_chars=0,
+        max_batch=2048,
+        seed=0,
+    ):
+        self.dim = dim
+        self.latency_dist = latency_dist
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rps = rate_limit_rps
+        self.rate_limit_burst = rate_limit_burst
+        self.failure_rate = failure_rate
+        self.max_input_chars = max_input_chars
+        self.max_batch = max_batch
+        self.seed = seed
+
+
+class StubState:
+    """レート制限のトークンバケットと統計カウンタ"""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.rng = random.Random(config.seed)
+        self.tokens = float(config.rate_limit_burst)
+        self.last_refill = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "failed": 0, "bad_request": 0, "inputs": 0}
+
+    def take_rate_token(self):
+        if self.config.rate_limit_rps <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                float(self.config.rate_limit_burst),
+                self.tokens + (now - self.last_refill) * self.config.rate_limit_rps,
+            )
+            self.last_refill = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+    def sample_latency(self):
+        cfg = self.config
+        with self.lock:
+            if cfg.latency_dist == "fixed":
+                ms = cfg.latency_ms
+            elif cfg.latency_dist == "uniform":
+                ms = self.rng.uniform(0, 2 * cfg.latency_ms)
+            elif cfg.latency_dist == "lognormal":
+                # 中央値が latency_ms になる対数正規分布（裾の重いレイテンシ）
+                ms = cfg.latency_ms * self.rng.lognormvariate(0, cfg.latency_sigma)
+            else:
+                ms = 0.0
+        return ms / 1000.0
+
+    def should_fail(self):
+        if self.config.failure_rate <= 0:
+            return False
+        with self.lock:
+            return self.rng.random() < self.config.failure_rate
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+
+class EmbeddingStubHandler(BaseHTTPRequestHandler):
+    server_version = "EmbeddingStub/1.0"
+
+    def log_message(self, format, *args):
+        # リクエストごとのアクセスログは出さない（ロードテスト時にうるさいため）
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, message, err_type, code=None, headers=None):
+        self._send_json(status, {"error": {"message": message, "type": err_type, "param": None, "code": code}}, headers)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path.rstrip("/") == "/stats":
+            with state.lock:
+                self._send_json(200, dict(state.stats))
+        elif self.path.rstrip("/") == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_error(404, f"Unknown path: {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        state = self.server.state
+        cfg = state.config
+        path = self.path.split("?", 1)[0].rstrip("/")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+
+        azure = AZURE_PATH.match(path)
+        if path not in ("/v1/embeddings", "/embeddings") and not azure:
+            self._send_error(404, f"Unknown path: {self.path}", "invalid_request_error")
+            return
+
+        state.count("requests")
+        if not state.take_rate_token():
+            state.count("rate_limited")
+            self._send_error(
+                429,
+                "Rate limit reached for requests (stub)",
+                "requests",
+                "rate_limit_exceeded",
+                headers={"Retry-After": "1", "x-ratelimit-remaining-requests": "0"},
+            )
+            return
+
+        time.sleep(state.sample_latency())
+
+        if state.should_fail():
+            state.count("failed")
+            self._send_error(500, "The server had an error while processing your request (injected)", "server_error")
+            return
+
+        try:
+            body = json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            state.count("bad_request")
+            self._send_error(400, "Invalid JSON body", "invalid_request_error")
+            return
+
+        model = azure.group(1) if azure else body.get("model")
+        if not model:
+            state.count("bad_request")
+            self._send_error(400, "you must provide a model parameter", "invalid_request_error")
+            return
+
+        inputs = body.get("input")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        if not isinstance(inputs, list) or not inputs:
+            state.count("bad_request")
+            self._send_error(400, "'input' must be a non-empty string or array", "invalid_request_error")
+            return
+        if len(inputs) > cfg.max_batch:
+            state.count("bad_request")
+            self._send_error(400, f"Too many inputs. The max number of inputs is {cfg.max_batch}.", "invalid_request_error")
+            return
+
+        texts = [x if isinstance(x, str) else json.dumps(x) for x in inputs]
+        for i, text in enumerate(texts):
+            if not text or (cfg.max_input_chars and len(text) > cfg.max_input_chars):
+                state.count("bad_request")
+                self._send_error(400, f"Invalid input at index {i}", "invalid_request_error", "invalid_input")
+                return
+
+        dim = int(body.get("dimensions") or MODEL_DIMS.get(model, cfg.dim))
+        use_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(texts):
+            vec = hash_embedding(text, model, dim)
+            emb = base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii") if use_base64 else vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": emb})
+
+        tokens = sum(estimate_tokens(t) for t in texts)
+        state.count("ok")
+        state.count("inputs", len(texts))
+        self._send_json(
+            200,
+            {
+                "object": "list",
+                "data": data,
+                "model": model,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            },
+        )
+
+
+class FileBatchStub:
+    """
+    Batch API（files / batches）のファイルベースの代役。状態はすべて root 以下に置くので、
+    プロセスを再起動しても続きから問い合わせられる。
+    retrieve() が polls_to_complete 回呼ばれた時点で入力を処理し、成功した要求を出力ファイルに、
+    失敗した要求（failure_rate の確率で 500、空・長すぎる入力で 400）をエラーファイルに書く。
+    出力の行順は入力と逆にする（実際の Batch API も順序を保証しない）
+    """
+
+    def __init__(self, root, config=None, polls_to_complete=2):
+        self.root = os.fspath(root)
+        self.config = config or StubConfig()
+        self.polls_to_complete = polls_to_complete
+        for sub in ("files", "batches"):
+            os.makedirs(os.path.join(self.root, sub), exist_ok=True)
+
+    def _file_path(self, file_id):
+        return os.path.join(self.root, "files", f"{file_id}.jsonl")
+
+    def _batch_path(self, batch_id):
+        return os.path.join(self.root, "batches", f"{batch_id}.json")
+
+    def _save_batch(self, batch):
+        tmp = self._batch_path(batch["id"]) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(batch, f)
+        os.replace(tmp, self._batch_path(batch["id"]))
+
+    def upload(self, path):
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with open(path, "rb") as src, open(self._file_path(file_id), "wb") as dst:
+            dst.write(src.read())
+        return file_id
+
+    def create(self, file_id, metadata=None):
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "input_file_id": file_id,
+            "metadata": metadata,
+            "status": "validating",
+            "polls": 0,
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": None,
+        }
+        self._save_batch(batch)
+        return batch["id"]
+
+    def find(self, file_id, metadata):
+        for name in os.listdir(os.path.join(self.root, "batches")):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.root, "batches", name), encoding="utf-8") as f:
+                batch = json.load(f)
+            if batch["input_file_id"] == file_id and batch["metadata"] == metadata:
+                return batch["id"]
+        return None
+
+    def retrieve(self, batch_id):
+        with open(self._batch_path(batch_id), encoding="utf-8") as f:
+            batch = json.load(f)
+        if batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+            batch["polls"] += 1
+            if batch["polls"] >= self.polls_to_complete:
+                self._process(batch)
+            else:
+                batch["status"] = "in_progress"
+            self._save_batch(batch)
+        return {k: batch[k] for k in ("status", "output_file_id", "error_file_id", "request_counts")}
+
+    def download(self, file_id, dest):
+        with open(self._file_path(file_id), "rb") as src, open(dest, "wb") as dst:
+            dst.write(src.read())
+
+    def _process(self, batch):
+        cfg = self.config
+        ok, failed = [], []
+        with open(self._file_path(batch["input_file_id"]), encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        for req in requests:
+            body = req["body"]
+            model = body["model"]
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            result = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": req["custom_id"], "error": None}
+            seed = hashlib.sha256(f"{cfg.seed}\0{req['custom_id']}".encode("utf-8")).digest()
+            if cfg.failure_rate > 0 and int.from_bytes(seed[:8], "little") / 2 ** 64 < cfg.failure_rate:
+                result["response"] = {"status_code": 500, "body": {"error": {
+                    "message": "The server had an error while processing your request (injected)", "type": "server_error",
+                }}}
+                failed.append(result)
+                continue
+            bad = [i for i, t in enumerate(inputs) if not t or (cfg.max_input_chars and len(t) > cfg.max_input_chars)]
+            if bad or len(inputs) > cfg.max_batch:
+                result["response"] = {"status_code": 400, "body": {"error": {
+                    "message": f"Invalid input at index {bad[0] if bad else cfg.max_batch}",
+                    "type": "invalid_request_error", "code": "invalid_input",
+                }}}
+                failed.append(result)
+                continue
+            dim = int(body.get("dimensions") or MODEL_DIMS.get(model, cfg.dim))
+            use_base64 = body.get("encoding_format") == "base64"
+            data = []
+            for i, text in enumerate(inputs):
+                vec = hash_embedding(text, model, dim)
+                emb = base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii") if use_base64 else vec.tolist()
+                data.append({"object": "embedding", "index": i, "embedding": emb})
+            tokens = sum(estimate_tokens(t) for t in inputs)
+            result["response"] = {
+                "status_code": 200,
+                "body": {"object": "list", "data": data, "model": model, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}},
+            }
+            ok.append(result)
+
+        for kind, results in (("output_file_id", ok), ("error_file_id", failed)):
+            if not results:
+                continue
+            file_id = f"file-{uuid.uuid4().hex[:24]}"
+            with open(self._file_path(file_id), "w", encoding="utf-8") as f:
+                for result in reversed(results):
+                    f.write(json.dumps(result) + "\n")
+            batch[kind] = file_id
+        batch["status"] = "completed"
+        batch["request_counts"] = {"total": len(requests), "completed": len(ok), "failed": len(failed)}
+
+
+def make_server(host="127.0.0.1", port=8000, config=None):
+    server = ThreadingHTTPServer((host, port), EmbeddingStubHandler)
+    server.daemon_threads = True
+    server.state = StubState(config or StubConfig())
+    return server
+
+
+def serve_in_background(host="127.0.0.1", port=0, config=None):
+    """ベンチマーク・テストからスレッドで起動する。(server, base_url) を返す"""
+    server = make_server(host, port, config)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 互換の埋め込みスタブサーバーを起動します")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--dim", type=int, default=1536, help="未登録モデルの次元数")
+    parser.add_argument("--latency-dist", choices=["none", "fixed", "uniform", "lognormal"], default="none")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="レイテンシの基準値 (ms)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal の σ")
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0, help="許容リクエスト/秒 (0 で無制限)")
+    parser.add_argument("--rate-limit-burst", type=int, default=10)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="500 を返す確率")
+    parser.add_argument("--max-input-chars", type=int, default=0, help="超過した入力で 400 を返す (0 で無制限)")
+    parser.add_argument("--max-batch", type=int, default=2048)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        dim=args.dim,
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        rate_limit_rps=args.rate_limit_rps,
+        rate_limit_burst=args.rate_limit_burst,
+        failure_rate=args.failure_rate,
+        max_input_chars=args.max_input_chars,
+        max_batch=args.max_batch,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config)
+    print(f"🧪 埋め込みスタブサーバー起動: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 停止しました")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,18 @@
 import os
-import pickle
 import argparse
 import pandas as pd
 from pathlib import Path
-from llm import request_to_embed, request_to_local_embed
-from embed_items import MODELS  # 同じモデル一覧を共有
+import metrics
+from artifact_io import dump_pickle, load_pickle
+from embed_items import MODELS, embed_batch  # 同じモデル一覧を共有
 
-def main():
-    parser = argparse.ArgumentParser(description="キーワードを複数モデルで埋め込み")
-    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
-    args = parser.parse_args()
 
-    base_dir = Path(__file__).parent / "data" / args.folder
+def embed_keywords(folder):
+    """
+    keyword.csv の各キーワードを全モデルで埋め込み、キャッシュと keyword_embed_<model>.pkl を保存する。
+    {model_key: {keyword: vector}} を返す
+    """
+    base_dir = Path(__file__).parent / "data" / folder
     base_dir.mkdir(parents=True, exist_ok=True)
     keyword_path = base_dir / "keyword.csv"
     if not keyword_path.exists():
@@ -20,6 +21,7 @@ def main():
     df = pd.read_csv(keyword_path)
     keywords = df["keyword" if "keyword" in df.columns else "キーワード"].dropna().unique().tolist()
 
+    keyword_embeddings = {}
     for model_name in MODELS:
         model_key = model_name.replace("/", "_")
         cache_path = base_dir / f"embed_cache_{model_key}.pkl"
@@ -27,35 +29,50 @@ def main():
 
         # キャッシュ読み込み
         if cache_path.exists():
-            with open(cache_path, "rb") as f:
-                embed_cache = pickle.load(f)
+            with metrics.span("store.read", artifact="embed_cache"):
+                embed_cache = load_pickle(cache_path)
         else:
             embed_cache = {}
 
-        # 埋め込み取得
-        results = {}
+        # 埋め込み取得（キャッシュにないものだけまとめて取得）
+        missing = []
         for kw in keywords:
             if kw in embed_cache:
-                vec = embed_cache[kw]
+                metrics.incr("keyword_cache_hits", model=model_name)
                 print(f"✅ キャッシュ使用: {kw}")
             else:
                 print(f"🆕 埋め込み取得: {kw}")
-                if model_name.startswith("openai/"):
-                    vec = request_to_embed([kw], model_name.replace("openai/", ""))[0]
-                else:
-                    vec = request_to_local_embed([kw], model_name)[0]
+                metrics.incr("keyword_cache_misses", model=model_name)
+                missing.append(kw)
+        if missing:
+            for kw, vec in zip(missing, embed_batch(missing, model_name).tolist()):
                 embed_cache[kw] = vec
-            results[kw] = vec
+        results = {kw: embed_cache[kw] for kw in keywords}
 
         # キャッシュ保存
-        with open(cache_path, "wb") as f:
-            pickle.dump(embed_cache, f)
+        with metrics.span("store.write", artifact="embed_cache"):
+            dump_pickle(embed_cache, cache_path)
 
         # 結果保存
-        with open(out_path, "wb") as f:
-            pickle.dump(results, f)
+        with metrics.span("store.write", artifact="keyword_embed"):
+            dump_pickle(results, out_path)
 
         print(f"✅ 出力完了: {out_path}")
+        keyword_embeddings[model_key] = results
+
+    return keyword_embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="キーワードを複数モデルで埋め込み")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    args = parser.parse_args()
+
+    embed_keywords(args.folder)
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "generate_axis_embeddings")
 
 if __name__ == "__main__":
     main()
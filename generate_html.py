@@ -1,32 +1,27 @@
 import argparse
-import json
-import pickle
 from pathlib import Path
 from llm import request_to_local_embed, request_to_embed
 
-from embed_items import MODELS
-# Plotly ライブラリ
-import plotly.graph_objects as go
+from build_overview import overview_in_csv_order
+from vector_store import VectorStore, load_embedded_items
+import numpy as np
 import pandas as pd
+import metrics
+from artifact_io import dump_pickle, load_pickle, precompress
+from json_stream import StreamArray, StreamObject, write_json, write_template
 
 
-def main():
-    parser = argparse.ArgumentParser(description="フォルダ単位でインタラクティブHTMLを生成します")
-    parser.add_argument(
-        "folder",
-        help="data 配下のサブフォルダ名 (例: overflow, sample)"
-    )
-    args = parser.parse_args()
-
+def build_interactive_html(folder, data=None, chunk_rows=1000, precompressed=False):
+    """
+    <folder>_interactive.html を生成する。data を渡せば埋め込みを読み直さない。
+    precompressed=True なら静的ホスティング用の .gz / .br も書く
+    """
     # フォルダパス設定
-    base_dir = Path(__file__).parent / "data" / args.folder
-    combined_path = base_dir / f"embedded_items_{args.folder}.pkl"
-    if not combined_path.exists():
-        raise FileNotFoundError(f"埋め込みまとめファイルが見つかりません: {combined_path}")
-
-    # 埋め込み結果読み込み
-    with open(combined_path, "rb") as f:
-        data = pickle.load(f)
+    base_dir = Path(__file__).parent / "data" / folder
+
+    # 埋め込み結果読み込み（pkl またはストリーミングモードのストア）
+    if data is None:
+        data = load_embedded_items(base_dir, folder)
     texts = data["texts"]            # リスト of str
     embeddings = data["embeddings"]  # dict: {model_key: list[vectors]}
 
@@ -52,11 +47,13 @@ def main():
         cache_path = base_dir / f"keyword_embed_{model_key}.pkl"
         if cache_path.exists():
             print(f"📦 キャッシュ読み込み: {cache_path.name}")
-            with open(cache_path, "rb") as f:
-                keyword_embeddings[model_key] = pickle.load(f)
+            metrics.incr("keyword_cache_hits", model=model_key)
+            with metrics.span("store.read", artifact="keyword_embed"):
+                keyword_embeddings[model_key] = load_pickle(cache_path)
             continue
 
         print(f"🔤 軸ベクトル作成中: {model_name}")
+        metrics.incr("keyword_cache_misses", model=model_key)
         model_embeds = {}
         for axis in axis_names:
             left_words = axis_keywords[axis]["left"]
@@ -79,26 +76,40 @@ def main():
         keyword_embeddings[model_key] = model_embeds
 
         # キャッシュ保存
-        with open(cache_path, "wb") as f:
-            pickle.dump(model_embeds, f)
+        dump_pickle(model_embeds, cache_path)
+
+    # 概観レイアウト（build_overview.py の PCA 座標）。あれば PC1 × PC2 をそのまま描ける
+    overview = {}
+    store = VectorStore(base_dir)
+    if store.exists() and store.num_rows == len(texts):
+        for model_key in embeddings.keys():
+            if model_key in store.model_keys():
+                coords = overview_in_csv_order(store, model_key)
+                if coords is not None:
+                    # 隔離した行の座標は NaN なので null にして描かない
+                    xy = coords[:, :2].astype("float64").round(5)
+                    overview[model_key] = [[None, None] if np.isnan(row).any() else row for row in xy]
 
     # HTML 出力先
-    out_html = base_dir / f"{args.folder}_interactive.html"
-
-    # JSON ペイロード
-    payload = {
-        "texts": texts,
-        "embeddings": embeddings,
-        "models": list(embeddings.keys()),
-        "axes": axis_names,
-        "keyword_embeddings": keyword_embeddings,
-        "axis_keywords": axis_keywords,
-    }
-    json_path = base_dir / f"interactive_payload_{args.folder}.json"
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False)
-
-    # HTML テンプレート
+    out_html = base_dir / f"{folder}_interactive.html"
+
+    # JSON ペイロード（texts と embeddings は行単位で書き出す）
+    def make_payload():
+        return StreamObject([
+            ("texts", StreamArray(texts)),
+            ("embeddings", StreamObject((k, StreamArray(v)) for k, v in embeddings.items())),
+            ("models", list(embeddings.keys())),
+            ("axes", axis_names),
+            ("keyword_embeddings", keyword_embeddings),
+            ("axis_keywords", axis_keywords),
+            ("overview", StreamObject((k, StreamArray(v)) for k, v in overview.items())),
+        ])
+
+    json_path = base_dir / f"interactive_payload_{folder}.json"
+    with metrics.span("html.serialize", artifact="payload_json"), open(json_path, "w", encoding="utf-8") as f:
+        write_json(f, make_payload(), chunk_rows, ensure_ascii=False)
+
+    # HTML テンプレート（__PAYLOAD__ の位置にペイロードを書き出す）
     html = [
         "<!DOCTYPE html>",
         "<html lang='ja'><head><meta charset='UTF-8'><title>Interactive Scatter</title>",
@@ -124,7 +135,8 @@ def main():
         "モデル: <select id='model-select'></select>&nbsp;",
         "X軸テーマ: <select id='x-axis'></select>&nbsp;",
         "Y軸テーマ: <select id='y-axis'></select>&nbsp;",
-        "<button onclick='draw()'>描画</button>",
+        "<button onclick='draw()'>描画</button>&nbsp;",
+        "<button id='overview-button' onclick='drawOverview()'>概観 (PCA)</button>",
         "</div>",
         "<div id='plot' style='width:100%;height:80vh;'></div>",
         "<div id='labels-table'>",
@@ -140,7 +152,7 @@ def main():
         "  <div></div>",
         "</div>",
         "<script>",
-        f"const payload = {json.dumps(payload)};",
+        "const payload = __PAYLOAD__;",
         "payload.models.forEach(m => document.getElementById('model-select').innerHTML += `<option value='${m}'>${m}</option>`);",
         "payload.axes.forEach(a => {",
         "  document.getElementById('x-axis').innerHTML += `<option value='${a}'>${a}</option>`;",
@@ -166,15 +178,46 @@ def main():
         "  document.getElementById('y-top').innerText = '↑ ' + topY;",
         "  document.getElementById('y-bottom').innerText = bottomY + ' ↓';",
         "}",
+        "function drawOverview(){",
+        "  const model = document.getElementById('model-select').value;",
+        "  const coords = payload.overview[model];",
+        "  if (!coords) { alert('このモデルの概観レイアウトがありません (python build_overview.py <folder>)'); return; }",
+        "  const trace = { x: coords.map(c => c[0]), y: coords.map(c => c[1]), mode: 'markers', text: payload.texts, type: 'scatter' };",
+        "  Plotly.newPlot('plot', [trace], { margin: { t: 30 } });",
+        "  document.getElementById('x-left').innerText = '← PC1';",
+        "  document.getElementById('x-right').innerText = 'PC1 →';",
+        "  document.getElementById('y-top').innerText = '↑ PC2';",
+        "  document.getElementById('y-bottom').innerText = 'PC2 ↓';",
+        "}",
         "</script>",
         "</body></html>"
     ]
 
 
-    with open(out_html, "w", encoding="utf-8") as f:
-        f.write("\n".join(html))
+    with metrics.span("html.write", artifact="interactive_html"), open(out_html, "w", encoding="utf-8") as f:
+        write_template(f, "\n".join(html), {"__PAYLOAD__": make_payload()}, chunk_rows)
+    if precompressed:
+        for path in (json_path, out_html):
+            precompress(path)
 
     print(f"✅ インタラクティブ HTML を生成しました: {out_html}")
+    return out_html
+
+
+def main():
+    parser = argparse.ArgumentParser(description="フォルダ単位でインタラクティブHTMLを生成します")
+    parser.add_argument(
+        "folder",
+        help="data 配下のサブフォルダ名 (例: overflow, sample)"
+    )
+    parser.add_argument("--precompress", action="store_true", help="静的ホスティング用の .gz / .br も出力する")
+    parser.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    args = parser.parse_args()
+
+    build_interactive_html(args.folder, precompressed=args.precompress)
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "generate_html")
 
 
 if __name__ == '__main__':
@@ -1,56 +1,13 @@
 import argparse
-import pickle
-import json
 from pathlib import Path
 import pandas as pd
+import metrics
+from artifact_io import load_pickle, precompress
+from json_stream import StreamArray, StreamObject, write_template
+from vector_store import load_embedded_items
 
-def main():
-    parser = argparse.ArgumentParser(description="embedding_explorer.html を生成")
-    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
-    args = parser.parse_args()
-
-    base_dir = Path(__file__).parent / "data" / args.folder
-    item_path = base_dir / f"embedded_items_{args.folder}.pkl"
-
-    with open(item_path, "rb") as f:
-        items_data = pickle.load(f)
-
-    args_path = base_dir / "args.csv"
-    if args_path.exists():
-        df = pd.read_csv(args_path)
-    else:
-        df = pd.DataFrame({"argument": items_data["texts"]})
-        df["カテゴリ"] = "カテゴリA"
-        df["絵文字"] = "□"
-
-    items = [
-        {
-            "内容": df["argument"][i],
-            "絵文字": df["絵文字"][i] if "絵文字" in df else "□",
-            "カテゴリ": df["カテゴリ"][i] if "カテゴリ" in df else "カテゴリA",
-            **{k: v[i] for k, v in items_data["embeddings"].items()}
-        }
-        for i in range(len(items_data["texts"]))
-    ]
-
-    keyword_data = {}
-    for model_key in items_data["embeddings"].keys():
-        model_path = base_dir / f"keyword_embed_{model_key}.pkl"
-        if not model_path.exists():
-            print(f"⚠️ keyword_embed_{model_key}.pkl が見つかりません。スキップ。")
-            continue
-        with open(model_path, "rb") as f:
-            emb = pickle.load(f)
-        for kw, vec in emb.items():
-            keyword_data.setdefault(kw, {})[model_key] = vec
-
-    models = list(items_data["embeddings"].keys())
-    categories = sorted(df["カテゴリ"].unique().tolist())
-    items_json = json.dumps(items, ensure_ascii=False)
-    keyword_json = json.dumps(keyword_data, ensure_ascii=False)
-    categories_json = json.dumps(categories, ensure_ascii=False)
-
-    html = f"""
+# JSON データは __KEYWORD_DATA__ / __ITEMS__ / __CATEGORIES__ の位置に書き出す
+HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="ja">
 <head>
@@ -58,8 +15,8 @@ def main():
   <title>意味空間 Explorer</title>
   <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
   <style>
-    body {{ font-family: sans-serif; margin: 0; padding: 0; }}
-    .description {{
+    body { font-family: sans-serif; margin: 0; padding: 0; }
+    .description {
       max-width: 1000px;
       margin: 0.3em auto 0.5em auto;
       font-size: 0.95rem;
@@ -67,40 +24,40 @@ def main():
       text-align: center;
       white-space: nowrap;
       overflow-x: auto;
-    }}
-    .control-panel {{
+    }
+    .control-panel {
       display: flex;
       flex-direction: column;
       align-items: center;
       margin-bottom: 0.5em;
-    }}
-    .axis-grid {{
+    }
+    .axis-grid {
       display: grid;
       grid-template-columns: auto auto auto;
       grid-template-rows: auto auto auto;
       gap: 0.2em;
       margin-bottom: 0.4em;
       font-size: 0.95rem;
-    }}
-    .axis-grid > * {{ text-align: center; }}
-    .checkboxes {{
+    }
+    .axis-grid > * { text-align: center; }
+    .checkboxes {
       display: flex;
       flex-wrap: wrap;
       gap: 0.8em;
       justify-content: center;
       margin-bottom: 0.5em;
-    }}
-    .control-row {{
+    }
+    .control-row {
       display: flex;
       align-items: center;
       gap: 0.5em;
       margin-bottom: 0.3em;
-    }}
-    select, button, label {{
+    }
+    select, button, label {
       font-size: 0.95rem;
       padding: 0.2em;
       margin: 0.1em;
-    }}
+    }
   </style>
 </head>
 <body>
@@ -132,39 +89,39 @@ def main():
   <div id="plot" style="width:90vw; height:60vh;"></div>
 
   <script>
-    const keywordData = {keyword_json};
-    const items = {items_json};
-    const categories = {categories_json};
+    const keywordData = __KEYWORD_DATA__;
+    const items = __ITEMS__;
+    const categories = __CATEGORIES__;
     const keys = Object.keys(keywordData);
     const models = Object.keys(keywordData[keys[0]]);
 
     const modelSel = document.getElementById("model");
-    models.forEach(m => {{
+    models.forEach(m => {
       const opt = document.createElement("option");
       opt.value = m;
       opt.textContent = m;
       modelSel.appendChild(opt);
-    }});
+    });
     modelSel.value = models[0];
 
-    function fillSelect(id, options, defaultValue) {{
+    function fillSelect(id, options, defaultValue) {
       const sel = document.getElementById(id);
       sel.innerHTML = "";
-      options.forEach(v => {{
+      options.forEach(v => {
         const opt = document.createElement("option");
         opt.value = v;
         opt.textContent = v;
         if (v === defaultValue) opt.selected = true;
         sel.appendChild(opt);
-      }});
-    }}
+      });
+    }
     fillSelect("x0", keys, "甘い");
     fillSelect("x1", keys, "辛い");
     fillSelect("y0", keys, "冷たい");
     fillSelect("y1", keys, "熱い");
 
     const categoryBox = document.getElementById("category-box");
-    categories.forEach(cat => {{
+    categories.forEach(cat => {
       const label = document.createElement("label");
       const checkbox = document.createElement("input");
       checkbox.type = "checkbox";
@@ -173,17 +130,17 @@ def main():
       label.appendChild(checkbox);
       label.appendChild(document.createTextNode(cat));
       categoryBox.appendChild(label);
-    }});
+    });
 
-    function normalize(vec) {{
+    function normalize(vec) {
       const norm = Math.sqrt(vec.reduce((a,b) => a + b*b, 0));
       return vec.map(x => x / norm);
-    }}
-    function dot(vec1, vec2) {{
+    }
+    function dot(vec1, vec2) {
       return vec1.reduce((a,b,i) => a + b * vec2[i], 0);
-    }}
+    }
 
-    function updatePlot() {{
+    function updatePlot() {
       const x0 = document.getElementById("x0").value;
       const x1 = document.getElementById("x1").value;
       const y0 = document.getElementById("y0").value;
@@ -195,25 +152,25 @@ def main():
       const axisY = normalize(keywordData[y0][model].map((v, i) => v - keywordData[y1][model][i]));
 
       const xs = [], ys = [], texts = [], hovers = [];
-      for (const row of items) {{
+      for (const row of items) {
         if (!row[model]) continue;
         if (!selectedCategories.includes(row["カテゴリ"])) continue;
         xs.push(dot(row[model], axisX));
         ys.push(dot(row[model], axisY));
         texts.push(row["絵文字"] || "□");
         hovers.push(row["内容"]);
-      }}
+      }
 
-      const trace = {{
+      const trace = {
         x: xs, y: ys, text: texts, hovertext: hovers,
-        mode: "text", type: "scatter", textfont: {{ size: 16 }}
-      }};
+        mode: "text", type: "scatter", textfont: { size: 16 }
+      };
 
-      Plotly.newPlot("plot", [trace], {{
-        margin: {{ l: 50, r: 50, t: 20, b: 80 }},
-        xaxis: {{}}, yaxis: {{}}
-      }});
-    }}
+      Plotly.newPlot("plot", [trace], {
+        margin: { l: 50, r: 50, t: 20, b: 80 },
+        xaxis: {}, yaxis: {}
+      });
+    }
 
     updatePlot();
   </script>
@@ -221,9 +178,87 @@ def main():
 </html>
 """
 
+
+def build_explorer_html(folder, items_data=None, keyword_embeddings=None, chunk_rows=1000, precompressed=False):
+    """
+    embedding_explorer.html を生成する。
+    items_data / keyword_embeddings ({model_key: {keyword: vector}}) を渡せばファイルから読み直さない。
+    precompressed=True なら静的ホスティング用の .gz / .br も書く
+    """
+    base_dir = Path(__file__).parent / "data" / folder
+    if items_data is None:
+        items_data = load_embedded_items(base_dir, folder)
+
+    args_path = base_dir / "args.csv"
+    if args_path.exists():
+        df = pd.read_csv(args_path)
+    else:
+        df = pd.DataFrame({"argument": items_data["texts"]})
+        df["カテゴリ"] = "カテゴリA"
+        df["絵文字"] = "□"
+
+    # 行ごとの dict は書き出し時に 1 件ずつ生成する（全件のリストは作らない）
+    contents = df["argument"].tolist()
+    emojis = df["絵文字"].tolist() if "絵文字" in df else None
+    cats = df["カテゴリ"].tolist() if "カテゴリ" in df else None
+
+    def iter_items():
+        for i in range(len(items_data["texts"])):
+            yield {
+                "内容": contents[i],
+                "絵文字": emojis[i] if emojis is not None else "□",
+                "カテゴリ": cats[i] if cats is not None else "カテゴリA",
+                **{k: v[i] for k, v in items_data["embeddings"].items()}
+            }
+
+    keyword_data = {}
+    for model_key in items_data["embeddings"].keys():
+        if keyword_embeddings is not None and model_key in keyword_embeddings:
+            for kw, vec in keyword_embeddings[model_key].items():
+                keyword_data.setdefault(kw, {})[model_key] = vec
+            continue
+        model_path = base_dir / f"keyword_embed_{model_key}.pkl"
+        if not model_path.exists():
+            print(f"⚠️ keyword_embed_{model_key}.pkl が見つかりません。スキップ。")
+            continue
+        with metrics.span("store.read", artifact="keyword_embed"):
+            emb = load_pickle(model_path)
+        for kw, vec in emb.items():
+            keyword_data.setdefault(kw, {})[model_key] = vec
+
+    categories = sorted(df["カテゴリ"].unique().tolist())
+
+    # テンプレートとデータをチャンク単位でファイルへ直接書き出す
     out_path = base_dir / "embedding_explorer.html"
-    out_path.write_text(html, encoding="utf-8")
+    with metrics.span("html.write", artifact="embedding_explorer"), open(out_path, "w", encoding="utf-8") as f:
+        write_template(
+            f,
+            HTML_TEMPLATE,
+            {
+                "__KEYWORD_DATA__": StreamObject(keyword_data),
+                "__ITEMS__": StreamArray(iter_items()),
+                "__CATEGORIES__": categories,
+            },
+            chunk_rows=chunk_rows,
+            ensure_ascii=False,
+        )
+    if precompressed:
+        precompress(out_path)
     print(f"✅ HTML 出力完了: {out_path}")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embedding_explorer.html を生成")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--precompress", action="store_true", help="静的ホスティング用の .gz / .br も出力する")
+    parser.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    args = parser.parse_args()
+
+    build_explorer_html(args.folder, precompressed=args.precompress)
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "generate_interactive_html")
 
 if __name__ == "__main__":
     main()
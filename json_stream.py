@@ -0,0 +1,92 @@
+"""
+大きな JSON をメモリ上で一つの文字列にせず、ファイルへ逐次書き出すための小さなヘルパー
+
+StreamArray / StreamObject で包んだ値だけを要素単位でストリーミングし、
+それ以外の値は json.dumps でまとめて書く。区切り文字は json.dumps の既定値と同じなので、
+出力は json.dumps(obj) と同一になる。
+"""
+import json
+
+ITEM_SEP = ", "
+KEY_SEP = ": "
+
+
+class StreamArray:
+    """要素を 1 つずつ書き出す配列（リスト・ジェネレータ・ndarray など）"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+class StreamObject:
+    """(key, value) を 1 つずつ書き出すオブジェクト"""
+
+    def __init__(self, pairs):
+        self.pairs = pairs.items() if isinstance(pairs, dict) else pairs
+
+
+def _jsonable(value):
+    # numpy 配列・スカラーはリスト・Python の数値に変換
+    return value.tolist() if hasattr(value, "tolist") else value
+
+
+def write_json(f, obj, chunk_rows=1000, **dumps_kwargs):
+    """obj を f に書き出す。chunk_rows 要素ごとにまとめて write する"""
+    if isinstance(obj, StreamArray):
+        f.write("[")
+        buf = []
+        first = True
+        for row in obj.rows:
+            buf.append(_dumps(row, chunk_rows, dumps_kwargs))
+            if len(buf) >= chunk_rows:
+                f.write(("" if first else ITEM_SEP) + ITEM_SEP.join(buf))
+                first = False
+                buf = []
+        if buf:
+            f.write(("" if first else ITEM_SEP) + ITEM_SEP.join(buf))
+        f.write("]")
+    elif isinstance(obj, StreamObject):
+        f.write("{")
+        for i, (key, value) in enumerate(obj.pairs):
+            if i:
+                f.write(ITEM_SEP)
+            f.write(json.dumps(str(key), **dumps_kwargs) + KEY_SEP)
+            write_json(f, value, chunk_rows, **dumps_kwargs)
+        f.write("}")
+    else:
+        f.write(_dumps(obj, chunk_rows, dumps_kwargs))
+
+
+def _dumps(value, chunk_rows, dumps_kwargs):
+    if isinstance(value, (StreamArray, StreamObject)):
+        # 入れ子のストリームは文字列として組み立てる（要素 1 つ分なので小さい前提）
+        parts = []
+        write_json(_ListWriter(parts), value, chunk_rows, **dumps_kwargs)
+        return "".join(parts)
+    return json.dumps(_jsonable(value), **dumps_kwargs)
+
+
+class _ListWriter:
+    def __init__(self, parts):
+        self.parts = parts
+
+    def write(self, s):
+        self.parts.append(s)
+
+
+def write_template(f, template, values, chunk_rows=1000, **dumps_kwargs):
+    """
+    template 中のプレースホルダ（values のキー）を JSON に置き換えながら書き出す。
+    プレースホルダ以外の部分はそのまま書く
+    """
+    pos = 0
+    while True:
+        hits = [(template.find(marker, pos), marker) for marker in values]
+        hits = [(i, marker) for i, marker in hits if i >= 0]
+        if not hits:
+            break
+        i, marker = min(hits)
+        f.write(template[pos:i])
+        write_json(f, values[marker], chunk_rows, **dumps_kwargs)
+        pos = i + len(marker)
+    f.write(template[pos:])
@@ -1,63 +1,243 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
 import logging
 import os
+import sys
 import threading
+from typing import TYPE_CHECKING
+
+import metrics
 
-import openai
-from dotenv import load_dotenv
-from openai import AzureOpenAI, OpenAI
-from pydantic import BaseModel
-from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+if TYPE_CHECKING:
+    from pydantic import BaseModel
 
+# openai / pydantic / tenacity / dotenv は初回利用時に読み込む（import 時間短縮のため）
 DOTENV_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../../.env"))
-load_dotenv(DOTENV_PATH)
-
-# check env
-use_azure = os.getenv("USE_AZURE", "false").lower()
-if use_azure == "true":
-    if not os.getenv("AZURE_CHATCOMPLETION_ENDPOINT"):
-        raise RuntimeError("AZURE_CHATCOMPLETION_ENDPOINT environment variable is not set")
-    if not os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME"):
-        raise RuntimeError("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME environment variable is not set")
-    if not os.getenv("AZURE_CHATCOMPLETION_API_KEY"):
-        raise RuntimeError("AZURE_CHATCOMPLETION_API_KEY environment variable is not set")
-    if not os.getenv("AZURE_CHATCOMPLETION_VERSION"):
-        raise RuntimeError("AZURE_CHATCOMPLETION_VERSION environment variable is not set")
-    if not os.getenv("AZURE_EMBEDDING_ENDPOINT"):
-        raise RuntimeError("AZURE_EMBEDDING_ENDPOINT environment variable is not set")
-    if not os.getenv("AZURE_EMBEDDING_API_KEY"):
-        raise RuntimeError("AZURE_EMBEDDING_API_KEY environment variable is not set")
-    if not os.getenv("AZURE_EMBEDDING_VERSION"):
-        raise RuntimeError("AZURE_EMBEDDING_VERSION environment variable is not set")
-    if not os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME"):
-        raise RuntimeError("AZURE_EMBEDDING_DEPLOYMENT_NAME environment variable is not set")
-
-
-@retry(
-    retry=retry_if_exception_type(openai.RateLimitError),
-    wait=wait_exponential(multiplier=3, min=3, max=20),
-    stop=stop_after_attempt(3),
-    reraise=True,
-)
+
+AZURE_REQUIRED_ENV = [
+    "AZURE_CHATCOMPLETION_ENDPOINT",
+    "AZURE_CHATCOMPLETION_DEPLOYMENT_NAME",
+    "AZURE_CHATCOMPLETION_API_KEY",
+    "AZURE_CHATCOMPLETION_VERSION",
+    "AZURE_EMBEDDING_ENDPOINT",
+    "AZURE_EMBEDDING_API_KEY",
+    "AZURE_EMBEDDING_VERSION",
+    "AZURE_EMBEDDING_DEPLOYMENT_NAME",
+]
+
+__configured = False
+__config_lock = threading.Lock()
+__clients = {}
+__async_clients = {}
+__clients_lock = threading.Lock()
+
+
+def _ensure_configured():
+    """.env の読み込みと環境変数チェック（初回のみ）"""
+    global __configured
+    if __configured:
+        return
+    with __config_lock:
+        if __configured:
+            return
+        from dotenv import load_dotenv
+
+        load_dotenv(DOTENV_PATH)
+
+        # check env
+        use_azure = os.getenv("USE_AZURE", "false").lower()
+        if use_azure == "true":
+            for name in AZURE_REQUIRED_ENV:
+                if not os.getenv(name):
+                    raise RuntimeError(f"{name} environment variable is not set")
+        __configured = True
+
+
+def _get_client(kind):
+    """
+    プロバイダのクライアントを種類ごとに 1 つだけ作って使い回す。
+    埋め込み用は _retry_on_transient で再試行するので、SDK 自身の再試行（既定 2 回）は切って重ねがけを防ぐ
+    """
+    with __clients_lock:
+        if kind not in __clients:
+            from openai import AzureOpenAI, OpenAI
+
+            if kind == "openai_embedding":
+                # OPENAI_EMBEDDING_BASE_URL でスタブサーバー等の互換エンドポイントに向けられる
+                client = OpenAI(base_url=os.getenv("OPENAI_EMBEDDING_BASE_URL") or None, max_retries=0)
+            elif kind == "azure_chat":
+                client = AzureOpenAI(
+                    api_version=os.getenv("AZURE_CHATCOMPLETION_VERSION"),
+                    azure_endpoint=os.getenv("AZURE_CHATCOMPLETION_ENDPOINT"),
+                    api_key=os.getenv("AZURE_CHATCOMPLETION_API_KEY"),
+                )
+            elif kind == "azure_embedding":
+                client = AzureOpenAI(
+                    api_version=os.getenv("AZURE_EMBEDDING_VERSION"),
+                    azure_endpoint=os.getenv("AZURE_EMBEDDING_ENDPOINT"),
+                    api_key=os.getenv("AZURE_EMBEDDING_API_KEY"),
+                    max_retries=0,
+                )
+            else:
+                raise ValueError(f"Unknown client kind: {kind}")
+            __clients[kind] = client
+        return __clients[kind]
+
+
+def _get_async_client(kind):
+    """
+    非同期クライアントをイベントループごとに 1 つ作って使い回す
+    （httpx の接続プールはループに結び付くので、asyncio.run のたびに新しいループなら作り直す）。
+    再試行は arequest_chat_bulk 側で数えながら行うので、SDK 自身の再試行は切る
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    with __clients_lock:
+        cached = __async_clients.get(kind)
+        if cached is not None and cached[0] is loop:
+            return cached[1]
+        from openai import AsyncAzureOpenAI, AsyncOpenAI
+
+        if kind == "azure_chat":
+            client = AsyncAzureOpenAI(
+                api_version=os.getenv("AZURE_CHATCOMPLETION_VERSION"),
+                azure_endpoint=os.getenv("AZURE_CHATCOMPLETION_ENDPOINT"),
+                api_key=os.getenv("AZURE_CHATCOMPLETION_API_KEY"),
+                max_retries=0,
+            )
+        elif kind == "openai_chat":
+            client = AsyncOpenAI(max_retries=0)
+        else:
+            raise ValueError(f"Unknown async client kind: {kind}")
+        __async_clients[kind] = (loop, client)
+        return client
+
+
+def _is_pydantic_model(json_schema):
+    if not isinstance(json_schema, type):
+        return False
+    from pydantic import BaseModel
+
+    return issubclass(json_schema, BaseModel)
+
+
+def _retry_on_rate_limit(multiplier, min, max):
+    """tenacity の retry を初回呼び出し時に組み立てるデコレータ"""
+
+    def decorator(fn):
+        wrapped = None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            nonlocal wrapped
+            if wrapped is None:
+                import openai
+                from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+                wrapped = retry(
+                    retry=retry_if_exception_type(openai.RateLimitError),
+                    wait=wait_exponential(multiplier=multiplier, min=min, max=max),
+                    stop=stop_after_attempt(3),
+                    before_sleep=_count_retry,
+                    reraise=True,
+                )(fn)
+            return wrapped(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _is_transient_error(e):
+    """時間をおけば成功しうるエラー（タイムアウト・接続断・5xx・レート制限）"""
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if "openai" not in sys.modules:
+        return False
+    import openai
+
+    return isinstance(e, (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError))
+
+
+def is_input_error(e):
+    """入力テキスト自体が原因のエラー（長すぎる・不正な入力など）。再試行しても成功しない"""
+    if "openai" not in sys.modules:
+        return False
+    import openai
+
+    return isinstance(e, (openai.BadRequestError, openai.UnprocessableEntityError))
+
+
+def _retry_on_transient(attempts, min, max):
+    """一時的なエラーをジッター付き指数バックオフで再試行するデコレータ（tenacity は初回呼び出し時に読み込む）"""
+
+    def decorator(fn):
+        wrapped = None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            nonlocal wrapped
+            if wrapped is None:
+                from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+                wrapped = retry(
+                    retry=retry_if_exception(_is_transient_error),
+                    wait=wait_random_exponential(multiplier=1, min=min, max=max),
+                    stop=stop_after_attempt(attempts),
+                    before_sleep=_count_retry,
+                    reraise=True,
+                )(fn)
+            return wrapped(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _count_retry(retry_state):
+    metrics.incr("api_retries", fn=retry_state.fn.__name__)
+
+
+def _record_usage(response, model):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    metrics.incr("api_prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0, model=model)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if completion_tokens:
+        metrics.incr("api_completion_tokens", completion_tokens, model=model)
+
+
+@_retry_on_rate_limit(multiplier=3, min=3, max=20)
 def request_to_openai(
     messages: list[dict],
     model: str = "gpt-4",
     is_json: bool = False,
     json_schema: dict | type[BaseModel] = None,
 ) -> dict:
+    import openai
+
+    _ensure_configured()
     openai.api_type = "openai"
 
     try:
-        if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        if _is_pydantic_model(json_schema):
             # Use beta.chat.completions.create for Pydantic BaseModel
-            response = openai.beta.chat.completions.parse(
-                model=model,
-                messages=messages,
-                temperature=0,
-                n=1,
-                seed=0,
-                response_format=json_schema,
-                timeout=30,
-            )
+            with metrics.span("api.chat", provider="openai"):
+                response = openai.beta.chat.completions.parse(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                    n=1,
+                    seed=0,
+                    response_format=json_schema,
+                    timeout=30,
+                )
+            _record_usage(response, model)
             return response.choices[0].message.content
 
         else:
@@ -67,18 +247,21 @@ def request_to_openai(
             if json_schema:  # 両方有効化されていたら、json_schemaを優先
                 response_format = json_schema
 
-            response = openai.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0,
-                n=1,
-                seed=0,
-                response_format=response_format,
-                timeout=30,
-            )
+            with metrics.span("api.chat", provider="openai"):
+                response = openai.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                    n=1,
+                    seed=0,
+                    response_format=response_format,
+                    timeout=30,
+                )
+            _record_usage(response, model)
 
             return response.choices[0].message.content
     except openai.RateLimitError as e:
+        metrics.incr("api_rate_limited", api="chat")
         logging.warning(f"OpenAI API rate limit hit: {e}")
         raise
     except openai.AuthenticationError as e:
@@ -89,41 +272,33 @@ def request_to_openai(
         raise
 
 
-@retry(
-    retry=retry_if_exception_type(openai.RateLimitError),
-    wait=wait_exponential(multiplier=1, min=2, max=20),
-    stop=stop_after_attempt(3),
-    reraise=True,
-)
+@_retry_on_rate_limit(multiplier=1, min=2, max=20)
 def request_to_azure_chatcompletion(
     messages: list[dict],
     is_json: bool = False,
     json_schema: dict | type[BaseModel] = None,
 ) -> dict:
-    azure_endpoint = os.getenv("AZURE_CHATCOMPLETION_ENDPOINT")
-    deployment = os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
-    api_key = os.getenv("AZURE_CHATCOMPLETION_API_KEY")
-    api_version = os.getenv("AZURE_CHATCOMPLETION_VERSION")
+    import openai
 
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-    )
+    _ensure_configured()
+    deployment = os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
+    client = _get_client("azure_chat")
     # Set response format based on parameters
 
     try:
-        if isinstance(json_schema, type) and issubclass(json_schema, BaseModel):
+        if _is_pydantic_model(json_schema):
             # Use beta.chat.completions.create for Pydantic BaseModel (Azure)
-            response = client.beta.chat.completions.parse(
-                model=deployment,
-                messages=messages,
-                temperature=0,
-                n=1,
-                seed=0,
-                response_model=json_schema,
-                timeout=30,
-            )
+            with metrics.span("api.chat", provider="azure"):
+                response = client.beta.chat.completions.parse(
+                    model=deployment,
+                    messages=messages,
+                    temperature=0,
+                    n=1,
+                    seed=0,
+                    response_model=json_schema,
+                    timeout=30,
+                )
+            _record_usage(response, deployment)
             return response
         else:
             response_format = None
@@ -132,17 +307,20 @@ def request_to_azure_chatcompletion(
             if json_schema:  # 両方有効化されていたら、json_schemaを優先
                 response_format = json_schema
 
-            response = client.chat.completions.create(
-                model=deployment,
-                messages=messages,
-                temperature=0,
-                n=1,
-                seed=0,
-                response_format=response_format,
-                timeout=30,
-            )
+            with metrics.span("api.chat", provider="azure"):
+                response = client.chat.completions.create(
+                    model=deployment,
+                    messages=messages,
+                    temperature=0,
+                    n=1,
+                    seed=0,
+                    response_format=response_format,
+                    timeout=30,
+                )
+            _record_usage(response, deployment)
             return response.choices[0].message.content
     except openai.RateLimitError as e:
+        metrics.incr("api_rate_limited", api="chat")
         logging.warning(f"OpenAI API rate limit hit: {e}")
         raise
     except openai.AuthenticationError as e:
@@ -159,6 +337,7 @@ def request_to_chat_openai(
     is_json: bool = False,
     json_schema: dict | type[BaseModel] = None,
 ) -> dict:
+    _ensure_configured()
     use_azure = os.getenv("USE_AZURE", "false").lower()
     if use_azure == "true":
         return request_to_azure_chatcompletion(messages, is_json, json_schema)
@@ -166,6 +345,189 @@ def request_to_chat_openai(
         return request_to_openai(messages, model, is_json, json_schema)
 
 
+# ─── 非同期まとめ実行（キャッシュ付き）──────────────────────────
+# temperature=0, seed=0 で呼ぶので、同じ (モデル, messages, response_format) の応答はディスクに保存して再利用する
+# 保存先は LLM_CHAT_CACHE_DIR（.env でも指定できるよう、読み込み後に参照する）
+DEFAULT_CHAT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", ".chat_cache")
+
+
+def _chat_cache_dir():
+    _ensure_configured()
+    return os.getenv("LLM_CHAT_CACHE_DIR") or DEFAULT_CHAT_CACHE_DIR
+
+
+def _chat_cache_key(provider, model, messages, is_json, json_schema):
+    if _is_pydantic_model(json_schema):
+        schema = {"pydantic": json_schema.__name__, "schema": json_schema.model_json_schema()}
+    else:
+        schema = json_schema
+    raw = json.dumps(
+        {"provider": provider, "model": model, "messages": messages, "is_json": is_json, "schema": schema},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _read_chat_cache(key):
+    path = os.path.join(_chat_cache_dir(), key[:2], f"{key}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["content"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_chat_cache(key, content):
+    path = os.path.join(_chat_cache_dir(), key[:2], f"{key}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"content": content}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class _RateLimiter:
+    """1 分あたりのリクエスト数を均等な間隔に制限する（asyncio 用）"""
+
+    def __init__(self, requests_per_minute):
+        import asyncio
+
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        import asyncio
+        import time
+
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def _achat_once(client, model, messages, is_json, json_schema, provider):
+    import openai
+
+    try:
+        return await _achat_request(client, model, messages, is_json, json_schema, provider)
+    except openai.RateLimitError:
+        metrics.incr("api_rate_limited", api="chat")
+        raise
+
+
+async def _achat_request(client, model, messages, is_json, json_schema, provider):
+    if _is_pydantic_model(json_schema):
+        with metrics.span("api.chat", provider=provider):
+            response = await client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                temperature=0,
+                n=1,
+                seed=0,
+                response_format=json_schema,
+                timeout=30,
+            )
+    else:
+        response_format = None
+        if is_json:
+            response_format = {"type": "json_object"}
+        if json_schema:  # 両方有効化されていたら、json_schemaを優先
+            response_format = json_schema
+        with metrics.span("api.chat", provider=provider):
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0,
+                n=1,
+                seed=0,
+                response_format=response_format,
+                timeout=30,
+            )
+    _record_usage(response, model)
+    return response.choices[0].message.content
+
+
+async def arequest_chat_bulk(
+    messages_list: list[list[dict]],
+    model: str = "gpt-4o",
+    is_json: bool = False,
+    json_schema: dict | type[BaseModel] = None,
+    max_concurrency: int = 8,
+    requests_per_minute: float | None = None,
+    use_cache: bool = True,
+    attempts: int = 5,
+) -> list:
+    """
+    messages のリストをまとめて問い合わせ、応答本文（str）のリストを入力と同じ順で返す。
+    最大 max_concurrency 件を同時に実行し、一時的なエラーはジッター付きバックオフで再試行する。
+    再試行しても失敗したリクエストは、その位置に例外オブジェクトを入れて返す
+    """
+    import asyncio
+
+    from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+    _ensure_configured()
+    if os.getenv("USE_AZURE", "false").lower() == "true":
+        provider = "azure"
+        model = os.getenv("AZURE_CHATCOMPLETION_DEPLOYMENT_NAME")
+        client = _get_async_client("azure_chat")
+    else:
+        provider = "openai"
+        client = _get_async_client("openai_chat")
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    limiter = _RateLimiter(requests_per_minute)
+
+    async def run(key, messages):
+        if use_cache:
+            cached = _read_chat_cache(key)
+            if cached is not None:
+                metrics.incr("chat_cache_hits", model=model)
+                return cached
+            metrics.incr("chat_cache_misses", model=model)
+        async with semaphore:
+            async for attempt in AsyncRetrying(
+                retry=retry_if_exception(_is_transient_error),
+                wait=wait_random_exponential(multiplier=1, min=1, max=30),
+                stop=stop_after_attempt(attempts),
+                before_sleep=lambda state: metrics.incr("api_retries", fn="arequest_chat_bulk"),
+                reraise=True,
+            ):
+                with attempt:
+                    await limiter.wait()
+                    content = await _achat_once(client, model, messages, is_json, json_schema, provider)
+        if use_cache:
+            _write_chat_cache(key, content)
+        return content
+
+    # 同じ内容のリクエストは 1 回だけ送る
+    keys = [_chat_cache_key(provider, model, m, is_json, json_schema) for m in messages_list]
+    unique = dict(zip(keys, messages_list))
+    done = await asyncio.gather(*(run(k, m) for k, m in unique.items()), return_exceptions=True)
+    by_key = dict(zip(unique, done))
+    results = [by_key[k] for k in keys]
+    for r in done:
+        if isinstance(r, Exception):
+            metrics.incr("chat_failures", model=model)
+            logging.error(f"Chat request failed: {r}")
+    return results
+
+
+def request_chat_bulk(messages_list: list[list[dict]], **kwargs) -> list:
+    """arequest_chat_bulk の同期版（イベントループの外から呼ぶ）"""
+    import asyncio
+
+    return asyncio.run(arequest_chat_bulk(messages_list, **kwargs))
+
+
 EMBDDING_MODELS = [
     "text-embedding-3-large",
     "text-embedding-3-small",
@@ -177,67 +539,248 @@ def _validate_model(model):
         raise RuntimeError(f"Invalid embedding model: {model}, available models: {EMBDDING_MODELS}")
 
 
+@_retry_on_transient(attempts=5, min=1, max=30)
+def _create_embeddings(client_kind, args, model, provider):
+    import openai
+
+    client = _get_client(client_kind)
+    try:
+        with metrics.span("api.embed", provider=provider):
+            response = client.embeddings.create(input=args, model=model)
+    except openai.RateLimitError:
+        metrics.incr("api_rate_limited", api="embed")
+        raise
+    _record_usage(response, model)
+    metrics.incr("embed_texts", len(response.data), model=model)
+    return [item.embedding for item in response.data]
+
+
 def request_to_embed(args, model, is_embedded_at_local=False):
     if is_embedded_at_local:
         return request_to_local_embed(args)
 
+    _ensure_configured()
     use_azure = os.getenv("USE_AZURE", "false").lower()
     if use_azure == "true":
         return request_to_azure_embed(args, model)
 
     else:
         _validate_model(model)
-        client = OpenAI()
-        response = client.embeddings.create(input=args, model=model)
-        embeds = [item.embedding for item in response.data]
+        embeds = _create_embeddings("openai_embedding", args, model, "openai")
     return embeds
 
 
 def request_to_azure_embed(args, model):
-    azure_endpoint = os.getenv("AZURE_EMBEDDING_ENDPOINT")
-    api_key = os.getenv("AZURE_EMBEDDING_API_KEY")
-    api_version = os.getenv("AZURE_EMBEDDING_VERSION")
+    _ensure_configured()
     deployment = os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME")
+    return _create_embeddings("azure_embedding", args, deployment, "azure")
 
-    client = AzureOpenAI(
-        api_version=api_version,
-        azure_endpoint=azure_endpoint,
-        api_key=api_key,
-    )
-
-    response = client.embeddings.create(input=args, model=deployment)
-    return [item.embedding for item in response.data]
 
+# ─── バッチ API（オフラインの一括埋め込み） ─────────────────────
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
 
-__local_emb_models = {}
-__local_emb_model_loading_lock = threading.Lock()
-
-def request_to_local_embed(texts, model_name="paraphrase-multilingual-mpnet-base-v2"):
-    global __local_emb_models
 
-    with __local_emb_model_loading_lock:
-        if model_name not in __local_emb_models:
-            from sentence_transformers import SentenceTransformer
-            import torch
+class EmbeddingBatchAPI:
+    """
+    OpenAI / Azure OpenAI の Batch API で埋め込みを依頼する薄いラッパー。
+    embedding_stub_server.FileBatchStub と同じメソッドを持つ（batch_embed.py から使う）
+    """
 
-            print(f"📦 モデル読み込み中: {model_name}")
-            model = SentenceTransformer(model_name, trust_remote_code=True)
+    def __init__(self, model):
+        _ensure_configured()
+        if os.getenv("USE_AZURE", "false").lower() == "true":
+            self.client = _get_client("azure_embedding")
+            self.model = os.getenv("AZURE_EMBEDDING_DEPLOYMENT_NAME")
+        else:
+            _validate_model(model)
+            self.client = _get_client("openai_embedding")
+            self.model = model
+
+    @_retry_on_transient(attempts=5, min=1, max=30)
+    def upload(self, path):
+        with metrics.span("api.batch", op="upload"), open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    @_retry_on_transient(attempts=5, min=1, max=30)
+    def create(self, file_id, metadata=None):
+        with metrics.span("api.batch", op="create"):
+            batch = self.client.batches.create(
+                input_file_id=file_id,
+                endpoint="/v1/embeddings",
+                completion_window="24h",
+                metadata=metadata,
+            )
+        return batch.id
+
+    @_retry_on_transient(attempts=5, min=1, max=30)
+    def find(self, file_id, metadata, scan_limit=1000):
+        """file_id と metadata で投入済みのバッチを探し、batch_id（なければ None）を返す。新しい順に scan_limit 件まで見る"""
+        with metrics.span("api.batch", op="list"):
+            for i, batch in enumerate(self.client.batches.list(limit=100)):
+                if i >= scan_limit:
+                    break
+                if batch.input_file_id == file_id and (batch.metadata or {}) == metadata:
+                    return batch.id
+        return None
+
+    @_retry_on_transient(attempts=5, min=1, max=30)
+    def retrieve(self, batch_id):
+        with metrics.span("api.batch", op="retrieve"):
+            batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "request_counts": counts.model_dump() if counts is not None else None,
+        }
+
+    @_retry_on_transient(attempts=5, min=1, max=30)
+    def download(self, file_id, dest):
+        """結果ファイルをメモリに載せずに dest へ書き出す"""
+        with metrics.span("api.batch", op="download"):
+            with self.client.files.with_streaming_response.content(file_id) as response:
+                response.stream_to_file(dest)
+
+
+# ─── ローカル埋め込みモデル ─────────────────────────────
+# LOCAL_EMB_SNAPSHOT_DIR を設定すると、初回読み込み後にモデルを safetensors 形式でそこへ保存し、
+# 次回以降はローカルのスナップショットから読み込む（Hub への問い合わせなし）。
+# 省けるのは Hub への問い合わせとディスクからの読み込み（同じホストならページキャッシュに載ったファイル）だけで、
+# 重みは各プロセスがそれぞれ RAM に展開する（ワーカーごとにモデル 1 つ分のメモリを使い、プロセス間では共有しない）
+__local_emb_models = {}
+__local_emb_model_locks = {}
+__local_emb_locks_lock = threading.Lock()
+
+
+def _local_model_lock(model_name):
+    # モデルごとのロック（別モデルの読み込み中でも、読み込み済みモデルはすぐ使える）
+    with __local_emb_locks_lock:
+        return __local_emb_model_locks.setdefault(model_name, threading.Lock())
+
+
+def _snapshot_path(model_name):
+    """スナップショットの保存先。LOCAL_EMB_SNAPSHOT_DIR（.env でも可）が未設定なら None"""
+    _ensure_configured()
+    snapshot_dir = os.getenv("LOCAL_EMB_SNAPSHOT_DIR")
+    if not snapshot_dir:
+        return None
+    return os.path.join(snapshot_dir, model_name.replace("/", "_"))
+
+
+def _has_snapshot(path):
+    # 書き終えた一時ディレクトリを丸ごと rename するので、modules.json があれば完全なスナップショット
+    return path is not None and os.path.exists(os.path.join(path, "modules.json"))
+
+
+def save_local_snapshot(model_name):
+    """
+    読み込み済み（なければ読み込んだ）モデルを safetensors 形式で LOCAL_EMB_SNAPSHOT_DIR に保存する。
+    プロセスごとの一時ディレクトリに書いてから置き換えるので、複数のワーカーが同時に保存しても、
+    読み込み中の既存スナップショットを消したり壊したりしない
+    """
+    path = _snapshot_path(model_name)
+    if path is None:
+        raise RuntimeError("LOCAL_EMB_SNAPSHOT_DIR environment variable is not set")
+    if _has_snapshot(path):
+        return path
+    model = _load_local_model(model_name)
+    if _has_snapshot(path):
+        # 初回読み込みの中で保存済み
+        return path
+    tmp = f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+    import shutil
 
-            if  torch.cuda.is_available():
-                print("🚀 GPUモードで実行します")
-                model = model.to("cuda")
-            else:
-                print("⚙️ CPUモードで実行します")
+    try:
+        with metrics.span("local.snapshot", model=model_name):
+            model.save(tmp, safe_serialization=True)
+        if _has_snapshot(path):
+            # 書いている間に別のワーカーが保存を終えた
+            return path
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # 同時に置き換えられた、または不完全なディレクトリが残っている（どちらも既存側は触らない）
+            if not _has_snapshot(path):
+                raise
+            return path
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+    print(f"💾 スナップショットを保存: {path}")
+    return path
+
+
+def _load_local_model(model_name):
+    model = __local_emb_models.get(model_name)
+    if model is not None:
+        return model
+
+    with _local_model_lock(model_name):
+        if model_name in __local_emb_models:
+            return __local_emb_models[model_name]
+
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        snapshot = _snapshot_path(model_name)
+        has_snapshot = _has_snapshot(snapshot)
+        print(f"📦 モデル読み込み中: {model_name}" + (" (スナップショット)" if has_snapshot else ""))
+        with metrics.span("local.load", model=model_name, source="snapshot" if has_snapshot else "hub"):
+            model = SentenceTransformer(snapshot if has_snapshot else model_name, trust_remote_code=True)
+
+        if  torch.cuda.is_available():
+            print("🚀 GPUモードで実行します")
+            model = model.to("cuda")
+        else:
+            print("⚙️ CPUモードで実行します")
+
+        __local_emb_models[model_name] = model
+
+    if snapshot is not None and not has_snapshot:
+        try:
+            save_local_snapshot(model_name)
+        except Exception as e:
+            logging.warning(f"Failed to save local model snapshot for {model_name}: {e}")
+    return model
+
+
+def preload_local_models(model_names, background=True):
+    """
+    ローカルモデルを先に読み込んでおく。background=True ならスレッドで読み込み、すぐに戻る。
+    読み込み中に request_to_local_embed が呼ばれた場合は、そのモデルの読み込み完了を待つ
+    """
+
+    def load(name):
+        try:
+            _load_local_model(name)
+        except Exception as e:
+            logging.warning(f"Failed to preload local model {name}: {e}")
+
+    threads = []
+    for name in model_names:
+        if name in __local_emb_models:
+            continue
+        if background:
+            t = threading.Thread(target=load, args=(name,), name=f"preload-{name}", daemon=True)
+            t.start()
+            threads.append(t)
+        else:
+            load(name)
+    return threads
 
-            __local_emb_models[model_name] = model
 
-    model = __local_emb_models[model_name]
+def request_to_local_embed(texts, model_name="paraphrase-multilingual-mpnet-base-v2"):
+    model = _load_local_model(model_name)
 
     # ✅ RoSEtta用のqueryプレフィックス処理
     if model_name == "pkshatech/RoSEtta-base-ja":
         texts = [f"query: {text}" for text in texts]
 
-    return model.encode(texts, convert_to_numpy=True).tolist()
+    with metrics.span("local.encode", model=model_name):
+        vectors = model.encode(texts, convert_to_numpy=True)
+    metrics.incr("embed_texts", 1 if isinstance(texts, str) else len(texts), model=model_name)
+    return vectors.tolist()
 
 
 def _test():
@@ -251,6 +794,34 @@ def _test():
     print(request_to_azure_embed("Hello", "text-embedding-3-large"))
 
 
+def _import_time_test(budget_sec=0.2):
+    # import llm が重いライブラリを読み込まず、予算内に収まることを確認する
+    import subprocess
+    import sys
+
+    code = (
+        "import sys, time; t = time.perf_counter(); import llm; "
+        "print(time.perf_counter() - t); "
+        "print(','.join(m for m in ('openai', 'pydantic', 'tenacity', 'dotenv', 'torch', 'sentence_transformers') if m in sys.modules))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    ).stdout.split("\n")
+    elapsed, loaded = float(out[0]), out[1]
+    print(f"import llm: {elapsed * 1000:.1f} ms, heavy modules: {loaded or '-'}")
+    assert not loaded, f"heavy modules imported at import time: {loaded}"
+    assert elapsed < budget_sec, f"import llm took {elapsed:.3f}s (budget {budget_sec}s)"
+
+
+def _bulk_chat_test():
+    messages_list = [
+        [{"role": "system", "content": "英訳せよ"}, {"role": "user", "content": text}]
+        for text in ["りんご", "みかん", "ぶどう", "りんご"]
+    ]
+    for content in request_chat_bulk(messages_list, model="gpt-4o", max_concurrency=4):
+        print(content)
+
+
 def _local_emb_test():
     data = [
         # 料理関連のグループ
@@ -336,4 +907,6 @@ if __name__ == "__main__":
     # _jsonschema_test()
     # _basemodel_test()
     # _local_emb_test()
+    # _import_time_test()
+    # _bulk_chat_test()
     pass
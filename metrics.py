@@ -0,0 +1,126 @@
+"""
+軽量な計測モジュール（標準ライブラリのみ）
+
+- span(name): 処理時間の計測（件数・合計・最大）
+- incr(name, value, **labels): カウンタ（トークン数、テキスト数、リトライ、429、キャッシュヒット等）
+- write_reports(out_dir, run_name): JSON レポートと Prometheus テキスト形式で出力
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_spans = {}  # (name, labels) -> [count, total_sec, max_sec]
+_counters = {}  # (name, labels) -> value
+_started_at = time.time()
+
+PROM_PREFIX = "semantic_map"
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+@contextmanager
+def span(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        entry = _spans.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+
+def incr(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def reset():
+    global _started_at
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started_at = time.time()
+
+
+def snapshot():
+    with _lock:
+        spans = [
+            {"name": name, "labels": dict(labels), "count": c, "total_sec": round(t, 6), "max_sec": round(m, 6)}
+            for (name, labels), (c, t, m) in sorted(_spans.items())
+        ]
+        counters = [
+            {"name": name, "labels": dict(labels), "value": v}
+            for (name, labels), v in sorted(_counters.items())
+        ]
+        started_at = _started_at
+    return {
+        "started_at": started_at,
+        "wall_sec": round(time.time() - started_at, 6),
+        "spans": spans,
+        "counters": counters,
+    }
+
+
+def _prom_name(name):
+    return f"{PROM_PREFIX}_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _prom_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_prom_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def to_prometheus():
+    snap = snapshot()
+    lines = []
+    seen = set()
+    for s in snap["spans"]:
+        base = _prom_name(s["name"]) + "_seconds"
+        if base not in seen:
+            lines.append(f"# TYPE {base} summary")
+            seen.add(base)
+        labels = _prom_labels(s["labels"])
+        lines.append(f"{base}_count{labels} {s['count']}")
+        lines.append(f"{base}_sum{labels} {s['total_sec']}")
+    for c in snap["counters"]:
+        base = _prom_name(c["name"]) + "_total"
+        if base not in seen:
+            lines.append(f"# TYPE {base} counter")
+            seen.add(base)
+        lines.append(f"{base}{_prom_labels(c['labels'])} {c['value']}")
+    lines.append(f"# TYPE {PROM_PREFIX}_wall_seconds gauge")
+    lines.append(f"{PROM_PREFIX}_wall_seconds {snap['wall_sec']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_reports(out_dir, run_name):
+    """<run_name>_metrics.json と <run_name>_metrics.prom を出力"""
+    os.makedirs(out_dir, exist_ok=True)
+    report = {"run": run_name, **snapshot()}
+    json_path = os.path.join(out_dir, f"{run_name}_metrics.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    prom_path = os.path.join(out_dir, f"{run_name}_metrics.prom")
+    with open(prom_path, "w", encoding="utf-8") as f:
+        f.write(to_prometheus())
+    print(f"📊 計測レポートを出力: {json_path}, {prom_path}")
+    return json_path, prom_path
@@ -0,0 +1,160 @@
+"""
+ストアの内容を カテゴリ でパーティション分割した Parquet データセットとして書き出す
+
+    data/<folder>/dataset/カテゴリ=<値>/part-0.parquet
+
+各ファイルには元の行番号 (row_id)、args.csv のカラム（argument, 絵文字, img など）、
+モデルごとの埋め込み emb_<model_key>（float32 の固定長リスト）が入る。
+pyarrow（任意の依存）が必要。
+
+    python parquet_export.py sample
+    python embed_items.py sample --parquet
+"""
+import argparse
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from vector_store import VectorStore
+
+DATASET_DIRNAME = "dataset"
+PARTITION_COLUMN = "カテゴリ"
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Parquet 出力には pyarrow が必要です: pip install pyarrow") from None
+
+
+def embedding_column(key):
+    return f"emb_{key}"
+
+
+def _schema(store, columns):
+    import pyarrow as pa
+
+    fields = [pa.field("row_id", pa.int64())]
+    fields += [pa.field(c, pa.string()) for c in columns]
+    fields += [pa.field(embedding_column(k), pa.list_(pa.float32(), store.dim(k))) for k in store.model_keys()]
+    return pa.schema(fields)
+
+
+def _iter_batches(store, schema, columns, block_rows):
+    """ストアの行順にレコードバッチを作る（埋め込みは NumPy のバッファをそのまま使う）"""
+    import pyarrow as pa
+
+    row_ids = store.row_ids()
+    keys = store.model_keys()
+    records = store.iter_records()
+    mats = {k: store.matrix(k) for k in keys}
+    for start in range(0, store.num_rows, block_rows):
+        end = min(start + block_rows, store.num_rows)
+        recs = [next(records) for _ in range(start, end)]
+        arrays = [pa.array(row_ids[start:end])]
+        for c in columns:
+            arrays.append(pa.array([None if r.get(c) is None else str(r.get(c)) for r in recs], type=pa.string()))
+        for k in keys:
+            with metrics.span("store.read", artifact="vector_store"):
+                block = np.ascontiguousarray(mats[k][start:end], dtype=np.float32)
+            arrays.append(pa.FixedSizeListArray.from_arrays(pa.array(block.reshape(-1)), store.dim(k)))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def export_parquet(store, out_dir=None, block_rows=8192):
+    """
+    store を Parquet データセットに書き出し、出力ディレクトリを返す。
+    一時ディレクトリに書いてから置き換えるので、今回なくなったカテゴリのディレクトリは残らない
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    out_dir = Path(out_dir) if out_dir else Path(store.base_dir) / DATASET_DIRNAME
+    first = next(store.iter_records(), {})
+    columns = list(first.keys())
+    if PARTITION_COLUMN not in columns:
+        raise ValueError(f"{PARTITION_COLUMN} カラムがないためパーティション分割できません")
+    schema = _schema(store, columns)
+
+    tmp = out_dir.with_name(out_dir.name + f".tmp{os.getpid()}")
+    old = out_dir.with_name(out_dir.name + f".old{os.getpid()}")
+    try:
+        with metrics.span("store.write", artifact="parquet"):
+            ds.write_dataset(
+                _iter_batches(store, schema, columns, block_rows),
+                tmp,
+                schema=schema,
+                format="parquet",
+                partitioning=ds.partitioning(pa.schema([schema.field(PARTITION_COLUMN)]), flavor="hive"),
+                existing_data_behavior="delete_matching",
+                basename_template="part-{i}.parquet",
+                max_rows_per_group=block_rows,
+            )
+        if out_dir.exists():
+            os.replace(out_dir, old)
+        os.replace(tmp, out_dir)
+    finally:
+        for path in (tmp, old):
+            if path.exists():
+                shutil.rmtree(path)
+    return out_dir
+
+
+def open_dataset(path):
+    """
+    書き出したデータセットを開く。カテゴリ は文字列として読む
+    （partitioning="hive" だと "1" や "2024" のような値が整数と推定され、isin の絞り込みが合わなくなる）
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive")
+    return ds.dataset(path, format="parquet", partitioning=partitioning)
+
+
+def read_embeddings(path, key, categories=None, columns=("argument",)):
+    """
+    指定モデルの埋め込みを (rows, dim) の float32 配列で読む。categories で カテゴリ を絞り込む
+    （該当パーティションのファイルだけを読む）。読み込むのは指定カラムと埋め込み列のみ。
+    (埋め込み行列, その他のカラムの pyarrow.Table) を返す
+    """
+    import pyarrow.dataset as ds
+
+    dataset = open_dataset(path)
+    column = embedding_column(key)
+    flt = ds.field(PARTITION_COLUMN).isin([str(c) for c in categories]) if categories else None
+    with metrics.span("store.read", artifact="parquet"):
+        table = dataset.to_table(columns=["row_id", *columns, column], filter=flt)
+    dim = table.schema.field(column).type.list_size
+    # 固定長リストの値バッファをコピーせずに NumPy 配列として参照する（チャンクが複数ならその分だけ連結）
+    parts = [chunk.flatten().to_numpy(zero_copy_only=True).reshape(-1, dim) for chunk in table[column].chunks]
+    if len(parts) == 1:
+        matrix = parts[0]
+    elif parts:
+        matrix = np.concatenate(parts)
+    else:
+        matrix = np.empty((0, dim), dtype=np.float32)
+    return matrix, table.drop_columns([column])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストアを カテゴリ 別の Parquet データセットに書き出します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--out", help="出力ディレクトリ（省略時は data/<folder>/dataset）")
+    parser.add_argument("--block-rows", type=int, default=8192, help="1 つの行グループに入れる行数")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    store = VectorStore.open_or_import(base_dir, args.folder)
+    out_dir = export_parquet(store, args.out, args.block_rows)
+    print(f"✅ Parquet データセットを保存: {out_dir} ({store.num_rows} 行, モデル: {store.model_keys()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import pickle
 import numpy as np
 import plotly.graph_objs as go
 from plotly.subplots import make_subplots
+import metrics
 from llm import request_to_embed
 
 # ─── 設定 ───────────────────────────────────────────
@@ -18,6 +19,7 @@ BASE_DIR    = os.path.dirname(os.path.abspath(__file__))
 ITEMS_PATH  = os.path.join(BASE_DIR, "data", "embedded_items.pkl")
 CACHE_PATH  = os.path.join(BASE_DIR, "data", "embed_cache.pkl")
 HTML_PATH   = os.path.join(BASE_DIR, "embedding_scatter.html")
+METRICS_DIR = None  # 計測レポートの出力先（None で出力しない）
 
 # ─── embed_cache 読み込み ───────────────────────────────
 if os.path.exists(CACHE_PATH):
@@ -79,8 +81,10 @@ def project(emb_matrix, concept_vecs):
     axis_y /= np.linalg.norm(axis_y)
     return emb_matrix.dot(axis_x), emb_matrix.dot(axis_y)
 
-x_s, y_s = project(emb_s, concept_small)
-x_l, y_l = project(emb_l, concept_large)
+with metrics.span("projection", model="small"):
+    x_s, y_s = project(emb_s, concept_small)
+with metrics.span("projection", model="large"):
+    x_l, y_l = project(emb_l, concept_large)
 
 # ─── 散布図作成 ─────────────────────────────────────
 fig = make_subplots(rows=2, cols=1, subplot_titles=("small embedding", "large embedding"))
@@ -113,5 +117,9 @@ fig.update_layout(
     width=800, height=1000
 )
 # HTML 保存
-fig.write_html(HTML_PATH)
+with metrics.span("html.write", artifact="embedding_scatter"):
+    fig.write_html(HTML_PATH)
 print(f"✅ 散布図を {HTML_PATH} に保存しました。 ")
+
+if METRICS_DIR:
+    metrics.write_reports(METRICS_DIR, "plot_embedding_scatter")
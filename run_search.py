@@ -1,86 +1,66 @@
 import os
-import pickle
-import pandas as pd
-import numpy as np
+import sys
 from datetime import datetime
-from llm import request_to_embed
+from pathlib import Path
 from dotenv import load_dotenv
+from embed_items import embed_batch
+from search_cache import SearchCache
+from vector_search import search
+from vector_store import VectorStore, model_key
 
 load_dotenv()
 
 # --- 設定 ---
+FOLDER = sys.argv[1] if len(sys.argv) > 1 else "sample"  # python run_search.py <folder>
 SEARCH_QUERY = "日本のおいしい食べ物"
 TOP_K = 10
 FILTER_CATEGORIES = []  # 空リストで「全カテゴリ」
 USE_CACHE = True
+# small と large の比較に加えて、ストアにあるモデルも並べる（ストアにないモデルは飛ばす）
+SEARCH_MODELS = ["openai/text-embedding-3-small", "openai/text-embedding-3-large", "cl-nagoya/ruri-v3-310m"]
+MODEL_LABELS = {"openai/text-embedding-3-small": "small", "openai/text-embedding-3-large": "large"}
 
 # --- パス定義 ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_PATH = os.path.join(BASE_DIR, "data/embedded_items.pkl")
-CACHE_PATH = os.path.join(BASE_DIR, "data/embed_cache.pkl")
+FOLDER_DIR = Path(BASE_DIR) / "data" / FOLDER
 LOG_PATH = os.path.join(BASE_DIR, f"search_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
 
-# --- キャッシュ読み込み ---
-if USE_CACHE and os.path.exists(CACHE_PATH):
-    with open(CACHE_PATH, "rb") as f:
-        embed_cache = pickle.load(f)
-else:
-    embed_cache = {}
+# --- 埋め込みデータ（ストア）を開く ---
+# カテゴリ別に並べ替え済み（python vector_store.py <folder> --partition）なら
+# FILTER_CATEGORIES の行範囲だけを読む
+store = VectorStore.open_or_import(FOLDER_DIR, FOLDER)
+models = [m for m in SEARCH_MODELS if model_key(m) in store.model_keys()]
+for model_name in SEARCH_MODELS:
+    if model_name not in models:
+        print(f"⚠️ {model_name} の埋め込みがストアにないためスキップします")
 
-# --- クエリベクトル取得（small + large） ---
-if SEARCH_QUERY in embed_cache:
-    query_vec_small, query_vec_large = embed_cache[SEARCH_QUERY]
-else:
-    query_vec_small = request_to_embed([SEARCH_QUERY], model="text-embedding-3-small")[0]
-    query_vec_large = request_to_embed([SEARCH_QUERY], model="text-embedding-3-large")[0]
-    embed_cache[SEARCH_QUERY] = (query_vec_small, query_vec_large)
-    if USE_CACHE:
-        with open(CACHE_PATH, "wb") as f:
-            pickle.dump(embed_cache, f)
-
-# --- 埋め込みデータ読み込み ---
-with open(DATA_PATH, "rb") as f:
-    df = pickle.load(f)
-
-# --- 類似度計算関数 ---
-def cosine_similarity(vec1, vec2):
-    v1 = np.array(vec1)
-    v2 = np.array(vec2)
-    return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
-
-# --- カテゴリでフィルタ（あれば） ---
-if FILTER_CATEGORIES:
-    df = df[df["カテゴリ"].isin(FILTER_CATEGORIES)]
-
-# --- 類似度計算 ---
-df["一致率_small"] = df["small"].apply(lambda vec: cosine_similarity(query_vec_small, vec))
-df["一致率_large"] = df["large"].apply(lambda vec: cosine_similarity(query_vec_large, vec))
-
-# --- 出力整形 ---
-df["一致率_small"] = (df["一致率_small"] * 100).round(1)
-df["一致率_large"] = (df["一致率_large"] * 100).round(1)
-
-# --- smallでソートした上位K件 ---
-results_small = df.sort_values("一致率_small", ascending=False).head(TOP_K).copy()
-
-# --- largeでソートした上位K件 ---
-results_large = df.sort_values("一致率_large", ascending=False).head(TOP_K).copy()
+# --- 類似度計算（モデルごとの上位K件） ---
+# 検索結果は data/<folder>/search_cache/ にキャッシュされ、ストアが更新されると自動で無効になる
+cache = SearchCache(store) if USE_CACHE else None
+results = {}
+for model_name in models:
+    embed = lambda text, name=model_name: embed_batch([text], name)[0]
+    if cache is not None:
+        hits = cache.search(SEARCH_QUERY, model_name, embed, TOP_K, FILTER_CATEGORIES)
+    else:
+        hits = search(store, model_key(model_name), embed(SEARCH_QUERY), TOP_K, FILTER_CATEGORIES or None)
+    records = store.records_at([row for row, _ in hits])
+    results[model_name] = [(rec, round(sim * 100, 1)) for rec, (_, sim) in zip(records, hits)]
 
 # --- ログ出力 ---
 with open(LOG_PATH, "w", encoding="utf-8") as f:
     f.write(f"🔍 検索ワード: {SEARCH_QUERY}\n")
     f.write(f"🎯 対象カテゴリ: {'全て' if not FILTER_CATEGORIES else FILTER_CATEGORIES}\n")
-    
-    f.write(f"\n   small\n\n")
-    f.write(f"{'カテゴリ':<8} {'内容':<14} {'small(%)':>10}\n")
-    f.write("-" * 42 + "\n")
-    for _, row in results_small.iterrows():
-        f.write(f"{row['カテゴリ']:<8} {row['内容']:<14} {row['一致率_small']:>10.1f}\n")
 
-    f.write(f"\n   large\n\n")
-    f.write(f"{'カテゴリ':<8} {'内容':<14} {'large(%)':>10}\n")
-    f.write("-" * 42 + "\n")
-    for _, row in results_large.iterrows():
-        f.write(f"{row['カテゴリ']:<8} {row['内容']:<14} {row['一致率_large']:>10.1f}\n")
+    for model_name, rows in results.items():
+        label = MODEL_LABELS.get(model_name, model_name)
+        f.write(f"\n   {label}\n\n")
+        f.write(f"{'カテゴリ':<8} {'内容':<14} {label + '(%)':>10}\n")
+        f.write("-" * 42 + "\n")
+        for rec, score in rows:
+            # 内容 カラムがなければ argument を表示する（空のセルは None なので文字列にしてから揃える）
+            content = str(rec.get("内容", rec.get("argument", "")) or "")
+            category = str(rec.get("カテゴリ") or "")
+            f.write(f"{category:<8} {content:<14} {score:>10.1f}\n")
 
 print(f"✅ 結果を {LOG_PATH} に出力しました。")
@@ -0,0 +1,119 @@
+"""
+検索結果（上位 K 件）のキャッシュ
+
+(検索ワード, モデル, カテゴリ, K) ごとに、メモリ上の LRU と
+data/<folder>/search_cache/ 以下のファイルの 2 段で保持する。
+各エントリにはストアの fingerprint を記録し、ストアが書き換わったら自動的に無効になる。
+クエリの埋め込みはストアに依存しないので、無効になったエントリからも再利用する。
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from artifact_io import dump_pickle, load_pickle
+from vector_search import search
+from vector_store import model_key
+
+CACHE_DIRNAME = "search_cache"
+
+
+def cache_key(query, model, categories=None, k=10):
+    """カテゴリの順序・重複に依存しないキー"""
+    cats = sorted(set(categories)) if categories else []
+    raw = json.dumps([query, model, cats, int(k)], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SearchCache:
+    def __init__(self, store, max_entries=512, max_disk_entries=4096):
+        self.store = store
+        self.dir = Path(store.base_dir) / CACHE_DIRNAME
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._store_version = store.fingerprint()
+
+    # ─── 取得・保存 ────────────────────────────────────
+    def _path(self, key):
+        return self.dir / f"{key}.pkl"
+
+    def _load(self, key):
+        """メモリ → ディスクの順に探す。見つからなければ None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key], "memory"
+        path = self._path(key)
+        if not path.exists():
+            return None, None
+        try:
+            with metrics.span("store.read", artifact="search_cache"):
+                entry = load_pickle(path)
+        except Exception:
+            # 壊れた・消されたエントリはキャッシュなしとして扱う
+            return None, None
+        os.utime(path)  # ディスク側の LRU は更新時刻で判断する
+        self._remember(key, entry)
+        return entry, "disk"
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                metrics.incr("search_cache_evictions", tier="memory")
+
+    def _save(self, key, entry):
+        self._remember(key, entry)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with metrics.span("store.write", artifact="search_cache"):
+            dump_pickle(entry, self._path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        paths = list(self.dir.glob("*.pkl"))
+        if len(paths) <= self.max_disk_entries:
+            return
+        paths.sort(key=lambda p: p.stat().st_mtime_ns)
+        for path in paths[:len(paths) - self.max_disk_entries]:
+            path.unlink(missing_ok=True)
+            metrics.incr("search_cache_evictions", tier="disk")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for path in self.dir.glob("*.pkl"):
+            path.unlink(missing_ok=True)
+
+    # ─── 検索 ───────────────────────────────────────
+    def search(self, query, model_name, embed_fn, k=10, categories=None):
+        """
+        キャッシュを使って上位 k 件を [(行番号, 類似度)] で返す。
+        embed_fn(query) はクエリの埋め込みが必要になったときだけ呼ばれる
+        """
+        key = cache_key(query, model_name, categories, k)
+        version = self.store.fingerprint()
+        entry, tier = self._load(key)
+        if entry is not None and entry["version"] == version:
+            metrics.incr("search_cache_hits", tier=tier)
+            return entry["results"]
+        if entry is not None:
+            metrics.incr("search_cache_stale")
+        metrics.incr("search_cache_misses")
+
+        query_vec = entry["query_vec"] if entry is not None else np.asarray(embed_fn(query), dtype=np.float32)
+        if version != self._store_version:
+            # 他のプロセスがストアを書き換えていれば行数などを読み直す
+            self.store.reload()
+            self._store_version = version
+        results = search(self.store, model_key(model_name), query_vec, k, categories or None)
+        self._save(key, {"version": version, "query_vec": query_vec, "results": results})
+        return results
@@ -0,0 +1,230 @@
+"""
+埋め込み行列を複数プロセスで共有する
+
+モデルごとに 元の行列・正規化済み行列・ノルム を 1 回だけ用意し、
+ワーカープロセスはそれを読み取り専用・コピーなしで参照する。共有の方式は 2 通り:
+
+- "file": ストアのディレクトリに normalized_<key>.f32 / norms_<key>.f32 を書き、np.memmap で開く
+          （OS のページキャッシュが共有されるので、ホスト上のプロセス数が増えてもメモリは増えない）
+- "shm" : multiprocessing.shared_memory に載せる（発行したプロセスが終了時に解放する）
+
+publish_* が返すハンドルは小さな dict なので、そのままワーカーへ渡せる。
+
+    python shared_matrices.py sample --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from vector_store import VectorStore
+
+# このプロセスが発行したセグメント名（同じプロセス内で開くときは resource_tracker の登録を残す）
+_published = set()
+
+
+def _normalized_paths(store, key):
+    return store.dir / f"normalized_{key}.f32", store.dir / f"norms_{key}.f32"
+
+
+def _version_path(store, key):
+    return store.dir / f"normalized_{key}.json"
+
+
+def _published_version(store, key):
+    path = _version_path(store, key)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("fingerprint")
+
+
+def publish_file(store, key, block_rows=65536):
+    """
+    正規化済み行列とノルムをストアに書き（ストアが変わっていれば書き直し）、ハンドルを返す。
+    既存のファイルは他のワーカーが memmap しているかもしれないので、一時ファイルに書いてから置き換える
+    """
+    store.ensure_unpacked()
+    n, d = store.num_rows, store.dim(key)
+    normalized_path, norms_path = _normalized_paths(store, key)
+    version = store.fingerprint()
+    if not (normalized_path.exists() and norms_path.exists() and _published_version(store, key) == version):
+        suffix = f".tmp{os.getpid()}"
+        normalized_tmp = normalized_path.with_name(normalized_path.name + suffix)
+        norms_tmp = norms_path.with_name(norms_path.name + suffix)
+        with metrics.span("store.write", artifact="normalized"), open(normalized_tmp, "wb") as nf, open(norms_tmp, "wb") as mf:
+            for _, block in store.iter_blocks(key, block_rows):
+                norms = np.linalg.norm(block, axis=1).astype(np.float32)
+                safe = np.where(norms > 0, norms, 1.0)[:, None]
+                nf.write((block / safe).astype(np.float32).tobytes())
+                mf.write(norms.tobytes())
+        os.replace(normalized_tmp, normalized_path)
+        os.replace(norms_tmp, norms_path)
+        # 版は最後に書く（途中で落ちたら次回に作り直す）
+        version_tmp = _version_path(store, key).with_name(_version_path(store, key).name + suffix)
+        with open(version_tmp, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": version, "rows": n}, f)
+        os.replace(version_tmp, _version_path(store, key))
+    return {
+        "kind": "file",
+        "key": key,
+        "shape": (n, d),
+        "matrix": str(store.vectors_path(key)),
+        "normalized": str(normalized_path),
+        "norms": str(norms_path),
+    }
+
+
+class SharedMatrixPublisher:
+    """
+    multiprocessing.shared_memory にモデルごとの行列を載せる。with ブロックを抜けると解放する
+        with SharedMatrixPublisher(store, keys) as handles: ...
+    """
+
+    def __init__(self, store, keys=None, block_rows=65536):
+        self.store = store
+        self.keys = keys or store.model_keys()
+        self.block_rows = block_rows
+        self.segments = []
+        self.handles = {}
+
+    def _segment(self, nbytes):
+        shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self.segments.append(shm)
+        _published.add(shm._name)
+        return shm
+
+    def __enter__(self):
+        for key in self.keys:
+            n, d = self.store.num_rows, self.store.dim(key)
+            raw_shm = self._segment(n * d * 4)
+            normalized_shm = self._segment(n * d * 4)
+            norms_shm = self._segment(n * 4)
+            raw = np.ndarray((n, d), dtype=np.float32, buffer=raw_shm.buf)
+            normalized = np.ndarray((n, d), dtype=np.float32, buffer=normalized_shm.buf)
+            norms = np.ndarray((n,), dtype=np.float32, buffer=norms_shm.buf)
+            with metrics.span("shm.publish", model=key):
+                for start, block in self.store.iter_blocks(key, self.block_rows):
+                    end = start + len(block)
+                    raw[start:end] = block
+                    norms[start:end] = np.linalg.norm(block, axis=1)
+                    normalized[start:end] = block / np.where(norms[start:end] > 0, norms[start:end], 1.0)[:, None]
+            self.handles[key] = {
+                "kind": "shm",
+                "key": key,
+                "shape": (n, d),
+                "matrix": raw_shm.name,
+                "normalized": normalized_shm.name,
+                "norms": norms_shm.name,
+            }
+        return self.handles
+
+    def __exit__(self, *exc):
+        for shm in self.segments:
+            shm.close()
+            shm.unlink()
+            _published.discard(shm._name)
+        self.segments = []
+
+
+class SharedMatrix:
+    """ハンドルから開いた読み取り専用のビュー（matrix, normalized, norms）"""
+
+    def __init__(self, handle):
+        self.key = handle["key"]
+        n, d = handle["shape"]
+        self._segments = []
+        if handle["kind"] == "file":
+            self.matrix = np.memmap(handle["matrix"], dtype=np.float32, mode="r", shape=(n, d))
+            self.normalized = np.memmap(handle["normalized"], dtype=np.float32, mode="r", shape=(n, d))
+            self.norms = np.memmap(handle["norms"], dtype=np.float32, mode="r", shape=(n,))
+        else:
+            self.matrix = self._attach(handle["matrix"], (n, d))
+            self.normalized = self._attach(handle["normalized"], (n, d))
+            self.norms = self._attach(handle["norms"], (n,))
+
+    def _attach(self, name, shape):
+        shm = shared_memory.SharedMemory(name=name)
+        # 解放は発行側が行う。発行側と無関係なプロセスでは resource_tracker が別なので、
+        # 登録されたままだと終了時に消されてしまう（multiprocessing の子プロセスは発行側と共有している）
+        if multiprocessing.parent_process() is None and shm._name not in _published:
+            from multiprocessing import resource_tracker
+
+            resource_tracker.unregister(shm._name, "shared_memory")
+        self._segments.append(shm)
+        view = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        view.flags.writeable = False
+        return view
+
+    def close(self):
+        # ビューを先に手放してからセグメントを閉じる
+        self.matrix = self.normalized = self.norms = None
+        for shm in self._segments:
+            shm.close()
+        self._segments = []
+
+
+def top_k(shared, query_vec, k=10):
+    """正規化済み行列を使ったコサイン類似度の上位 k 件 [(行番号, 類似度)]"""
+    q = np.asarray(query_vec, dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    sims = shared.normalized @ q
+    k = min(k, len(sims))
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top], kind="stable")]
+    return [(int(i), float(sims[i])) for i in top]
+
+
+# ─── ワーカー（動作確認用） ─────────────────────────────
+_worker_matrices = {}
+
+
+def _init_worker(handles):
+    for key, handle in handles.items():
+        _worker_matrices[key] = SharedMatrix(handle)
+
+
+def _worker_query(key, rows, k):
+    shared = _worker_matrices[key]
+    results = [top_k(shared, shared.matrix[row], k + 1)[1:] for row in rows]
+    return os.getpid(), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="埋め込み行列を共有してワーカープロセスから検索します（動作確認用）")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--mode", choices=["file", "shm"], default="file")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=100, help="ワーカーに投げる検索数（先頭の行をクエリにする）")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    store = VectorStore.open_or_import(base_dir, args.folder)
+    keys = store.model_keys()
+
+    def run(handles):
+        rows = list(range(min(args.queries, store.num_rows)))
+        chunks = [rows[i::args.workers] for i in range(args.workers)]
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(handles,)) as pool:
+            for key in keys:
+                pids = set()
+                for pid, _ in pool.map(_worker_query, [key] * len(chunks), chunks, [args.k] * len(chunks)):
+                    pids.add(pid)
+                print(f"🔍 {key}: {len(rows)} 件を {len(pids)} プロセスで検索しました")
+
+    if args.mode == "file":
+        run({key: publish_file(store, key) for key in keys})
+    else:
+        with SharedMatrixPublisher(store, keys) as handles:
+            run(handles)
+
+
+if __name__ == "__main__":
+    main()
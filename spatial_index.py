@@ -0,0 +1,197 @@
+"""
+軸語ペアへの射影結果に対する 2 次元グリッド索引
+
+(モデル, X 軸, Y 軸) ごとに射影座標を一様グリッドに振り分け、
+- ビューポート内の点の列挙
+- カーソルに最も近い点
+- 点の密度が高いセル上位 N 件
+を全件走査せずに求める。
+
+    python spatial_index.py sample --model openai_text-embedding-3-large --x 甘い,辛い --y 熱い,冷たい
+"""
+import argparse
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from artifact_io import load_pickle
+from vector_store import VectorStore
+
+
+def axis_vector(positive, negative):
+    """negative → positive 方向の単位ベクトル（explorer の JS と同じ定義）"""
+    vec = np.asarray(positive, dtype=np.float32) - np.asarray(negative, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def project(matrix, axis_x, axis_y, block_rows=65536):
+    """(rows, dim) の行列（memmap 可）を 2 軸に射影し、xs, ys を返す"""
+    axes = np.stack([axis_x, axis_y], axis=1).astype(np.float32)
+    out = np.empty((len(matrix), 2), dtype=np.float32)
+    with metrics.span("projection"):
+        for start in range(0, len(matrix), block_rows):
+            out[start:start + block_rows] = np.asarray(matrix[start:start + block_rows], dtype=np.float32) @ axes
+    return out[:, 0].copy(), out[:, 1].copy()
+
+
+class GridIndex:
+    """一様グリッド（CSR 形式: セル番号順に並べた点 ID とセルごとの開始位置）"""
+
+    def __init__(self, xs, ys, points_per_cell=16):
+        self.xs = np.asarray(xs, dtype=np.float32)
+        self.ys = np.asarray(ys, dtype=np.float32)
+        n = len(self.xs)
+        side = max(1, int(np.sqrt(max(n, 1) / points_per_cell)))
+        self.nx = self.ny = side
+        if n:
+            self.x_min, self.x_max = float(self.xs.min()), float(self.xs.max())
+            self.y_min, self.y_max = float(self.ys.min()), float(self.ys.max())
+        else:
+            self.x_min = self.x_max = self.y_min = self.y_max = 0.0
+        self.cell_w = (self.x_max - self.x_min) / self.nx or 1.0
+        self.cell_h = (self.y_max - self.y_min) / self.ny or 1.0
+
+        with metrics.span("spatial_index.build"):
+            cells = self._cell_of(self.xs, self.ys)
+            self.order = np.argsort(cells, kind="stable").astype(np.int64)
+            self.counts = np.bincount(cells, minlength=self.nx * self.ny)
+            self.starts = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def _col(self, x):
+        return np.clip(((np.asarray(x) - self.x_min) / self.cell_w).astype(np.int64), 0, self.nx - 1)
+
+    def _row(self, y):
+        return np.clip(((np.asarray(y) - self.y_min) / self.cell_h).astype(np.int64), 0, self.ny - 1)
+
+    def _cell_of(self, xs, ys):
+        return self._row(ys) * self.nx + self._col(xs)
+
+    def _cell_points(self, cell):
+        return self.order[self.starts[cell]:self.starts[cell + 1]]
+
+    def query_viewport(self, x0, x1, y0, y1):
+        """x0 <= x <= x1, y0 <= y <= y1 の点 ID（行番号）"""
+        if len(self.xs) == 0 or x1 < self.x_min or x0 > self.x_max or y1 < self.y_min or y0 > self.y_max:
+            return np.array([], dtype=np.int64)
+        c0, c1 = int(self._col(x0)), int(self._col(x1))
+        parts = []
+        for r in range(int(self._row(y0)), int(self._row(y1)) + 1):
+            # 同じ行のセルは CSR 上で連続しているので 1 回のスライスで取れる
+            parts.append(self.order[self.starts[r * self.nx + c0]:self.starts[r * self.nx + c1 + 1]])
+        ids = np.concatenate(parts)
+        xs, ys = self.xs[ids], self.ys[ids]
+        return ids[(xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)]
+
+    def nearest(self, x, y):
+        """(x, y) に最も近い点の (ID, 距離)。点がなければ (None, inf)"""
+        if len(self.xs) == 0:
+            return None, float("inf")
+        col, row = int(self._col(x)), int(self._row(y))
+        best_id, best_d2 = None, float("inf")
+        for ring in range(max(self.nx, self.ny)):
+            # 未探索のセルまでの距離より近い点が見つかっていれば終了
+            if best_id is not None and np.sqrt(best_d2) <= self._unexplored_distance(x, y, col, row, ring):
+                break
+            for r in range(row - ring, row + ring + 1):
+                if r < 0 or r >= self.ny:
+                    continue
+                cols = range(col - ring, col + ring + 1) if r in (row - ring, row + ring) else (col - ring, col + ring)
+                for c in cols:
+                    if c < 0 or c >= self.nx:
+                        continue
+                    ids = self._cell_points(r * self.nx + c)
+                    if len(ids) == 0:
+                        continue
+                    d2 = (self.xs[ids] - x) ** 2 + (self.ys[ids] - y) ** 2
+                    j = int(np.argmin(d2))
+                    if d2[j] < best_d2:
+                        best_id, best_d2 = int(ids[j]), float(d2[j])
+        return best_id, float(np.sqrt(best_d2))
+
+    def _unexplored_distance(self, x, y, col, row, ring):
+        """リング ring-1 までを探索済みのとき、未探索セルまでの最短距離の下限"""
+        bounds = []
+        if col - ring >= 0:
+            bounds.append(x - (self.x_min + (col - ring + 1) * self.cell_w))
+        if col + ring < self.nx:
+            bounds.append(self.x_min + (col + ring) * self.cell_w - x)
+        if row - ring >= 0:
+            bounds.append(y - (self.y_min + (row - ring + 1) * self.cell_h))
+        if row + ring < self.ny:
+            bounds.append(self.y_min + (row + ring) * self.cell_h - y)
+        return max(0.0, min(bounds)) if bounds else float("inf")
+
+    def cell_bounds(self, cell):
+        r, c = divmod(int(cell), self.nx)
+        x0 = self.x_min + c * self.cell_w
+        y0 = self.y_min + r * self.cell_h
+        return x0, x0 + self.cell_w, y0, y0 + self.cell_h
+
+    def densest_cells(self, n=10):
+        """点数の多いセル上位 n 件: [(セル範囲 (x0, x1, y0, y1), 点数, 点 ID)]"""
+        top = np.argsort(-self.counts, kind="stable")[:n]
+        return [(self.cell_bounds(c), int(self.counts[c]), self._cell_points(c)) for c in top if self.counts[c] > 0]
+
+    @property
+    def nbytes(self):
+        return self.xs.nbytes + self.ys.nbytes + self.order.nbytes + self.counts.nbytes + self.starts.nbytes
+
+
+def load_keyword_vectors(base_dir, key):
+    return load_pickle(Path(base_dir) / f"keyword_embed_{key}.pkl")
+
+
+class ProjectionIndexCache:
+    """(モデル, X 軸, Y 軸) ごとの GridIndex を LRU で保持する"""
+
+    def __init__(self, store, keyword_vectors, max_entries=32):
+        self.store = store
+        self.keyword_vectors = keyword_vectors  # {model_key: {keyword: vector}}
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+
+    def get(self, key, x_axis, y_axis):
+        """x_axis = (左, 右), y_axis = (下, 上) のキーワード"""
+        cache_key = (key, tuple(x_axis), tuple(y_axis))
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            metrics.incr("spatial_index_hits")
+            return self._cache[cache_key]
+        metrics.incr("spatial_index_misses")
+        kw = self.keyword_vectors[key]
+        ax = axis_vector(kw[x_axis[1]], kw[x_axis[0]])
+        ay = axis_vector(kw[y_axis[1]], kw[y_axis[0]])
+        xs, ys = project(self.store.matrix(key), ax, ay)
+        index = GridIndex(xs, ys)
+        self._cache[cache_key] = index
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="射影座標のグリッド索引を作成し、密度の高い領域を表示します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--model", required=True, help="モデルキー (例: openai_text-embedding-3-large)")
+    parser.add_argument("--x", required=True, help="X 軸の左,右 キーワード (例: 甘い,辛い)")
+    parser.add_argument("--y", required=True, help="Y 軸の下,上 キーワード (例: 熱い,冷たい)")
+    parser.add_argument("--top", type=int, default=5, help="表示する高密度セル数")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    store = VectorStore.open_or_import(base_dir, args.folder)
+    cache = ProjectionIndexCache(store, {args.model: load_keyword_vectors(base_dir, args.model)})
+    index = cache.get(args.model, args.x.split(","), args.y.split(","))
+    texts = store.texts()
+
+    print(f"🗺️ {store.num_rows} 点を {index.nx}x{index.ny} セルに索引化しました")
+    for (x0, x1, y0, y1), count, ids in index.densest_cells(args.top):
+        sample = ", ".join(texts[i] for i in ids[:5])
+        print(f"  [{x0:.3f}, {x1:.3f}] x [{y0:.3f}, {y1:.3f}]  {count} 件: {sample}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+大規模な意味マップ用のラスタタイル生成
+
+全アイテムを軸語ペアに射影し、ズームレベルごとに 256px 四方のタイルへ点の密度を集計して
+PNG タイルとして書き出す。タイルごとに、点が密集している画素の代表アイテム上位 N 件を
+小さな JS ファイル（タイル表示時に読み込む）として保存し、Leaflet のビューアでラベル表示する。
+ページの重さ・描画時間はアイテム数ではなく画面の広さで決まる。
+
+    python tile_renderer.py sample --model openai_text-embedding-3-large --x 甘い,辛い --y 熱い,冷たい --max-zoom 6
+出力: data/<folder>/tiles/<model>__<左>-<右>__<下>-<上>/
+    {z}/{x}/{y}.png     密度タイル（点のない画素は透明）
+    {z}/{x}/{y}.js      タイル内の代表アイテム
+    index.html          ビューア
+--precompress で .js / .html の .gz / .br も書く（PNG は圧縮済みなので対象外）
+"""
+import argparse
+import json
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from artifact_io import precompress_tree
+from json_stream import write_template
+from spatial_index import axis_vector, load_keyword_vectors, project
+from vector_store import VectorStore
+
+TILE_SIZE = 256
+
+# viridis に近い配色（低密度 → 高密度）
+COLOR_STOPS = np.array(
+    [[68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37]], dtype=np.float32
+)
+
+
+def _colormap():
+    pos = np.linspace(0, 1, len(COLOR_STOPS))
+    t = np.linspace(0, 1, 256)
+    return np.stack([np.interp(t, pos, COLOR_STOPS[:, c]) for c in range(3)], axis=1).astype(np.uint8)
+
+
+COLORMAP = _colormap()
+
+
+def write_png(path, rgba):
+    """(h, w, 4) の uint8 配列を PNG として書き出す（zlib と struct のみ使用）"""
+    h, w, _ = rgba.shape
+    raw = np.zeros((h, w * 4 + 1), dtype=np.uint8)  # 各行の先頭はフィルタ種別 0
+    raw[:, 1:] = rgba.reshape(h, w * 4)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def world_bounds(xs, ys, padding=0.02):
+    """全点を含む正方形の範囲 (x0, y1, span)。タイル座標は左上 (x0, y1) を原点とする"""
+    x_min, x_max = float(xs.min()), float(xs.max())
+    y_min, y_max = float(ys.min()), float(ys.max())
+    span = max(x_max - x_min, y_max - y_min) or 1.0
+    span *= 1 + 2 * padding
+    cx, cy = (x_min + x_max) / 2, (y_min + y_max) / 2
+    return cx - span / 2, cy + span / 2, span
+
+
+def render_tiles(xs, ys, texts, out_dir, max_zoom=6, top_n=8, categories=None):
+    """
+    ズーム 0〜max_zoom のタイルを out_dir に書き出す。
+    ズーム 0 の画素座標（0〜256）で各点の位置を返す (px, py)
+    """
+    out_dir = Path(out_dir)
+    x0, y1, span = world_bounds(xs, ys)
+    px0 = (xs - x0) / span * TILE_SIZE
+    py0 = (y1 - ys) / span * TILE_SIZE
+    tiles_written = 0
+
+    for z in range(max_zoom + 1):
+        n_tiles = 2 ** z
+        with metrics.span("tiles.render", zoom=str(z)):
+            px = np.clip((px0 * n_tiles).astype(np.int64), 0, TILE_SIZE * n_tiles - 1)
+            py = np.clip((py0 * n_tiles).astype(np.int64), 0, TILE_SIZE * n_tiles - 1)
+            tile = (py // TILE_SIZE) * n_tiles + (px // TILE_SIZE)
+            local = (py % TILE_SIZE) * TILE_SIZE + (px % TILE_SIZE)
+            order = np.argsort(tile, kind="stable")
+            tile_ids, starts = np.unique(tile[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+
+            # 色の濃さはズームレベル内の最大密度で正規化（対数）
+            max_count = 1
+            for s, e in zip(starts, ends):
+                max_count = max(max_count, int(np.bincount(local[order[s:e]]).max()))
+            scale = np.log1p(max_count)
+
+            for t, s, e in zip(tile_ids, starts, ends):
+                ty, tx = divmod(int(t), n_tiles)
+                members = order[s:e]
+                counts = np.bincount(local[members], minlength=TILE_SIZE * TILE_SIZE)
+                level = (np.log1p(counts) / scale * 255).astype(np.uint8)
+                rgba = np.zeros((TILE_SIZE * TILE_SIZE, 4), dtype=np.uint8)
+                filled = counts > 0
+                rgba[filled, :3] = COLORMAP[level[filled]]
+                rgba[filled, 3] = 255
+                tile_dir = out_dir / str(z) / str(tx)
+                tile_dir.mkdir(parents=True, exist_ok=True)
+                write_png(tile_dir / f"{ty}.png", rgba.reshape(TILE_SIZE, TILE_SIZE, 4))
+
+                # 密度の高い画素から 1 件ずつ代表アイテムを選ぶ
+                pixels, first = np.unique(local[members], return_index=True)
+                top = np.argsort(-counts[pixels], kind="stable")[:top_n]
+                items = []
+                for j in top:
+                    row = int(members[first[j]])
+                    item = {
+                        "row": row,
+                        "text": texts[row],
+                        "count": int(counts[pixels[j]]),
+                        "x": round(float(px0[row]), 4),
+                        "y": round(float(py0[row]), 4),
+                    }
+                    if categories is not None:
+                        item["category"] = categories[row]
+                    items.append(item)
+                with open(tile_dir / f"{ty}.js", "w", encoding="utf-8") as f:
+                    f.write(f"tileItems({z}, {tx}, {ty}, {json.dumps(items, ensure_ascii=False)});\n")
+                tiles_written += 1
+        print(f"  🧱 zoom {z}: {len(tile_ids)} タイル")
+    metrics.incr("tiles_written", tiles_written)
+    return {"x0": x0, "y1": y1, "span": span, "max_zoom": max_zoom, "tiles": tiles_written}
+
+
+VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+  <meta charset="UTF-8">
+  <title>意味空間タイルマップ</title>
+  <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+  <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+  <style>
+    html, body { margin: 0; height: 100%; font-family: sans-serif; }
+    #map { height: 100%; background: #111; }
+    .axis { position: absolute; z-index: 1000; color: #eee; background: rgba(0,0,0,0.5); padding: 2px 6px; font-size: 13px; }
+  </style>
+</head>
+<body>
+  <div id="map"></div>
+  <div class="axis" style="left: 8px; top: 50%;" id="left"></div>
+  <div class="axis" style="right: 8px; top: 50%;" id="right"></div>
+  <div class="axis" style="left: 50%; bottom: 8px;" id="bottom"></div>
+  <div class="axis" style="left: 50%; top: 8px;" id="top"></div>
+  <script>
+    const meta = __META__;
+    document.getElementById("left").textContent = "← " + meta.x_axis[0];
+    document.getElementById("right").textContent = meta.x_axis[1] + " →";
+    document.getElementById("bottom").textContent = "↓ " + meta.y_axis[0];
+    document.getElementById("top").textContent = "↑ " + meta.y_axis[1];
+
+    const size = 256;
+    const bounds = [[-size, 0], [0, size]];
+    const map = L.map("map", { crs: L.CRS.Simple, minZoom: 0, maxZoom: meta.max_zoom + 2 });
+    map.fitBounds(bounds);
+
+    const tiles = L.tileLayer("{z}/{x}/{y}.png", {
+      tileSize: size, noWrap: true, bounds: bounds,
+      minZoom: 0, maxNativeZoom: meta.max_zoom, maxZoom: meta.max_zoom + 2,
+    });
+
+    // 表示中のタイルの代表アイテムだけを読み込む
+    const labelLayers = {};
+    window.tileItems = function (z, x, y, items) {
+      const key = z + "/" + x + "/" + y;
+      if (!(key in labelLayers)) return;
+      const group = L.layerGroup(items.map(item =>
+        L.circleMarker([-item.y, item.x], { radius: 3, color: "#fff", weight: 1, fillOpacity: 0.8 })
+          .bindTooltip(item.text + (item.category ? " (" + item.category + ")" : "") + " ×" + item.count)
+      ));
+      labelLayers[key] = group;
+      group.addTo(map);
+    };
+    tiles.on("tileload", e => {
+      const c = e.coords;
+      if (c.z > meta.max_zoom) return;
+      const key = c.z + "/" + c.x + "/" + c.y;
+      labelLayers[key] = null;
+      const script = document.createElement("script");
+      script.src = key + ".js";
+      script.onload = () => script.remove();
+      document.body.appendChild(script);
+    });
+    tiles.on("tileunload", e => {
+      const key = e.coords.z + "/" + e.coords.x + "/" + e.coords.y;
+      if (labelLayers[key]) map.removeLayer(labelLayers[key]);
+      delete labelLayers[key];
+    });
+    tiles.addTo(map);
+  </script>
+</body>
+</html>
+"""
+
+
+def build_tiles(base_dir, folder, key, x_axis, y_axis, max_zoom=6, top_n=8, precompressed=False):
+    """(model, X 軸, Y 軸) のタイル一式とビューアを書き出し、出力ディレクトリを返す"""
+    store = VectorStore.open_or_import(base_dir, folder)
+    kw = load_keyword_vectors(base_dir, key)
+    ax = axis_vector(kw[x_axis[1]], kw[x_axis[0]])
+    ay = axis_vector(kw[y_axis[1]], kw[y_axis[0]])
+    xs, ys = project(store.matrix(key), ax, ay)
+
+    records = store.records()
+    texts = [str(r.get("argument", "")) for r in records]
+    categories = [r.get("カテゴリ") for r in records] if records and "カテゴリ" in records[0] else None
+
+    name = f"{key}__{x_axis[0]}-{x_axis[1]}__{y_axis[0]}-{y_axis[1]}"
+    out_dir = Path(base_dir) / "tiles" / name
+    info = render_tiles(xs, ys, texts, out_dir, max_zoom, top_n, categories)
+    meta = {**info, "model": key, "x_axis": list(x_axis), "y_axis": list(y_axis), "rows": store.num_rows}
+    with open(out_dir / "tiles.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    with open(out_dir / "index.html", "w", encoding="utf-8") as f:
+        write_template(f, VIEWER_TEMPLATE, {"__META__": meta}, ensure_ascii=False)
+    if precompressed:
+        precompress_tree(out_dir)
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="射影した全アイテムの密度タイル (PNG) とビューアを生成します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("--model", required=True, help="モデルキー (例: openai_text-embedding-3-large)")
+    parser.add_argument("--x", required=True, help="X 軸の左,右 キーワード (例: 甘い,辛い)")
+    parser.add_argument("--y", required=True, help="Y 軸の下,上 キーワード (例: 熱い,冷たい)")
+    parser.add_argument("--max-zoom", type=int, default=6, help="最大ズームレベル（タイル数は 4^z）")
+    parser.add_argument("--top", type=int, default=8, help="タイルごとの代表アイテム数")
+    parser.add_argument("--precompress", action="store_true", help="静的ホスティング用の .gz / .br も出力する")
+    parser.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    out_dir = build_tiles(
+        base_dir, args.folder, args.model, args.x.split(","), args.y.split(","), args.max_zoom, args.top,
+        args.precompress,
+    )
+    print(f"✅ タイルを出力しました: {out_dir / 'index.html'}")
+
+    if args.metrics_dir:
+        metrics.write_reports(args.metrics_dir, "tile_renderer")
+
+
+if __name__ == "__main__":
+    main()
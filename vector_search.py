@@ -0,0 +1,100 @@
+"""
+ストアに対するコサイン類似度の上位 K 件検索・カテゴリ絞り込みつき射影
+
+カテゴリを指定した検索・射影では、regroup_by_category() で並べ替えたストアなら
+該当カテゴリの行範囲だけを読むので、全件を走査してから捨てることはない。
+
+    python vector_store.py sample --partition     # カテゴリ別に並べ替え（初回のみ）
+    python vector_search.py sample "日本のおいしい食べ物" --categories 料理,素材
+"""
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from vector_store import VectorStore
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def search(store, key, query_vec, k=10, categories=None, block_rows=4096):
+    """
+    query_vec とのコサイン類似度の上位 k 件を [(行番号, 類似度)] で返す。
+    categories を指定するとそのカテゴリの行だけを対象にする。隔離した行（valid_mask）は含めない
+    """
+    q = _unit(query_vec)
+    valid = store.valid_mask(key)
+    best_rows = np.empty(0, dtype=np.int64)
+    best_sims = np.empty(0, dtype=np.float32)
+    with metrics.span("search", model=key):
+        for rows, block in store.iter_partition_blocks(key, categories, block_rows):
+            keep = valid[rows]
+            if not keep.all():
+                rows, block = rows[keep], block[keep]
+            norms = np.linalg.norm(block, axis=1)
+            norms[norms == 0] = 1.0
+            sims = (block @ q) / norms
+            # ブロックごとの上位 k 件と、それまでの上位 k 件をまとめて選び直す
+            rows = np.concatenate([best_rows, rows])
+            sims = np.concatenate([best_sims, sims])
+            if len(sims) > k:
+                top = np.argpartition(-sims, k - 1)[:k]
+                rows, sims = rows[top], sims[top]
+            best_rows, best_sims = rows, sims
+            metrics.incr("search_rows_scanned", len(block), model=key)
+    order = np.argsort(-best_sims, kind="stable")
+    return [(int(best_rows[i]), float(best_sims[i])) for i in order]
+
+
+def project_categories(store, key, axis_x, axis_y, categories=None, block_rows=65536):
+    """指定カテゴリの行だけを 2 軸に射影し、(行番号, xs, ys) を返す（隔離した行は除く）"""
+    axes = np.stack([axis_x, axis_y], axis=1).astype(np.float32)
+    valid = store.valid_mask(key)
+    rows_parts, xy_parts = [], []
+    with metrics.span("projection", model=key):
+        for rows, block in store.iter_partition_blocks(key, categories, block_rows):
+            keep = valid[rows]
+            if not keep.all():
+                rows, block = rows[keep], block[keep]
+            rows_parts.append(rows)
+            xy_parts.append(block @ axes)
+    if not rows_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+    xy = np.concatenate(xy_parts)
+    return np.concatenate(rows_parts), xy[:, 0].copy(), xy[:, 1].copy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストアをコサイン類似度で検索します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument("query", help="検索ワード")
+    parser.add_argument("--models", help="対象モデルキー（カンマ区切り, 省略時は全モデル）")
+    parser.add_argument("--categories", help="対象カテゴリ（カンマ区切り, 省略時は全カテゴリ）")
+    parser.add_argument("--top", type=int, default=10, help="表示件数")
+    args = parser.parse_args()
+
+    from embed_items import MODELS, embed_batch
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    store = VectorStore.open_or_import(base_dir, args.folder)
+    keys = args.models.split(",") if args.models else store.model_keys()
+    categories = args.categories.split(",") if args.categories else None
+    if categories and store.partitions() is None:
+        print("⚠️ カテゴリ別に並べ替えられていないため全件を走査します（python vector_store.py <folder> --partition）")
+
+    names = {name.replace("/", "_"): name for name in MODELS}
+    for key in keys:
+        query_vec = embed_batch([args.query], names.get(key, key))[0]
+        hits = search(store, key, query_vec, args.top, categories)
+        print(f"\n🔍 {key}")
+        for rec, (_, sim) in zip(store.records_at([row for row, _ in hits]), hits):
+            print(f"  {sim * 100:6.1f}%  {rec.get('カテゴリ', '')}  {rec.get('argument', '')}")
+
+
+if __name__ == "__main__":
+    main()
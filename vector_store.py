@@ -0,0 +1,612 @@
+"""
+追記型のオンディスク・ベクトルストア
+
+data/<folder>/store/ 以下に次の形式で保存する:
+    meta.json           行数・モデルごとの次元数・無効な行（隔離してゼロベクトルで保存した行）の元の行番号
+    rows.jsonl          1 行 1 JSON（args.csv の各カラム）
+    vectors_<key>.f32   float32 行優先の生バイナリ（np.memmap で部分読み込み可能）
+    row_offsets.i64     rows.jsonl 内の各行の開始バイト位置（任意の行をシークして読むため）
+    row_ids.i64         各行の元の行番号（args.csv 上の位置）
+    bitmaps.npz         カテゴリごとの所属ビットマップ（元の行番号順, regroup_by_category 後のみ）
+    *.zc                pack() で作る vectors_<key>.f32 / rows.jsonl のチャンク圧縮版（artifact_io のチャンク形式）
+
+meta.json の "rows" がコミット済み行数で、途中で中断された追記分は読み込み時に無視される。
+regroup_by_category() は行を並べ替えたファイルを世代番号つきの名前（rows.g<世代>.jsonl など）で書き、
+meta.json の "generation" を書き換えた時点で切り替える（古い世代のファイルはその後で消す）。
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from artifact_io import compress_codec, iter_array_chunks, iter_chunks, load_pickle, write_array_chunks, write_chunks
+
+STORE_DIRNAME = "store"
+
+
+def model_key(model_name):
+    return model_name.replace("/", "_")
+
+
+def _clean(value):
+    # pandas の NaN は JSON にできないので None にする
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class VectorStore:
+    def __init__(self, base_dir):
+        self.base_dir = Path(base_dir)
+        self.dir = self.base_dir / STORE_DIRNAME
+        self.meta_path = self.dir / "meta.json"
+        self.meta = self._read_meta()
+
+    # ─── メタ情報 ─────────────────────────────────────
+    def _read_meta(self):
+        if self.meta_path.exists():
+            with open(self.meta_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"version": 1, "rows": 0, "rows_bytes": 0, "models": {}}
+
+    def reload(self):
+        self.meta = self._read_meta()
+
+    def fingerprint(self):
+        """
+        ストアの内容が変わるたびに変わる文字列（meta.json の内容と更新時刻から作る）。
+        他のプロセスによる書き込みも拾えるよう、毎回ディスクから読む
+        """
+        if not self.meta_path.exists():
+            return "empty"
+        stat = self.meta_path.stat()
+        digest = hashlib.sha1(self.meta_path.read_bytes()).hexdigest()[:16]
+        return f"{digest}-{stat.st_mtime_ns}"
+
+    def _write_meta(self):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.meta_path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.meta_path)
+
+    def exists(self):
+        return self.meta_path.exists()
+
+    @property
+    def num_rows(self):
+        return self.meta["rows"]
+
+    def model_keys(self):
+        return list(self.meta["models"].keys())
+
+    def row_order(self):
+        """
+        行の並びの版。reset・regroup_by_category で増える。
+        行番号で引く成果物（クラスタ木・近傍グラフなど）は作成時の値を記録し、違っていれば作り直す
+        """
+        return self.meta.get("row_order", 0)
+
+    def dim(self, key):
+        return self.meta["models"][key]["dim"]
+
+    def invalid_ids(self, key):
+        """埋め込みに失敗してゼロベクトルで保存した行の元の行番号（row_ids の値）"""
+        return self.meta["models"][key].get("invalid", [])
+
+    def valid_mask(self, key):
+        """
+        行ごとに、そのモデルのベクトルが有効かどうかの bool 配列（ストアの行順）。
+        隔離した行は False なので、検索・近傍・クラスタ・概観では除外する
+        """
+        invalid = self.invalid_ids(key)
+        if not invalid:
+            return np.ones(self.num_rows, dtype=bool)
+        return ~np.isin(self.row_ids(), invalid)
+
+    def generation(self):
+        """今のファイルの世代（regroup_by_category で増える。0 は世代番号なしの名前）"""
+        return self.meta.get("generation", 0)
+
+    def _path(self, stem, suffix, generation=None):
+        generation = self.generation() if generation is None else generation
+        return self.dir / (f"{stem}{suffix}" if generation == 0 else f"{stem}.g{generation}{suffix}")
+
+    @property
+    def rows_path(self):
+        return self._path("rows", ".jsonl")
+
+    @property
+    def offsets_path(self):
+        return self._path("row_offsets", ".i64")
+
+    @property
+    def row_ids_path(self):
+        return self._path("row_ids", ".i64")
+
+    @property
+    def bitmaps_path(self):
+        return self._path("bitmaps", ".npz")
+
+    def vectors_path(self, key, generation=None):
+        return self._path(f"vectors_{key}", ".f32", generation)
+
+    def packed_path(self, path):
+        return Path(path).with_name(Path(path).name + ".zc")
+
+    def _raw_paths(self):
+        return [self.vectors_path(key) for key in self.model_keys()] + [self.rows_path]
+
+    # ─── 書き込み ────────────────────────────────────
+    def reset(self):
+        """ストアを空にして作り直す"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._discard_packed()
+        # どの世代のファイルも消して、世代番号なしの名前から始め直す
+        for pattern in ("vectors_*.f32", "rows*.jsonl", "row_offsets*.i64", "row_ids*.i64", "bitmaps*.npz"):
+            for path in self.dir.glob(pattern):
+                path.unlink()
+        self.meta.pop("generation", None)
+        self.rows_path.write_text("", encoding="utf-8")
+        self.offsets_path.write_bytes(b"")
+        self.row_ids_path.write_bytes(b"")
+        self.meta = {"version": 1, "rows": 0, "rows_bytes": 0, "models": {}, "row_order": self.row_order() + 1}
+        self._write_meta()
+
+    def drop_model(self, key):
+        self.ensure_unpacked()
+        self._discard_packed()
+        self.meta["models"].pop(key, None)
+        path = self.vectors_path(key)
+        if path.exists():
+            path.unlink()
+        self._write_meta()
+
+    def _truncate_uncommitted(self):
+        """前回中断時にコミットされなかった末尾を切り詰める"""
+        n = self.num_rows
+        for key in self.model_keys():
+            path = self.vectors_path(key)
+            size = n * self.dim(key) * 4
+            if path.exists() and path.stat().st_size > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        for path in (self.offsets_path, self.row_ids_path):
+            if path.exists() and path.stat().st_size > n * 8:
+                with open(path, "r+b") as f:
+                    f.truncate(n * 8)
+        committed = self.meta.get("rows_bytes", 0)
+        if self.rows_path.exists() and self.rows_path.stat().st_size > committed:
+            with open(self.rows_path, "r+b") as f:
+                f.truncate(committed)
+
+    def append(self, records, vectors_by_model, invalid=None):
+        """
+        records: list[dict] （行メタデータ）
+        vectors_by_model: {model_key: array (len(records), dim)}
+        invalid: {model_key: records 内の位置のリスト} 隔離してゼロベクトルを入れた行（valid_mask() で除外される）
+        ベクトル → 行 → meta の順に書き、meta 更新でコミットする。
+        行のあるストアには、既存のモデルとちょうど同じキーのベクトルを渡す（過不足があると ValueError）
+        """
+        n = len(records)
+        if n == 0:
+            return
+        if self.num_rows > 0 and set(vectors_by_model) != set(self.model_keys()):
+            missing = sorted(set(self.model_keys()) - set(vectors_by_model))
+            extra = sorted(set(vectors_by_model) - set(self.model_keys()))
+            raise ValueError(f"モデルの組が既存のストアと一致しません（不足: {missing}, 追加: {extra}）")
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.ensure_unpacked()
+        self._discard_packed()
+        self._truncate_uncommitted()
+        with metrics.span("store.write", artifact="vector_store"):
+            for key, vectors in vectors_by_model.items():
+                arr = np.ascontiguousarray(vectors, dtype=np.float32)
+                if arr.shape[0] != n:
+                    raise ValueError(f"行数が一致しません: {key} {arr.shape[0]} != {n}")
+                if key not in self.meta["models"]:
+                    self.meta["models"][key] = {"dim": int(arr.shape[1])}
+                elif self.dim(key) != arr.shape[1]:
+                    raise ValueError(f"次元数が一致しません: {key} {arr.shape[1]} != {self.dim(key)}")
+                with open(self.vectors_path(key), "ab") as f:
+                    f.write(arr.tobytes())
+            self._ensure_row_index()
+            offsets = np.empty(n, dtype=np.int64)
+            with open(self.rows_path, "ab") as f:
+                for i, rec in enumerate(records):
+                    offsets[i] = f.tell()
+                    f.write((json.dumps({k: _clean(v) for k, v in rec.items()}, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.meta["rows_bytes"] = f.tell()
+            with open(self.offsets_path, "ab") as f:
+                f.write(offsets.tobytes())
+            first_id = self.meta.get("next_row_id", self.num_rows)
+            with open(self.row_ids_path, "ab") as f:
+                f.write(np.arange(first_id, first_id + n, dtype=np.int64).tobytes())
+            for key, positions in (invalid or {}).items():
+                if len(positions):
+                    ids = self.meta["models"][key].setdefault("invalid", [])
+                    ids.extend(first_id + int(p) for p in positions)
+            self.meta["next_row_id"] = first_id + n
+            self.meta["rows"] += n
+            self._write_meta()
+
+    def _ensure_row_index(self):
+        """row_offsets / row_ids がない古いストアでは rows.jsonl から作り直す"""
+        n = self.num_rows
+        if self.offsets_path.exists() and self.row_ids_path.exists():
+            return
+        offsets = np.empty(n, dtype=np.int64)
+        pos = 0
+        if self.rows_path.exists():
+            with open(self.rows_path, "rb") as f:
+                for i in range(n):
+                    offsets[i] = pos
+                    pos += len(f.readline())
+        self.offsets_path.write_bytes(offsets.tobytes())
+        self.row_ids_path.write_bytes(np.arange(n, dtype=np.int64).tobytes())
+
+    # ─── カテゴリ別パーティション ───────────────────────────
+    def regroup_by_category(self, column="カテゴリ", block_rows=4096):
+        """
+        行をカテゴリごとに連続するよう並べ替えて書き直す。
+        カテゴリごとの [開始, 終了) 行範囲を meta.json に、所属ビットマップを bitmaps.npz に保存する。
+        並べ替えたファイルは次の世代の名前で書き、meta.json の置き換えで一度に切り替える
+        （途中で中断しても meta.json は元の世代を指したまま）。
+        行番号が変わるので row_order() を増やす（古い行番号の成果物は読み込み時に検出される）
+        """
+        n = self.num_rows
+        self.ensure_unpacked()
+        self._discard_packed()
+        self._ensure_row_index()
+        cats = np.array(["" if rec.get(column) is None else str(rec.get(column)) for rec in self.iter_records()], dtype=object)
+        perm = np.argsort(cats, kind="stable")
+        old_ids = self.row_ids()
+        old_paths = [self.vectors_path(key) for key in self.model_keys()] + [
+            self.rows_path, self.offsets_path, self.row_ids_path, self.bitmaps_path,
+        ]
+        gen = self.generation() + 1
+
+        with metrics.span("store.write", artifact="regroup"):
+            for key in self.model_keys():
+                mat = self.matrix(key)
+                with open(self.vectors_path(key, gen), "wb") as f:
+                    for start in range(0, n, block_rows):
+                        idx = perm[start:start + block_rows]
+                        order = np.argsort(idx)
+                        block = np.empty((len(idx), self.dim(key)), dtype=np.float32)
+                        block[order] = mat[idx[order]]  # memmap は昇順に読む
+                        f.write(block.tobytes())
+            offsets = np.empty(n, dtype=np.int64)
+            with open(self.rows_path, "rb") as src, open(self._path("rows", ".jsonl", gen), "wb") as dst:
+                src_offsets = np.fromfile(self.offsets_path, dtype=np.int64, count=n)
+                for i, row in enumerate(perm):
+                    src.seek(src_offsets[row])
+                    offsets[i] = dst.tell()
+                    dst.write(src.readline())
+                rows_bytes = dst.tell()
+            offsets.tofile(self._path("row_offsets", ".i64", gen))
+            new_ids = old_ids[perm]
+            new_ids.tofile(self._path("row_ids", ".i64", gen))
+
+            partitions = {}
+            sorted_cats = cats[perm]
+            bitmaps = {}
+            id_space = int(old_ids.max()) + 1 if n else 0
+            for cat in dict.fromkeys(sorted_cats):
+                start = int(np.searchsorted(sorted_cats, cat, side="left"))
+                end = int(np.searchsorted(sorted_cats, cat, side="right"))
+                partitions[cat] = [start, end]
+                mask = np.zeros(id_space, dtype=bool)
+                mask[new_ids[start:end]] = True
+                bitmaps[f"p{len(bitmaps)}"] = np.packbits(mask)
+            np.savez(self._path("bitmaps", ".npz", gen), **bitmaps)
+
+            # meta.json を置き換えた時点で新しい世代に切り替わる
+            self.meta["generation"] = gen
+            self.meta["rows_bytes"] = rows_bytes
+            self.meta["partitions"] = {"column": column, "rows": n, "id_space": id_space, "categories": partitions}
+            self.meta["row_order"] = self.row_order() + 1
+            self._write_meta()
+            for path in old_paths:
+                path.unlink(missing_ok=True)
+        return partitions
+
+    def partitions(self):
+        """カテゴリ → [開始, 終了) 行範囲。未作成、または作成後に行が追記されていれば None"""
+        part = self.meta.get("partitions")
+        if not part or part["rows"] != self.num_rows:
+            return None
+        return part["categories"]
+
+    def category_ranges(self, categories):
+        """指定カテゴリの行範囲のリスト（パーティションが使えなければ None）"""
+        part = self.partitions()
+        if part is None:
+            return None
+        return [tuple(part[c]) for c in categories if c in part]
+
+    def category_bitmap(self, categories):
+        """指定カテゴリに属するかどうかの bool 配列（元の行番号順）"""
+        part = self.meta.get("partitions")
+        if not part or self.partitions() is None:
+            raise RuntimeError("カテゴリのパーティションがありません。regroup_by_category() を実行してください")
+        names = list(part["categories"].keys())
+        mask = np.zeros(part["id_space"], dtype=bool)
+        with np.load(self.bitmaps_path) as bitmaps:
+            for c in categories:
+                if c in part["categories"]:
+                    mask |= np.unpackbits(bitmaps[f"p{names.index(c)}"], count=part["id_space"]).astype(bool)
+        return mask
+
+    def iter_partition_blocks(self, key, categories=None, block_rows=4096, column="カテゴリ"):
+        """
+        (行番号の配列, ndarray) を返す。categories を指定するとそのカテゴリの行だけを読む。
+        パーティション済みなら該当範囲のみ、未作成なら全行を読んでから絞り込む
+        """
+        mat = self.matrix(key)
+        if not categories:
+            ranges = [(0, self.num_rows)]
+        else:
+            ranges = self.category_ranges(categories)
+        if ranges is not None:
+            for start, end in ranges:
+                for s in range(start, end, block_rows):
+                    e = min(s + block_rows, end)
+                    with metrics.span("store.read", artifact="vector_store"):
+                        block = np.array(mat[s:e])
+                    yield np.arange(s, e), block
+            return
+        selected = set(categories)
+        mask = np.array([rec.get(column) in selected for rec in self.iter_records()], dtype=bool)
+        for start, block in self.iter_blocks(key, block_rows):
+            rows = np.flatnonzero(mask[start:start + len(block)])
+            if len(rows):
+                yield rows + start, block[rows]
+
+    # ─── 圧縮（あまり使わないフォルダの保管用） ─────────────────
+    def pack(self, codec=None, block_rows=4096, drop_raw=False):
+        """
+        vectors_<key>.f32 と rows.jsonl をチャンク圧縮版（*.zc）として書く（codec の既定は compress_codec()）。
+        drop_raw=True なら元のファイルを消す（次に memmap や行を読むときに自動で展開する）。
+        (元のバイト数, 圧縮後のバイト数) を返す
+        """
+        codec = codec or compress_codec()
+        self.ensure_unpacked()
+        self._truncate_uncommitted()
+        with metrics.span("store.write", artifact="packed"):
+            for key in self.model_keys():
+                write_array_chunks(
+                    self.packed_path(self.vectors_path(key)),
+                    (block for _, block in self.iter_blocks(key, block_rows)),
+                    codec,
+                )
+            with open(self.rows_path, "rb") as f:
+                lines = itertools.islice(f, self.num_rows)
+                blocks = iter(lambda: b"".join(itertools.islice(lines, block_rows)), b"")
+                write_chunks(self.packed_path(self.rows_path), blocks, codec)
+        before = sum(p.stat().st_size for p in self._raw_paths())
+        after = sum(self.packed_path(p).stat().st_size for p in self._raw_paths())
+        if drop_raw:
+            for path in self._raw_paths():
+                path.unlink()
+            # shared_matrices.py の正規化済み行列も作り直せるので消す
+            for path in itertools.chain(self.dir.glob("normalized_*"), self.dir.glob("norms_*.f32")):
+                path.unlink()
+        return before, after
+
+    def unpack(self):
+        """*.zc から元のファイルを書き戻す（一時ファイルに展開してから置き換える）"""
+        with metrics.span("store.read", artifact="packed"):
+            for key in self.model_keys():
+                path = self.vectors_path(key)
+                tmp = path.with_name(path.name + ".tmp")
+                with open(tmp, "wb") as f:
+                    for _, block in iter_array_chunks(self.packed_path(path)):
+                        f.write(block.tobytes())
+                os.replace(tmp, path)
+            tmp = self.rows_path.with_name(self.rows_path.name + ".tmp")
+            with open(tmp, "wb") as f:
+                for data in iter_chunks(self.packed_path(self.rows_path)):
+                    f.write(data)
+            os.replace(tmp, self.rows_path)
+
+    def is_packed(self):
+        """元のファイルが消されていて、圧縮版だけがある状態か"""
+        return any(not p.exists() and self.packed_path(p).exists() for p in self._raw_paths())
+
+    def ensure_unpacked(self):
+        if self.is_packed():
+            print(f"📦 圧縮されたストアを展開します: {self.dir}")
+            self.unpack()
+
+    def _discard_packed(self):
+        # 書き込み後は圧縮版が古くなるので消す（元のファイルがある状態でだけ呼ぶ）
+        for path in self.dir.glob("*.zc"):
+            path.unlink()
+
+    # ─── 読み込み ────────────────────────────────────
+    def matrix(self, key):
+        """(rows, dim) の読み取り専用 memmap を返す"""
+        n, d = self.num_rows, self.dim(key)
+        if n == 0:
+            return np.zeros((0, d), dtype=np.float32)
+        self.ensure_unpacked()
+        return np.memmap(self.vectors_path(key), dtype=np.float32, mode="r", shape=(n, d))
+
+    def iter_blocks(self, key, block_rows=4096):
+        """(開始行, ndarray) を block_rows 行ずつ返す。圧縮版しかなければ展開せずにチャンクから読む"""
+        path = self.vectors_path(key)
+        if self.num_rows and not path.exists() and self.packed_path(path).exists():
+            for start, chunk in iter_array_chunks(self.packed_path(path)):
+                for s in range(0, len(chunk), block_rows):
+                    yield start + s, np.array(chunk[s:s + block_rows])
+            return
+        mat = self.matrix(key)
+        for start in range(0, self.num_rows, block_rows):
+            with metrics.span("store.read", artifact="vector_store"):
+                block = np.array(mat[start:start + block_rows])
+            yield start, block
+
+    def iter_records(self):
+        if self.num_rows and not self.rows_path.exists() and self.packed_path(self.rows_path).exists():
+            rows = (line for data in iter_chunks(self.packed_path(self.rows_path)) for line in data.splitlines())
+            for line in itertools.islice(rows, self.num_rows):
+                yield json.loads(line)
+            return
+        with open(self.rows_path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if i >= self.num_rows:
+                    break
+                yield json.loads(line)
+
+    def records(self):
+        return list(self.iter_records())
+
+    def records_at(self, rows):
+        """指定した行番号のレコードだけをシークして読む"""
+        self.ensure_unpacked()
+        self._ensure_row_index()
+        offsets = np.memmap(self.offsets_path, dtype=np.int64, mode="r", shape=(self.num_rows,))
+        out = []
+        with open(self.rows_path, "rb") as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                out.append(json.loads(f.readline()))
+        return out
+
+    def row_ids(self):
+        """各行の元の行番号（args.csv 上の位置）"""
+        self._ensure_row_index()
+        return np.fromfile(self.row_ids_path, dtype=np.int64, count=self.num_rows)
+
+    def texts(self, text_column="argument"):
+        return [str(rec.get(text_column, "")) for rec in self.iter_records()]
+
+    def to_combined(self):
+        """従来の embedded_items_<folder>.pkl と同じ形式の dict に変換（元の行順に戻す）"""
+        texts = self.texts()
+        order = np.argsort(self.row_ids(), kind="stable")
+        if np.array_equal(order, np.arange(len(order))):
+            order = slice(None)
+        return {
+            "texts": [texts[i] for i in order] if isinstance(order, np.ndarray) else texts,
+            "embeddings": {key: np.asarray(self.matrix(key))[order].tolist() for key in self.model_keys()},
+            "invalid": {
+                key: np.flatnonzero(~self.valid_mask(key)[order]).tolist()
+                for key in self.model_keys()
+                if self.invalid_ids(key)
+            },
+        }
+
+    # ─── 従来形式からの取り込み ──────────────────────────
+    @classmethod
+    def import_combined(cls, base_dir, folder, block_rows=4096):
+        """embedded_items_<folder>.pkl（と args.csv）からストアを作る"""
+        import pandas as pd
+
+        base_dir = Path(base_dir)
+        combined = load_pickle(base_dir / f"embedded_items_{folder}.pkl")
+        texts = combined["texts"]
+        args_path = base_dir / "args.csv"
+        if args_path.exists():
+            records = pd.read_csv(args_path).to_dict(orient="records")
+        else:
+            records = [{"argument": t} for t in texts]
+
+        store = cls(base_dir)
+        store.reset()
+        embeddings = {k: v for k, v in combined["embeddings"].items() if v is not None}
+        invalid = {k: np.asarray(v, dtype=np.int64) for k, v in combined.get("invalid", {}).items() if k in embeddings}
+        for start in range(0, len(texts), block_rows):
+            end = min(start + block_rows, len(texts))
+            store.append(
+                records[start:end],
+                {k: np.asarray(v[start:end], dtype=np.float32) for k, v in embeddings.items()},
+                {k: rows[(rows >= start) & (rows < end)] - start for k, rows in invalid.items()},
+            )
+        return store
+
+    @classmethod
+    def open_or_import(cls, base_dir, folder):
+        """ストアを開く。ないか、embedded_items_<folder>.pkl の方が新しければ取り込み直す"""
+        store = cls(base_dir)
+        combined_path = Path(base_dir) / f"embedded_items_{folder}.pkl"
+        stale = (
+            store.exists()
+            and combined_path.exists()
+            and combined_path.stat().st_mtime > store.meta_path.stat().st_mtime
+        )
+        if not store.exists() or stale:
+            print(f"📥 {folder} の埋め込みをストア形式に取り込みます")
+            store = cls.import_combined(base_dir, folder)
+        return store
+
+
+def load_embedded_items(base_dir, folder):
+    """
+    texts / embeddings の dict を返す。
+    embedded_items_<folder>.pkl とストアのうち新しい方を使う（ストリーミングモードでは pkl を作らない）
+    """
+    base_dir = Path(base_dir)
+    combined_path = base_dir / f"embedded_items_{folder}.pkl"
+    store = VectorStore(base_dir)
+    use_store = store.exists() and (
+        not combined_path.exists() or store.meta_path.stat().st_mtime > combined_path.stat().st_mtime
+    )
+    if use_store:
+        with metrics.span("store.read", artifact="vector_store"):
+            return store.to_combined()
+    if not combined_path.exists():
+        raise FileNotFoundError(f"埋め込みまとめファイルが見つかりません: {combined_path}")
+    with metrics.span("store.read", artifact="embedded_items"):
+        return load_pickle(combined_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="embedded_items_<folder>.pkl をストア形式に変換します")
+    parser.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    parser.add_argument(
+        "--partition",
+        action="store_true",
+        help="既存のストア（なければ pkl から作成）をカテゴリごとに並べ替える",
+    )
+    parser.add_argument("--column", default="カテゴリ", help="パーティションに使うカラム")
+    parser.add_argument("--pack", action="store_true", help="既存のストアのベクトルと行をチャンク圧縮する")
+    parser.add_argument("--drop-raw", action="store_true", help="--pack の後に非圧縮のファイルを消す（読むときに自動で展開）")
+    parser.add_argument("--unpack", action="store_true", help="圧縮版から非圧縮のファイルを書き戻す")
+    parser.add_argument("--codec", choices=["zstd", "gzip", "none"], help="--pack の圧縮方式（省略時は ARTIFACT_COMPRESSION、なければ zstd か gzip）")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    if args.pack:
+        store = VectorStore.open_or_import(base_dir, args.folder)
+        before, after = store.pack(args.codec, drop_raw=args.drop_raw)
+        print(f"✅ ストアを圧縮しました: {before / 1024 ** 2:.1f} MB → {after / 1024 ** 2:.1f} MB")
+        return
+    if args.unpack:
+        store = VectorStore(base_dir)
+        store.unpack()
+        print(f"✅ ストアを展開しました: {store.dir}")
+        return
+    if args.partition:
+        store = VectorStore.open_or_import(base_dir, args.folder)
+        partitions = store.regroup_by_category(args.column)
+        for cat, (start, end) in partitions.items():
+            print(f"  🗂️ {cat}: {end - start} 行 [{start}, {end})")
+        print(f"✅ カテゴリ別に並べ替えました: {store.dir}")
+        return
+
+    store = VectorStore.import_combined(base_dir, args.folder)
+    print(f"✅ ストアを作成しました: {store.dir} ({store.num_rows} 行, モデル: {store.model_keys()})")
+
+
+if __name__ == "__main__":
+    main()
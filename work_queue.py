@@ -0,0 +1,319 @@
+"""
+複数ホストで埋め込みを分担するためのワークキュー
+
+コーディネータが args.csv をシャードに分割し、各ホストのワーカーが共有ディレクトリ上の
+SQLite ファイル（data/<folder>/queue/queue.sqlite）からシャードをリース（期限付きで確保）して埋め込む。
+ワーカーが落ちてリースが切れたシャードは別のワーカーが取り直す。
+各シャードの結果は queue/out/shard_<id>/ にストア形式で（隔離したアイテムは同じディレクトリの quarantine.jsonl に）
+書かれ、merge でフォルダのストアと quarantine.jsonl へまとめる。
+モデルのエラーでシャードが失敗するとキューに戻り、max_attempts 回失敗すると failed になる。
+
+    python work_queue.py init sample --shard-rows 1000
+    python work_queue.py work sample            # ホストごとに何プロセスでも起動できる
+    python work_queue.py status sample
+    python work_queue.py merge sample
+"""
+import argparse
+import os
+import shutil
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from embed_items import LOCAL_MODELS, MODELS, QUARANTINE_FILENAME, embed_batch, invalid_rows, write_quarantine
+from llm import preload_local_models
+from vector_store import VectorStore, model_key
+
+QUEUE_DIRNAME = "queue"
+
+
+def queue_dir(base_dir):
+    return Path(base_dir) / QUEUE_DIRNAME
+
+
+def _connect(base_dir):
+    conn = sqlite3.connect(queue_dir(base_dir) / "queue.sqlite", timeout=60, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 60000")
+    return conn
+
+
+def init_queue(base_dir, shard_rows=1000):
+    """args.csv をシャードに分割してキューを作り直す。シャード数を返す"""
+    qdir = queue_dir(base_dir)
+    if qdir.exists():
+        shutil.rmtree(qdir)
+    (qdir / "shards").mkdir(parents=True)
+    (qdir / "out").mkdir()
+
+    conn = _connect(base_dir)
+    conn.execute(
+        """CREATE TABLE shards (
+            id INTEGER PRIMARY KEY,
+            start_row INTEGER NOT NULL,
+            end_row INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        )"""
+    )
+    n = 0
+    for i, chunk in enumerate(pd.read_csv(Path(base_dir) / "args.csv", chunksize=shard_rows)):
+        chunk.to_csv(qdir / "shards" / f"shard_{i}.csv", index=False)
+        conn.execute(
+            "INSERT INTO shards (id, start_row, end_row) VALUES (?, ?, ?)",
+            (i, int(chunk.index[0]), int(chunk.index[-1]) + 1),
+        )
+        n += 1
+    conn.close()
+    return n
+
+
+def claim_shard(conn, worker, lease_seconds, max_attempts):
+    """未処理またはリース切れのシャードを 1 つ確保する。なければ None"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """SELECT id, start_row, attempts FROM shards
+               WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+               ORDER BY id LIMIT 1""",
+            (now,),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        shard_id, start_row, attempts = row
+        if attempts >= max_attempts:
+            conn.execute(
+                "UPDATE shards SET status = 'failed', error = COALESCE(error, 'too many attempts') WHERE id = ?",
+                (shard_id,),
+            )
+            conn.execute("COMMIT")
+            return claim_shard(conn, worker, lease_seconds, max_attempts)
+        if attempts:
+            metrics.incr("queue_reclaims")
+        conn.execute(
+            "UPDATE shards SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+            (worker, now + lease_seconds, shard_id),
+        )
+        conn.execute("COMMIT")
+        return shard_id, start_row
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def renew_lease(conn, shard_id, worker, lease_seconds):
+    """リースを延長する。他のワーカーに取られていれば False"""
+    cur = conn.execute(
+        "UPDATE shards SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+        (time.time() + lease_seconds, shard_id, worker),
+    )
+    return cur.rowcount == 1
+
+
+def finish_shard(conn, shard_id, worker, status, error=None):
+    cur = conn.execute(
+        "UPDATE shards SET status = ?, error = ?, lease_expires = NULL WHERE id = ? AND worker = ? AND status = 'leased'",
+        (status, error, shard_id, worker),
+    )
+    return cur.rowcount == 1
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def embed_shard(base_dir, shard_id, start_row, models, renew, batch_size=100):
+    """
+    シャードを埋め込み、queue/out/shard_<id>/ にストアとして書く。
+    モデルのエラーはそのまま送出する（呼び出し側でシャードをキューに戻す）
+    """
+    qdir = queue_dir(base_dir)
+    df = pd.read_csv(qdir / "shards" / f"shard_{shard_id}.csv")
+    texts = df["argument"].astype(str).tolist()
+
+    vectors_by_model = {}
+    invalid = {}
+    quarantined = []
+    for model_name in models:
+        parts = []
+        invalid[model_key(model_name)] = []
+        try:
+            for i in range(0, len(texts), batch_size):
+                if not renew():
+                    raise LeaseLost(f"shard {shard_id}")
+                bad_items = []
+                parts.append(embed_batch(texts[i:i + batch_size], model_name, bad_items))
+                invalid[model_key(model_name)].extend(i + row for row in invalid_rows(bad_items))
+                quarantined.append((model_name, start_row + i, bad_items))
+        except LeaseLost:
+            raise
+        except Exception:
+            metrics.incr("model_failures", model=model_name)
+            raise
+        vectors_by_model[model_key(model_name)] = np.concatenate(parts)
+
+    out = qdir / "out" / f"shard_{shard_id}"
+    tmp = out.with_name(out.name + f".tmp{os.getpid()}")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    store = VectorStore(tmp)
+    store.reset()
+    store.append(df.to_dict(orient="records"), vectors_by_model, invalid)
+    # 共有の quarantine.jsonl には書かず、シャードの結果と一緒に置いて merge でまとめる
+    for model_name, row, bad_items in quarantined:
+        write_quarantine(tmp, model_name, row, bad_items)
+    if out.exists():
+        shutil.rmtree(out)
+    os.replace(tmp, out)
+    return list(vectors_by_model)
+
+
+def run_worker(base_dir, models=MODELS, lease_seconds=600, max_attempts=3, batch_size=100):
+    """シャードがなくなるまで確保 → 埋め込み → 完了 を繰り返す。処理したシャード数を返す"""
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    conn = _connect(base_dir)
+    preload_local_models([m for m in models if m in LOCAL_MODELS])
+    done = 0
+    while True:
+        claimed = claim_shard(conn, worker, lease_seconds, max_attempts)
+        if claimed is None:
+            break
+        shard_id, start_row = claimed
+        print(f"▶️ [{worker}] shard {shard_id} を処理中...")
+        try:
+            with metrics.span("queue.shard"):
+                keys = embed_shard(
+                    base_dir, shard_id, start_row, models,
+                    lambda: renew_lease(conn, shard_id, worker, lease_seconds), batch_size,
+                )
+        except LeaseLost:
+            print(f"⚠️ [{worker}] shard {shard_id} のリースが切れたため破棄します")
+            continue
+        except Exception as e:
+            # 他のワーカー（または自分）が取り直せるよう戻す。max_attempts を超えると failed になる
+            finish_shard(conn, shard_id, worker, "pending", f"{type(e).__name__}: {e}")
+            print(f"❌ [{worker}] shard {shard_id} に失敗しました: {e}")
+            continue
+        if finish_shard(conn, shard_id, worker, "done"):
+            done += 1
+            metrics.incr("queue_shards_done")
+            print(f"✅ [{worker}] shard {shard_id} 完了 (モデル: {keys})")
+    conn.close()
+    return done
+
+
+def queue_status(base_dir):
+    conn = _connect(base_dir)
+    rows = conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+    failed = conn.execute("SELECT id, error FROM shards WHERE status = 'failed'").fetchall()
+    conn.close()
+    return dict(rows), failed
+
+
+def merge_shards(base_dir, block_rows=4096):
+    """完了した全シャードの結果を、元の行順でフォルダのストアと quarantine.jsonl へまとめる"""
+    counts, _ = queue_status(base_dir)
+    pending = sum(v for k, v in counts.items() if k != "done")
+    if pending:
+        raise RuntimeError(f"未完了のシャードがあります: {counts}")
+
+    conn = _connect(base_dir)
+    shard_ids = [r[0] for r in conn.execute("SELECT id FROM shards ORDER BY start_row")]
+    conn.close()
+    out_dirs = [queue_dir(base_dir) / "out" / f"shard_{i}" for i in shard_ids]
+    shards = [VectorStore(d) for d in out_dirs]
+    keys = [k for k in shards[0].model_keys() if all(k in s.model_keys() for s in shards)] if shards else []
+    dropped = sorted({k for s in shards for k in s.model_keys()} - set(keys))
+    if dropped:
+        print(f"⚠️ 一部のシャードにしかないモデルは除外します: {dropped}")
+
+    store = VectorStore(base_dir)
+    store.reset()
+    with metrics.span("queue.merge"):
+        for shard in shards:
+            records = shard.iter_records()
+            invalid = {k: np.flatnonzero(~shard.valid_mask(k)) for k in keys}
+            for start in range(0, shard.num_rows, block_rows):
+                end = min(start + block_rows, shard.num_rows)
+                store.append(
+                    [next(records) for _ in range(start, end)],
+                    {k: shard.matrix(k)[start:end] for k in keys},
+                    {k: rows[(rows >= start) & (rows < end)] - start for k, rows in invalid.items()},
+                )
+
+    # ストアを作り直したので、隔離リストもシャードの分で置き換える
+    path = Path(base_dir) / QUARANTINE_FILENAME
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    n = 0
+    with open(tmp, "w", encoding="utf-8") as dst:
+        for out_dir in out_dirs:
+            shard_path = out_dir / QUARANTINE_FILENAME
+            if not shard_path.exists():
+                continue
+            with open(shard_path, encoding="utf-8") as src:
+                for line in src:
+                    dst.write(line)
+                    n += 1
+    if n:
+        os.replace(tmp, path)
+        print(f"⚠️ {n} 件の隔離アイテムをまとめました: {path}")
+    else:
+        tmp.unlink()
+        path.unlink(missing_ok=True)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数ワーカーで埋め込みを分担するワークキュー")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    init = sub.add_parser("init", help="args.csv をシャードに分割してキューを作成")
+    init.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    init.add_argument("--shard-rows", type=int, default=1000, help="1 シャードの行数")
+
+    work = sub.add_parser("work", help="シャードを確保して埋め込む（キューが空になるまで）")
+    work.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    work.add_argument("--models", help="このワーカーで使うモデル（カンマ区切り, 省略時は MODELS すべて）")
+    work.add_argument("--lease-seconds", type=float, default=600, help="リースの有効期間（バッチごとに延長）")
+    work.add_argument("--max-attempts", type=int, default=3, help="リース切れで取り直す最大回数")
+    work.add_argument("--batch-size", type=int, default=100)
+    work.add_argument("--metrics-dir", help="計測レポート (JSON / Prometheus) の出力先")
+
+    status = sub.add_parser("status", help="シャードの状態を表示")
+    status.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+
+    merge = sub.add_parser("merge", help="完了したシャードをストアへまとめる")
+    merge.add_argument("folder", help="data 配下のサブフォルダ名 (例: sample, overflow)")
+    args = parser.parse_args()
+
+    base_dir = Path(__file__).parent / "data" / args.folder
+    if args.command == "init":
+        n = init_queue(base_dir, args.shard_rows)
+        print(f"✅ {n} シャードのキューを作成しました: {queue_dir(base_dir)}")
+    elif args.command == "work":
+        models = args.models.split(",") if args.models else MODELS
+        done = run_worker(base_dir, models, args.lease_seconds, args.max_attempts, args.batch_size)
+        print(f"🏁 {done} シャードを処理しました")
+        if args.metrics_dir:
+            metrics.write_reports(args.metrics_dir, f"work_queue_{os.getpid()}")
+    elif args.command == "status":
+        counts, failed = queue_status(base_dir)
+        print("📋 " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+        for shard_id, error in failed:
+            print(f"  ❌ shard {shard_id}: {error}")
+    elif args.command == "merge":
+        store = merge_shards(base_dir)
+        print(f"📦 ストアへ保存: {store.dir} ({store.num_rows} 行, モデル: {store.model_keys()})")
+
+
+if __name__ == "__main__":
+    main()